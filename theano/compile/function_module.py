@@ -5,10 +5,9 @@ Driver of graph construction, optimization, and linking.
 from __future__ import print_function
 
 import copy
-from six import string_types, iteritems, iterkeys
+from six import string_types, iteritems, iterkeys, itervalues
 from six.moves import xrange
 import six.moves.copyreg as copyreg
-import six.moves.cPickle as pickle
 from itertools import chain
 import time
 import warnings
@@ -23,7 +22,6 @@ import theano.compile.mode
 from theano.compile.io import (
     In, SymbolicInput, SymbolicInputKit, SymbolicOutput)
 from theano.compile.ops import deep_copy_op, view_op
-from theano.gof.graph import is_same_graph
 from theano.gof.op import ops_with_inner_function
 
 import logging
@@ -239,6 +237,12 @@ class Function(object):
     numpy tensor.  C code should raise an error if you pass an object
     of the wrong type.
 
+    Calls with positional arguments only use a call path built when the
+    function is created (see `_make_fast_call`). numpy.ndarray arguments
+    that exactly match the type of their input are then only checked, not
+    filtered. Outputs marked with ``Out(borrow=True)`` are returned
+    without any copy.
+
     Attributes
     ----------
     finder
@@ -526,6 +530,8 @@ class Function(object):
             if node.op in ops_with_inner_function:
                 self.nodes_with_inner_function.append(node.op)
 
+        self._fast_call = self._make_fast_call()
+
     def __contains__(self, item):
         return self.value.__contains__(item)
 
@@ -611,6 +617,10 @@ class Function(object):
         fg_cpy = gof.fg.FunctionGraph([memo[i] for i in maker.fgraph.inputs],
                                       [memo[o] for o in out_vars],
                                       clone=False)
+        # The toposort of the linker must keep the inplace operations after
+        # the other clients of the variables they destroy.
+        if hasattr(maker.fgraph, 'destroyers'):
+            fg_cpy.attach_feature(gof.DestroyHandler())
 
         # Re initialize Outs and swap update and variable in Ins
         # By doing this, we can pass FunctionMaker._check_unused_inputs()
@@ -732,7 +742,326 @@ class Function(object):
         f_cpy.maker.fgraph.name = name
         return f_cpy
 
+    def _copy_aliased_inputs(self):
+        """
+        Copy the inputs that share memory with another input, all but the
+        first one of each group.
+
+        """
+        # Collect aliased inputs among the storage space
+        args_share_memory = []
+        for i in xrange(len(self.input_storage)):
+            i_var = self.maker.inputs[i].variable
+            i_val = self.input_storage[i].storage[0]
+            if hasattr(i_var.type, 'may_share_memory'):
+                is_aliased = False
+                for j in xrange(len(args_share_memory)):
+
+                    group_j = izip(
+                        [self.maker.inputs[k].variable for k
+                         in args_share_memory[j]],
+                        [self.input_storage[k].storage[0] for k
+                         in args_share_memory[j]])
+                    if numpy.any([(var.type is i_var.type and
+                                   var.type.may_share_memory(val, i_val))
+                                  for (var, val) in group_j]):
+
+                        is_aliased = True
+                        args_share_memory[j].append(i)
+                        break
+
+                if not is_aliased:
+                    args_share_memory.append([i])
+
+        # Check for groups of more than one argument that share memory
+        for group in args_share_memory:
+            if len(group) > 1:
+                # copy all but the first
+                for idx in group[1:]:
+                    self.input_storage[idx].storage[0] = copy.copy(
+                        self.input_storage[idx].storage[0])
+
+    def _reraise_fn_error(self):
+        """
+        Re-raise the exception raised by self.fn, with information on the
+        node that raised it. Must be called in the except clause.
+
+        """
+        if hasattr(self.fn, 'position_of_error'):
+            # this is a new vm-provided function or c linker
+            # they need this because the exception manipulation
+            # done by raise_with_op is not implemented in C.
+            if hasattr(self.fn, 'thunks'):
+                # For the CVM
+                gof.link.raise_with_op(
+                    self.fn.nodes[self.fn.position_of_error],
+                    self.fn.thunks[self.fn.position_of_error],
+                    storage_map=self.fn.storage_map)
+            else:
+                # For the c linker We don't have access from
+                # python to all the temps values So for now, we
+                # just don't print the extra shapes/strides info
+                gof.link.raise_with_op(
+                    self.fn.nodes[self.fn.position_of_error],
+                    storage_map=self.fn.storage_map)
+        else:
+            # old-style linkers raise their own exceptions
+            raise
+
+    def _make_fast_call(self):
+        """
+        Build the call path used for calls with positional arguments only.
+
+        Everything that doesn't change between calls is computed here: the
+        storage of the arguments, the inputs to reset and to update and the
+        outputs to free. An argument that is a numpy.ndarray with exactly
+        the dtype, number of dimensions and broadcastable pattern of its
+        TensorType is stored as is. Other values go through `filter`, as
+        in the general path.
+
+        Returns
+        -------
+        A function of the tuple of arguments, whose `map` attribute does
+        several calls at once, or None if this function has inputs that
+        need the general path (SymbolicInputKit).
+
+        """
+        from theano.tensor.type import TensorType
+
+        if any(indices is not None for _, indices, _ in self.indices):
+            return None
+
+        input_storage = self.input_storage
+        # The number of arguments must be in [min_args, max_args], else
+        # the general path raises the error.
+        min_args = 0
+        max_args = len(input_storage)
+        for i, c in enumerate(input_storage):
+            if c.required:
+                min_args = i + 1
+            if c.implicit and max_args == len(input_storage):
+                max_args = i
+        if min_args > max_args:
+            return None
+
+        args_spec = []
+        for c in input_storage:
+            t = c.type
+            if type(t) is TensorType and not t.filter_checks_isfinite:
+                check = (t.numpy_dtype, t.ndim,
+                         [i for i, b in enumerate(t.broadcastable) if b])
+            else:
+                check = None
+            args_spec.append((c, c.storage, check))
+
+        maker = self.maker
+        output_storage = self.output_storage
+        required = [c.storage for c in input_storage if c.required]
+        # self.fn and its flags are read at each call, as they can be
+        # changed after the function is built (e.g. by ProfileMode).
+        gc_outputs = [c.storage for c, v in zip(output_storage,
+                                                maker.fgraph.outputs)
+                      if v.owner is not None]
+        updated = [c for inp, c in zip(maker.expanded_inputs, input_storage)
+                   if inp.update is not None]
+        n_returned = self.n_returned_outputs
+        refeed = [(i, value) for i, (_, refeed, value)
+                  in enumerate(self.defaults) if refeed]
+        # Aliased inputs only need to be copied if one of them can be
+        # destroyed.
+        check_aliasing = any(inp.mutable for inp in maker.inputs)
+        ndarray = numpy.ndarray
+
+        def run(args, profile):
+            # Compute the outputs of one call, without the bookkeeping
+            # that can be done once for several calls.
+            if self.trust_input:
+                for arg, (c, storage, check) in izip(args, args_spec):
+                    storage[0] = arg
+            else:
+                i = 0
+                for arg, (c, storage, check) in izip(args, args_spec):
+                    if check is not None and type(arg) is ndarray:
+                        dtype, ndim, bcast = check
+                        if (arg.dtype is dtype and arg.ndim == ndim and
+                                arg.flags.aligned):
+                            shape = arg.shape
+                            for b in bcast:
+                                if shape[b] != 1:
+                                    break
+                            else:
+                                storage[0] = arg
+                                i += 1
+                                continue
+                    if arg is None:
+                        storage[0] = arg
+                    else:
+                        try:
+                            storage[0] = c.type.filter(
+                                arg, strict=c.strict,
+                                allow_downcast=c.allow_downcast)
+                        except Exception as e:
+                            function_name = "theano function"
+                            if self.name:
+                                function_name += (' with name "' +
+                                                  self.name + '" ')
+                            e.args = ("Bad input argument to " +
+                                      function_name +
+                                      " at index %d(0-based)" % i,) + e.args
+                            raise
+                    i += 1
+                if check_aliasing and getattr(
+                        self, '_check_for_aliased_inputs', True):
+                    self._copy_aliased_inputs()
+
+            fn = self.fn
+            t0_fn = time.time()
+            try:
+                outputs = fn()
+            except Exception:
+                self._reraise_fn_error()
+            dt_fn = time.time() - t0_fn
+            maker.mode.fn_time += dt_fn
+            if profile:
+                profile.vm_call_time += dt_fn
+
+            if outputs is None:
+                outputs = [c.data for c in output_storage]
+            for storage in required:
+                storage[0] = None
+            if getattr(fn, 'allow_gc', False):
+                for storage in gc_outputs:
+                    storage[0] = None
+            if getattr(fn, 'need_update_inputs', True):
+                for c, value in izip(updated, outputs[n_returned:]):
+                    c.data = value
+            for i, value in refeed:
+                if isinstance(value, gof.Container):
+                    value = value.storage[0]
+                self[i] = value
+            return outputs[:n_returned]
+
+        def format_outputs(outputs):
+            if self.return_none:
+                return None
+            elif self.unpack_single and len(outputs) == 1:
+                return outputs[0]
+            elif self.output_keys is not None:
+                return dict(izip(self.output_keys, outputs))
+            return outputs
+
+        def end_calls(t0, profile, n_calls):
+            dt_call = time.time() - t0
+            maker.mode.call_time += dt_call
+            if profile:
+                profile.fct_callcount += n_calls
+                profile.fct_call_time += dt_call
+                if hasattr(self.fn, 'update_profile'):
+                    self.fn.update_profile(profile)
+
+        def fast_call(args):
+            profile = self.profile
+            t0 = time.time()
+            outputs = run(args, profile)
+            end_calls(t0, profile, 1)
+            return format_outputs(outputs)
+
+        def fast_map(args_list):
+            profile = self.profile
+            t0 = time.time()
+            try:
+                return [format_outputs(run(args, profile))
+                        for args in args_list]
+            finally:
+                end_calls(t0, profile, len(args_list))
+
+        fast_call.min_args = min_args
+        fast_call.max_args = max_args
+        fast_call.map = fast_map
+        return fast_call
+
+    def map(self, args_list, stack=False):
+        """
+        Call the function once for each tuple of positional arguments in
+        `args_list`.
+
+        The per-call bookkeeping (timing, profiling, checking which call
+        path to use) is done once for all the calls.
+
+        Parameters
+        ----------
+        args_list
+            A list of tuples of positional arguments.
+        stack
+            If True, the function must compute a batch of independent
+            samples: each input given in `args_list` has one more leading
+            dimension than the arguments of one call, and each output one
+            more leading dimension than the result of one call. The
+            arguments of all the calls are stacked along a new leading
+            axis, the function is called only once, and its outputs are
+            split along their leading axis.
+
+        Returns
+        -------
+        list
+            The result of each call, as returned by __call__.
+
+        """
+        args_list = [tuple(args) for args in args_list]
+        if not args_list:
+            return []
+        if stack:
+            return self._map_stacked(args_list)
+        fast_call = self._fast_call
+        if fast_call is not None and all(
+                fast_call.min_args <= len(args) <= fast_call.max_args
+                for args in args_list):
+            return fast_call.map(args_list)
+        return [self(*args) for args in args_list]
+
+    def _map_stacked(self, args_list):
+        n = len(args_list)
+        n_args = len(args_list[0])
+        if any(len(args) != n_args for args in args_list):
+            raise TypeError("All the calls must have the same number of"
+                            " arguments to be stacked")
+        stacked = []
+        for i, column in enumerate(izip(*args_list)):
+            column = [numpy.asarray(v) for v in column]
+            if any(v.shape != column[0].shape for v in column):
+                raise ValueError("The argument %d(0-based) has different"
+                                 " shapes in the calls, it can't be"
+                                 " stacked" % i)
+            stacked.append(numpy.asarray(column))
+        outputs = self(*stacked)
+
+        def split(out):
+            if getattr(out, 'shape', ())[:1] != (n,):
+                raise ValueError(
+                    "An output of the function has shape %s, it can't be"
+                    " split into %d results" % (
+                        getattr(out, 'shape', None), n))
+            return out
+
+        if outputs is None:
+            return [None] * n
+        elif isinstance(outputs, dict):
+            for out in itervalues(outputs):
+                split(out)
+            return [dict((k, out[j]) for k, out in iteritems(outputs))
+                    for j in xrange(n)]
+        elif isinstance(outputs, list):
+            for out in outputs:
+                split(out)
+            return [[out[j] for out in outputs] for j in xrange(n)]
+        split(outputs)
+        return [outputs[j] for j in xrange(n)]
+
     def __call__(self, *args, **kwargs):
+        fast_call = self._fast_call
+        if (fast_call is not None and not kwargs and
+                fast_call.min_args <= len(args) <= fast_call.max_args):
+            return fast_call(args)
         profile = self.profile
         t0 = time.time()
 
@@ -783,38 +1112,7 @@ class Function(object):
 
         if (not self.trust_input and
                 getattr(self, '_check_for_aliased_inputs', True)):
-            # Collect aliased inputs among the storage space
-            args_share_memory = []
-            for i in xrange(len(self.input_storage)):
-                i_var = self.maker.inputs[i].variable
-                i_val = self.input_storage[i].storage[0]
-                if hasattr(i_var.type, 'may_share_memory'):
-                    is_aliased = False
-                    for j in xrange(len(args_share_memory)):
-
-                        group_j = izip(
-                            [self.maker.inputs[k].variable for k
-                             in args_share_memory[j]],
-                            [self.input_storage[k].storage[0] for k
-                             in args_share_memory[j]])
-                        if numpy.any([(var.type is i_var.type and
-                                       var.type.may_share_memory(val, i_val))
-                                      for (var, val) in group_j]):
-
-                            is_aliased = True
-                            args_share_memory[j].append(i)
-                            break
-
-                    if not is_aliased:
-                        args_share_memory.append([i])
-
-                # Check for groups of more than one argument that share memory
-                for group in args_share_memory:
-                    if len(group) > 1:
-                        # copy all but the first
-                        for idx in group[1:]:
-                            self.input_storage[i].storage[0] = copy.copy(
-                                self.input_storage[i].storage[0])
+            self._copy_aliased_inputs()
 
         # Check if inputs are missing, or if inputs were set more than once, or
         # if we tried to provide inputs that are supposed to be implicit.
@@ -839,26 +1137,7 @@ class Function(object):
         try:
             outputs = self.fn()
         except Exception:
-            if hasattr(self.fn, 'position_of_error'):
-                # this is a new vm-provided function or c linker
-                # they need this because the exception manipulation
-                # done by raise_with_op is not implemented in C.
-                if hasattr(self.fn, 'thunks'):
-                    # For the CVM
-                    gof.link.raise_with_op(
-                        self.fn.nodes[self.fn.position_of_error],
-                        self.fn.thunks[self.fn.position_of_error],
-                        storage_map=self.fn.storage_map)
-                else:
-                    # For the c linker We don't have access from
-                    # python to all the temps values So for now, we
-                    # just don't print the extra shapes/strides info
-                    gof.link.raise_with_op(
-                        self.fn.nodes[self.fn.position_of_error],
-                        storage_map=self.fn.storage_map)
-            else:
-                # old-style linkers raise their own exceptions
-                raise
+            self._reraise_fn_error()
 
         dt_fn = time.time() - t0_fn
         self.maker.mode.fn_time += dt_fn
@@ -1180,176 +1459,54 @@ class FunctionMaker(object):
             raise TypeError("Unknown output type: %s (%s)", type(output),
                             output)
 
-    def optimize_graph_with_cache(self, optimizer, inputs, outputs):
-        # This function is not finished
-        from theano.gof.compilelock import get_lock, release_lock
-        import os.path
-
-        graph_db_file = os.path.join(theano.config.compiledir,
-                                     'optimized_graphs.pkl')
-
-        # the inputs, outputs, and size of the graph to be optimized
-        inputs_new = [inp.variable for inp in inputs]
-        outputs_new = [out.variable for out in outputs]
-        size_new = len(self.fgraph.apply_nodes)
-        get_lock()
-        # Beginning of cache optimizations.
-        # Could be refactored in different functions.
-
-        def load_graph_db():
-            if os.path.isfile(graph_db_file):
-                print('graph_db already exists')
-            else:
-                # create graph_db
-                f = open(graph_db_file, 'wb')
-                print('create new graph_db in %s' % graph_db_file)
-                # file needs to be open and closed for every pickle
-                f.close()
-            # load the graph_db dictionary
-            try:
-                f = open(graph_db_file, 'rb')
-                # Temporary hack to allow
-                # theano.scan_module.tests.test_scan.T_Scan to
-                # finish. Should be changed in definitive version.
-                tmp = theano.config.unpickle_function
-                theano.config.unpickle_function = False
-                graph_db = pickle.load(f)
-
-                # hack end
-                f.close()
-                print('graph_db loaded and it is not empty')
-            except EOFError as e:
-                # the file has nothing in it
-                print(e)
-                print('graph_db loaded and it is empty')
-                graph_db = {}
-            finally:
-                theano.config.unpickle_function = tmp
-
-            return graph_db
-
-        def find_same_graph_in_db(graph_db):
-            # If found_graph_in_db is None, then need to optimize.
-            # Otherwise, return the graph found.
-            found_graph_in_db = None
-            # The sole purpose of this loop is to set 'need_optimize' by
-            # going through graph_db, looking for graph that has the same
-            # computation performed.
-            for graph_old, graph_optimized in iteritems(graph_db):
-                inputs_old = graph_old.inputs
-                outputs_old = graph_old.outputs
-                size_old = len(graph_old.apply_nodes)
-                # Some heuristics to check is the same graphs have
-                # already been optimized before.
-                if len(inputs_new) != len(inputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because input size is different')
-                    continue
-                elif len(outputs_new) != len(outputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because output size is different')
-                    continue
-                elif not all(input_new.type == input_old.type
-                             for input_new, input_old in
-                             zip(inputs_new, inputs_old)):
-                    print('need to optimize, because inputs are of different '
-                          'types')
-                    continue
-                elif not all(output_new.type == output_old.type
-                             for output_new, output_old in
-                             zip(outputs_new, outputs_old)):
-                    print('need to optimize, because outputs are of different '
-                          'types')
-                    continue
-                elif not size_old == size_new:
-                    print('need to optimize, because numbers of nodes in graph'
-                          ' are different')
-                    continue
-                else:
-                    flags = []
-                    for i, (output_new, output_old) in enumerate(
-                            zip(outputs_new, outputs_old)):
-                        print('loop through outputs node for both graphs')
-                        graph_old.variables = set(gof.graph.variables(
-                            graph_old.inputs, graph_old.outputs))
-
-                        # using clone allowed to avoid a lot of errors
-                        # deep copy seemed to had.
-                        f2 = graph_old.clone(check_integrity=False)
-                        t1 = output_new
-                        t2 = f2.outputs[i]
-
-                        # Used to remove "already used by another graph error
-                        def removeAllFgraph(remove):
-                            if hasattr(remove, 'fgraph'):
-                                del remove.fgraph
-                            if hasattr(remove, 'owner'):
-                                if remove.owner is None:
-                                    pass
-                                else:
-                                    if hasattr(remove.owner, 'fgraph'):
-                                        del remove.owner.fgraph
-                                    if hasattr(remove.owner, 'inputs'):
-                                        remove.owner.inputs = [removeAllFgraph(
-                                            i) for i in remove.owner.inputs]
-                                        for o in remove.owner.outputs:
-                                            if hasattr(o, 'fgraph'):
-                                                del o.fgraph
-                            return remove
-
-                        t2 = removeAllFgraph(t2)
-
-                        givens = dict(izip(gof.graph.inputs([t1]),
-                                           gof.graph.inputs([t2])))
-
-                        temp = dict(izip(gof.graph.inputs([t1]),
-                                         gof.graph.inputs([t2])))
-
-                        # hack to remove inconstent entry in givens
-                        # seems to work that but source of inconsistency
-                        # could be worth investigating.
-                        for key, value in iteritems(temp):
-                            if key.type != value.type:
-                                del givens[key]
-
-                        flag = is_same_graph(t1, t2, givens=givens)
-
-                        flags.append(flag)
-
-                    is_same = all(flags)
-                    if is_same:
-                        # found the match
-                        print('found a match, no need to optimize')
-                        found_graph_in_db = graph_optimized
-                        break
-            return found_graph_in_db
-
-        graph_db = load_graph_db()
-        print('loaded graph_db from %s, size=%d' % (graph_db_file,
-                                                    len(graph_db)))
-        found_graph = find_same_graph_in_db(graph_db)
-        if found_graph:
-            self.fgraph = found_graph
-            optimizer_profile = None
-        else:
-            # this is a brand new graph, optimize it, save it to graph_db
-            print('graph not found in graph_db, optimizing the graph')
-            self.fgraph.variables = set(gof.graph.variables(
-                self.fgraph.inputs, self.fgraph.outputs))
-            # check_integrity parameters was added to ignore
-            # "excess cached variables" errors. Works that way
-            # but once again the error couldbe worth
-            # investigating.
-            before_opt = self.fgraph.clone(check_integrity=False)
-            optimizer_profile = optimizer(self.fgraph)
-            graph_db.update({before_opt: self.fgraph})
-            f = open(graph_db_file, 'wb')
-            pickle.dump(graph_db, f, -1)
-            f.close()
-            print('new graph saved into graph_db')
-        release_lock()
+    def optimize_graph_with_cache(self, optimizer, inputs, outputs,
+                                  query=None):
+        """
+        Optimize self.fgraph, or replace it by its optimized version stored
+        in the cache of optimized graphs (see config.cache_optimizations).
+
+        Parameters
+        ----------
+        optimizer
+            The optimizer to apply on a cache miss.
+        inputs
+            The SymbolicInput of the inputs of self.fgraph.
+        outputs
+            The SymbolicOutput of the outputs of self.fgraph.
+        query
+            The Query of the optdb that built `optimizer`, used in the key of
+            the cache. Graphs optimized by other optimizers aren't cached.
+
+        Returns
+        -------
+        The profile of the optimizer, or None if the graph was in the cache.
+
+        """
+        from theano.compile import graph_cache
+
+        t0 = time.time()
+        try:
+            key = graph_cache.graph_key(self.fgraph, inputs, query)
+        except graph_cache.Uncacheable as e:
+            _logger.debug('The graph can not be cached: %s', e)
+            return optimizer(self.fgraph)
+
+        optimized = graph_cache.load(key, self.fgraph)
+        if optimized is not None:
+            self.fgraph = optimized
+            if self.profile:
+                self.profile.optimizer_cache_hits += 1
+                self.profile.optimizer_cache_hit_time += time.time() - t0
+            return None
+
+        optimizer_profile = optimizer(self.fgraph)
+        try:
+            graph_cache.save(key, self.fgraph)
+        except graph_cache.Uncacheable as e:
+            _logger.debug('The optimized graph can not be cached: %s', e)
+        if self.profile:
+            self.profile.optimizer_cache_misses += 1
+            self.profile.optimizer_cache_miss_time += time.time() - t0
         return optimizer_profile
 
     def __init__(self, inputs, outputs,
@@ -1439,7 +1596,11 @@ class FunctionMaker(object):
                 # now optimize the graph
                 if theano.config.cache_optimizations:
                     optimizer_profile = self.optimize_graph_with_cache(
-                        optimizer, inputs, outputs)
+                        optimizer, inputs, outputs,
+                        getattr(mode, '_optimizer', None))
+                    # On a cache hit, self.fgraph is the stored graph.
+                    fgraph = self.fgraph
+                    fgraph.profile = profile
                 else:
                     optimizer_profile = optimizer(fgraph)
 
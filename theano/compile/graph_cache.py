@@ -0,0 +1,238 @@
+"""
+Persistent cache of the optimized FunctionGraphs (config.cache_optimizations).
+
+The optimized graph of a function is stored in the compiledir, under a key
+computed from the structure of the graph before optimization, the query of
+the optimizer, the Theano version and the Theano flags. When the same graph
+is compiled again, in the same process or in another one, the optimized
+graph is loaded instead of running the optimizer.
+
+The structural hash of a variable is computed from the hash of the Op that
+computes it and the hashes of the inputs of that Op, so it doesn't depend
+on the order in which the graph was built nor on the names of the
+variables. The inputs of the function are hashed by position, type and
+mutability.
+
+Each graph is stored in its own file, in sub-directories named after the
+end of the key, so no lock is needed: a file is written under a temporary
+name and renamed.
+
+"""
+from __future__ import print_function
+import logging
+import os
+import shutil
+import tempfile
+
+import six.moves.cPickle as pickle
+
+import theano
+from theano import gof
+from theano.configparser import config, get_config_md5
+from theano.gof.utils import hash_from_code
+
+_logger = logging.getLogger('theano.compile.graph_cache')
+
+# The name of the directory of the cache in the compiledir.
+CACHE_DIRNAME = 'optimized_graphs'
+
+
+class Uncacheable(Exception):
+    """
+    Raised when a graph can't be hashed or stored in the cache.
+
+    """
+
+
+def get_cache_dir():
+    return os.path.join(config.compiledir, CACHE_DIRNAME)
+
+
+def clear():
+    """
+    Remove all the optimized graphs of the cache.
+
+    """
+    shutil.rmtree(get_cache_dir(), ignore_errors=True)
+
+
+def _signature(obj, memo=None):
+    """
+    Return a hash of the pickle of `obj`.
+
+    `memo` is an optional dict used to pickle each object only once.
+
+    """
+    if memo is not None and id(obj) in memo:
+        return memo[id(obj)][1]
+    try:
+        sig = hash_from_code(pickle.dumps(obj, 2))
+    except Exception as e:
+        raise Uncacheable("Can't pickle %s: %s" % (obj, e))
+    if memo is not None:
+        # Keep a reference to obj so that its id isn't reused.
+        memo[id(obj)] = (obj, sig)
+    return sig
+
+
+def _optimizer_signature(optimizer):
+    if isinstance(optimizer, gof.Query):
+        return 'Query(%s, %s, %s, %s, %s)' % (
+            sorted(optimizer.include), sorted(optimizer.require),
+            sorted(optimizer.exclude),
+            sorted((name, _optimizer_signature(query))
+                   for name, query in optimizer.subquery.items()),
+            optimizer.position_cutoff)
+    # The optimizers other than the queries of the optdb can't be
+    # identified between processes.
+    raise Uncacheable("Unknown optimizer %s" % optimizer)
+
+
+def graph_key(fgraph, input_specs, optimizer):
+    """
+    Return the key of the cache of an unoptimized FunctionGraph.
+
+    Parameters
+    ----------
+    fgraph
+        The FunctionGraph before optimization.
+    input_specs
+        The SymbolicInput of the inputs of `fgraph`.
+    optimizer
+        The optimizer, usually a Query (the `_optimizer` of a Mode).
+
+    Raises
+    ------
+    Uncacheable
+        If the graph or the optimizer can't be hashed.
+
+    """
+    sig = {}
+    memo = {}
+
+    def leaf_signature(var):
+        if not isinstance(var, gof.Constant):
+            raise Uncacheable("%s isn't an input of the graph" % var)
+        return hash_from_code('constant %s %s' % (_signature(var.type, memo),
+                                                  _signature(var.data)))
+
+    parts = ['theano %s' % theano.__version__, get_config_md5(),
+             _optimizer_signature(optimizer)]
+    for i, (var, spec) in enumerate(zip(fgraph.inputs, input_specs)):
+        sig[var] = hash_from_code('input %d %s %s' % (
+            i, _signature(var.type, memo), spec.mutable))
+        parts.append(sig[var])
+    for node in fgraph.toposort():
+        for var in node.inputs:
+            if var not in sig:
+                sig[var] = leaf_signature(var)
+        node_sig = hash_from_code('%s(%s)' % (
+            _signature(node.op, memo),
+            ', '.join(sig[var] for var in node.inputs)))
+        for i, out in enumerate(node.outputs):
+            sig[out] = hash_from_code('%s %d %s' % (
+                node_sig, i, _signature(out.type, memo)))
+    for out in fgraph.outputs:
+        if out not in sig:
+            sig[out] = leaf_signature(out)
+        parts.append(sig[out])
+    return hash_from_code('\n'.join(parts))
+
+
+def _cache_file(key):
+    return os.path.join(get_cache_dir(), key[-2:], key + '.pkl')
+
+
+def load(key, fgraph):
+    """
+    Return the optimized graph stored under `key`, or None.
+
+    The shared variables among the inputs of the returned graph use the
+    containers of the inputs of `fgraph`, the unoptimized graph.
+
+    """
+    path = _cache_file(key)
+    if not os.path.exists(path):
+        return None
+
+    def persistent_load(pid):
+        return fgraph.inputs[int(pid)].container
+
+    try:
+        with open(path, 'rb') as f:
+            unpickler = pickle.Unpickler(f)
+            unpickler.persistent_load = persistent_load
+            optimized = unpickler.load()
+    except Exception as e:
+        _logger.warning("Removing the optimized graph %s that can't be"
+                        " loaded: %s", path, e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    if len(optimized.inputs) != len(fgraph.inputs):
+        return None
+    return optimized
+
+
+def save(key, fgraph):
+    """
+    Store the optimized graph `fgraph` under `key`.
+
+    The containers of the shared variables among the inputs aren't stored,
+    they are replaced by the ones of the graph given to `load`. Graphs
+    that use other containers aren't stored.
+
+    Raises
+    ------
+    Uncacheable
+        If the graph can't be pickled.
+
+    """
+    containers = dict((id(var.container), i)
+                      for i, var in enumerate(fgraph.inputs)
+                      if isinstance(getattr(var, 'container', None),
+                                    gof.Container))
+
+    def persistent_id(obj):
+        if isinstance(obj, gof.Container):
+            if id(obj) not in containers:
+                raise Uncacheable("The graph uses the container of a"
+                                  " shared variable that isn't an input")
+            return str(containers[id(obj)])
+        return None
+
+    path = _cache_file(key)
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Another process may have created it.
+            if not os.path.isdir(dirname):
+                raise
+    # The profile of the function must not be stored with the graph.
+    profile = getattr(fgraph, 'profile', None)
+    fgraph.profile = None
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickler = pickle.Pickler(f, 2)
+            pickler.persistent_id = persistent_id
+            pickler.dump(fgraph)
+    except Exception as e:
+        os.remove(tmp_path)
+        if isinstance(e, Uncacheable):
+            raise
+        raise Uncacheable("Can't pickle the optimized graph: %s" % e)
+    finally:
+        fgraph.profile = profile
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # On Windows, the rename fails if another process stored the same
+        # graph first.
+        os.remove(tmp_path)
+        if not os.path.exists(path):
+            raise
@@ -76,6 +76,14 @@ AddConfigVar('profiling.destination',
              StrParam('stderr'),
              in_c_key=False)
 
+AddConfigVar('profiling.flamegraph',
+             """If not empty, file where the time of the nodes of the
+             profiled functions, including the nodes of the inner functions
+             of Scan, is written at exit, in the folded stacks format used
+             by the flame graph tools""",
+             StrParam(''),
+             in_c_key=False)
+
 
 def _atexit_print_fn():
     """
@@ -110,7 +118,10 @@ def _atexit_print_fn():
         for ps in to_sum[1:]:
             for attr in ["compile_time", "fct_call_time", "fct_callcount",
                          "vm_call_time", "optimizer_time", "linker_time",
-                         "validate_time", "import_time"]:
+                         "validate_time", "import_time",
+                         "optimizer_cache_hits", "optimizer_cache_hit_time",
+                         "optimizer_cache_misses",
+                         "optimizer_cache_miss_time"]:
                 setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
 
             # merge dictonary
@@ -133,6 +144,12 @@ def _atexit_print_fn():
                     n_ops_to_print=config.profiling.n_ops,
                     n_apply_to_print=config.profiling.n_apply)
 
+    if config.profiling.flamegraph:
+        # The Scan op profiles are written under their outer node
+        with open(config.profiling.flamegraph, 'w') as f:
+            for ps in to_sum:
+                ps.dump_flamegraph(f)
+
 
 class ProfileStats(object):
 
@@ -213,6 +230,16 @@ class ProfileStats(object):
     import_time = 0.0
     # time spent in importing compiled python module.
 
+    optimizer_cache_hits = 0
+    optimizer_cache_hit_time = 0.0
+    # number of graphs loaded from the cache of optimized graphs, and the
+    # time spent hashing and loading them (config.cache_optimizations).
+
+    optimizer_cache_misses = 0
+    optimizer_cache_miss_time = 0.0
+    # number of graphs not found in that cache, and the time spent hashing,
+    # optimizing and storing them.
+
     line_width = config.profiling.output_line_width
 
     nb_nodes = -1
@@ -351,6 +378,80 @@ class ProfileStats(object):
                 self.fill_node_total_time(node, rval)
         return rval
 
+    def inner_profiles(self):
+        """
+        dict node -> profile of the inner function of the node
+
+        Only the nodes whose op runs a profiled inner function, like Scan,
+        are included.
+
+        """
+        rval = {}
+        for node in self.apply_time:
+            fn = getattr(node.op, 'fn', None)
+            profile = getattr(getattr(fn, 'maker', None), 'profile', None)
+            if isinstance(profile, ProfileStats) and profile is not self:
+                rval[node] = profile
+        return rval
+
+    def node_outputs_size(self, node):
+        """
+        Total size in bytes of the outputs of node, or None if their shapes
+        were not recorded (config.profile_memory).
+
+        """
+        size = None
+        for out in node.outputs:
+            if (out in self.variable_shape and
+                    hasattr(out.type, 'get_size')):
+                size = (size or 0) + out.type.get_size(
+                    self.variable_shape[out])
+        return size
+
+    def folded_stacks(self, stack=None, _seen=None):
+        """
+        list of (stack, time), where stack is a tuple of frame names
+
+        The last frame of a stack is a node of the function and the time
+        is the time spent in that node, minus the time of the nodes of its
+        inner function, which have their own stacks below it.
+
+        """
+        if stack is None:
+            stack = (str(self.message or 'Function'),)
+        if _seen is None:
+            _seen = set()
+        _seen = _seen | set([id(self)])
+        inner = self.inner_profiles()
+        topos = {}
+        rval = []
+        for node, t in iteritems(self.apply_time):
+            if node.fgraph not in topos:
+                topos[node.fgraph] = node.fgraph.toposort()
+            frame = '%d %s' % (topos[node.fgraph].index(node), node)
+            node_stack = stack + (frame,)
+            profile = inner.get(node)
+            if profile is not None and id(profile) not in _seen:
+                inner_stacks = profile.folded_stacks(node_stack, _seen)
+                rval.extend(inner_stacks)
+                t = max(t - sum(profile.apply_time.values()), 0)
+            rval.append((node_stack, t))
+        return rval
+
+    def dump_flamegraph(self, file):
+        """
+        Write the time of the nodes to file in the folded stacks format
+        (one "frame;frame;... microseconds" line per stack) read by the
+        flame graph tools.
+
+        """
+        for node_stack, t in self.folded_stacks():
+            us = int(round(t * 1e6))
+            if us > 0:
+                frames = [f.replace(';', ',').replace('\n', ' ')
+                          for f in node_stack]
+                print('%s %d' % (';'.join(frames), us), file=file)
+
     def op_callcount(self):
         """
         dict op -> total number of thunk calls
@@ -663,6 +764,70 @@ class ProfileStats(object):
                sum(t for f, t, a, nd_id, nb_call in atimes[N:])), file=file)
         print('', file=file)
 
+    def summary_inner_nodes(self, file=sys.stderr, N=None):
+        """
+        Print the time, number of calls and output size of the nodes of the
+        inner functions (of Scan for instance) under the outer node that
+        runs them.
+
+        """
+        inner = self.inner_profiles()
+        if not inner:
+            return
+
+        print('Inner Apply (grouped by the outer Apply that runs them)',
+              file=file)
+        print('------', file=file)
+        print('<% outer time> <apply time> <time per call> <#call> '
+              '<output bytes> <id> <Apply name>', file=file)
+
+        def print_profile(profile, inner, outer_time, indent, seen):
+            topos = {}
+            atimes = []
+            for a, t in iteritems(profile.apply_time):
+                if a.fgraph not in topos:
+                    topos[a.fgraph] = a.fgraph.toposort()
+                atimes.append((t, topos[a.fgraph].index(a), a))
+            atimes.sort(key=lambda x: (-x[0], x[1]))
+            for t, nd_id, a in atimes[:N]:
+                nb_call = profile.apply_callcount.get(a, 0)
+                if nb_call == 0:
+                    continue
+                size = profile.node_outputs_size(a)
+                if size is None:
+                    size = 'unknown'
+                if outer_time > 0:
+                    f = t * 100 / outer_time
+                else:
+                    f = 0
+                line = '%s%5.1f%%  %7.3fs  %8.2es  %6d  %10s  %3d  %s' % (
+                    indent, f, t, t / nb_call, nb_call, size, nd_id, a)
+                print(line[:self.line_width], file=file)
+                sub = inner.get(a)
+                if sub is not None and id(sub) not in seen:
+                    print_profile(sub, sub.inner_profiles(), t,
+                                  indent + '    ', seen | set([id(sub)]))
+            if N is not None and len(atimes) > N:
+                print('%s... (remaining %i inner Apply instances account '
+                      'for %.2fs)' % (indent, len(atimes) - N,
+                                      sum(t for t, _, _ in atimes[N:])),
+                      file=file)
+
+        atimes = sorted(iteritems(inner),
+                        key=lambda x: -self.apply_time[x[0]])
+        for node, profile in atimes[:N]:
+            t = self.apply_time[node]
+            print('  %7.3fs  %6d  %s' % (t, self.apply_callcount[node],
+                                         node), file=file)
+            if isinstance(profile, ScanProfileStats):
+                print('      %d steps, %.3fs in the inner function, '
+                      '%.3fs of overhead' % (
+                          profile.nbsteps, profile.vm_call_time,
+                          max(t - profile.vm_call_time, 0)), file=file)
+            print_profile(profile, profile.inner_profiles(), t, '      ',
+                          set([id(self), id(profile)]))
+        print('', file=file)
+
     def summary_function(self, file):
         print('Function profiling', file=file)
         print('==================', file=file)
@@ -684,6 +849,12 @@ class ProfileStats(object):
               file=file)
         print('       Theano validate time: %es' % self.validate_time,
               file=file)
+        if self.optimizer_cache_hits or self.optimizer_cache_misses:
+            print('       Optimized graph cache: %d hits in %es, %d misses'
+                  ' in %es' % (self.optimizer_cache_hits,
+                               self.optimizer_cache_hit_time,
+                               self.optimizer_cache_misses,
+                               self.optimizer_cache_miss_time), file=file)
         print('    Theano Linker time (includes C, CUDA code '
               'generation/compiling): %es' % self.linker_time, file=file)
         print('       Import time %es' % self.import_time, file=file)
@@ -698,6 +869,10 @@ class ProfileStats(object):
               theano.gradient.grad_time, file=file)
         total_time = time.time() - theano_imported_time
         print('Time since theano import %.3fs' % (total_time))
+        module_cache = theano.gof.cmodule._module_cache
+        if module_cache is not None:
+            print('Time in all refresh of the C module cache %es' %
+                  module_cache.time_spent_in_refresh, file=file)
 
     def summary_memory(self, file, N=None):
         fct_memory = {}  # fgraph->dict(node->[outputs size])
@@ -744,6 +919,9 @@ class ProfileStats(object):
         new_max_node_memory_saved_by_view = 0
         new_max_node_memory_saved_by_inplace = 0
 
+        # statistics with the static memory plan of the vm linkers
+        max_planned_memory_size = 0
+
         # track min peak memory usage
         min_max_peak = 0
         min_peak_time = 0
@@ -1144,6 +1322,17 @@ class ProfileStats(object):
             new_max_node_memory_saved_by_view = \
                 max(new_max_node_memory_saved_by_view, new_running_memory[4])
 
+            # The variables of a group of the storage plan share the same
+            # storage, so they take the memory of the biggest one.
+            storage_plan = getattr(fgraph.profile, 'storage_plan', None)
+            if storage_plan:
+                planned_memory_size = sum(old_running_memory[0])
+                for group in storage_plan:
+                    sizes = [var_mem.get(var, 0) for var in group]
+                    planned_memory_size -= sum(sizes) - max(sizes)
+                max_planned_memory_size = max(max_planned_memory_size,
+                                              planned_memory_size)
+
             # Config: whether print min memory peak
             if config.profiling.min_peak_memory:
                 node_list = fgraph.apply_nodes
@@ -1175,6 +1364,10 @@ class ProfileStats(object):
         print("    GPU: %dKB (%dKB)" % ((int(round(
             new_max_node_memory_size[2] / 1024.)), int(round(
                 max_node_memory_size[2] / 1024.)))), file=file)
+        if max_planned_memory_size:
+            print("    Max with the static memory plan (vm.memory_plan=True,"
+                  " linker=vm_nogc): %dKB" % int(round(
+                      max_planned_memory_size / 1024.)), file=file)
 
         print("---", file=file)
 
@@ -1282,6 +1475,7 @@ class ProfileStats(object):
             self.summary_class(file, n_ops_to_print)
             self.summary_ops(file, n_ops_to_print)
             self.summary_nodes(file, n_apply_to_print)
+            self.summary_inner_nodes(file, n_apply_to_print)
         elif self.fct_callcount > 0:
             print("  No execution time accumulated "
                   "(hint: try config profiling.time_thunks=1)", file=file)
@@ -1612,11 +1806,23 @@ class ScanProfileStats(ProfileStats):
     callcount = 0.0
     nbsteps = 0.0
     call_time = 0.0
+    # Largest number of bytes held by the outputs of the op (the states
+    # stored over all the steps) at the end of a call.
+    output_memory = 0
+    # Largest number of bytes held during a call of the op: its inputs,
+    # its outputs and the largest storage of the scans of its inner
+    # function.
+    peak_memory = 0
 
     def __init__(self, atexit_print=True, name=None, **kwargs):
         super(ScanProfileStats, self).__init__(atexit_print, **kwargs)
         self.name = name
 
+    def __deepcopy__(self, memo):
+        # The scan optimizations deep copy the info of the ops they
+        # replace. The new ops must update the profile given by the user.
+        return self
+
     def summary_function(self, file):
         # RP: everytime we compile a function a ProfileStats is created for
         # that function. This means that everytime a optimization replaces
@@ -1651,3 +1857,9 @@ class ScanProfileStats(ProfileStats):
         print('  Total overhead (computing slices..) %es (%.3f%%)' % (
             self.call_time - self.vm_call_time, val), file=file)
         print('', file=file)
+        print('  Peak memory of the stored outputs %d bytes (%.1fKB)' % (
+            self.output_memory, self.output_memory / 1024.), file=file)
+        print('  Peak memory of the inputs, outputs and inner scans %d bytes'
+              ' (%.1fKB)' % (self.peak_memory, self.peak_memory / 1024.),
+              file=file)
+        print('', file=file)
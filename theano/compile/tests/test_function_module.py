@@ -1,6 +1,8 @@
 import copy
+import shutil
 import six.moves.cPickle as pickle
 import numpy
+import tempfile
 import unittest
 
 
@@ -9,8 +11,10 @@ from six import iteritems
 from theano.compile.io import In, Out
 from theano.compile import function
 from theano.compile import UnusedInputError
+from theano.compile import graph_cache
 from theano.gof import MissingInputError
 from theano.compat import exc_message
+from theano.tests import unittest_tools as utt
 from theano.tests.unittest_tools import SkipTest
 
 from theano import tensor
@@ -378,6 +382,17 @@ class T_function(unittest.TestCase):
             assert cpy(1)[0] == 4
             assert cpy(1)[0] == 4
 
+    def test_copy_inplace(self):
+        # The add is done inplace on exp(x): the copy must still compute the
+        # sum before it.
+        x = T.vector('x')
+        y = T.exp(x)
+        ori = theano.function([x], [y + 1, y.sum()])
+        cpy = ori.copy()
+        v = numpy.arange(4).astype(config.floatX)
+        for r1, r2 in zip(ori(v), cpy(v)):
+            utt.assert_allclose(r1, r2)
+
     def test_shared_state0(self):
         a = T.scalar()  # the a is for 'anonymous' (un-named).
         x, s = T.scalars('xs')
@@ -862,6 +877,148 @@ def test_empty_givens_updates():
     function([theano.In(x)], y, updates={})
 
 
+def test_fast_call():
+    x = T.dvector('x')
+    r = T.drow('r')
+    a = T.dscalar('a')
+    f = function([x, r, In(a, value=2.)], x * a + r.sum())
+    assert f._fast_call is not None
+    xv = numpy.arange(3.)
+    rv = numpy.ones((1, 2))
+    utt.assert_allclose(f(xv, rv), xv * 2 + 2)
+    utt.assert_allclose(f(xv, rv, 3.), xv * 3 + 2)
+    # Values that don't match the type exactly are filtered.
+    utt.assert_allclose(f([0, 1, 2], [[1, 1]]), xv * 2 + 2)
+    for bad in [(xv.astype('complex128'), rv),
+                (xv, numpy.ones((2, 2))),
+                (xv.reshape(3, 1), rv)]:
+        try:
+            f(*bad)
+        except TypeError as e:
+            assert 'Bad input argument' in e.args[0]
+        else:
+            assert False
+    # Missing arguments and keyword arguments use the general path.
+    try:
+        f(xv)
+    except TypeError as e:
+        assert 'Missing required input' in e.args[0]
+    else:
+        assert False
+    utt.assert_allclose(f(xv, r=rv), xv * 2 + 2)
+
+    # The updates are done by the fast path.
+    s = theano.shared(0.)
+    g = function([x], x + s, updates={s: s + 1})
+    assert g._fast_call is not None
+    utt.assert_allclose(g(xv), xv)
+    utt.assert_allclose(g(xv), xv + 1)
+    assert s.get_value() == 2
+
+
+def test_fast_call_profile_mode():
+    # ProfileMode replaces f.fn after the function is built.
+    x = T.dvector('x')
+    s = theano.shared(0.)
+    f = function([x], x * 2 + s, updates={s: s + 1},
+                 mode=theano.compile.ProfileMode())
+    xv = numpy.arange(3.)
+    utt.assert_allclose(f(xv), xv * 2)
+    utt.assert_allclose(f(xv), xv * 2 + 1)
+    assert s.get_value() == 2
+    utt.assert_allclose(f.map([(xv,), (xv,)])[1], xv * 2 + 3)
+
+
+def test_map():
+    x = T.dvector('x')
+    a = T.dscalar('a')
+    s = theano.shared(0.)
+    f = function([x, a], x * a + s, updates={s: s + 1})
+    args = [(numpy.arange(3.), 2.), (numpy.ones(3), 1.), ([1, 2, 3], 2.)]
+    results = f.map(args)
+    assert s.get_value() == 3
+    # The same calls one by one give the same results.
+    s.set_value(0.)
+    expected = [f(*call_args) for call_args in args]
+    assert s.get_value() == 3
+    assert len(results) == 3
+    for r, e in zip(results, expected):
+        utt.assert_allclose(r, e)
+    assert f.map([]) == []
+
+    # Default values
+    g = function([x, In(a, value=2.)], x * a)
+    args = [(numpy.arange(3.),), (numpy.ones(3), 1.), ([1, 2, 3],)]
+    for r, call_args in zip(g.map(args), args):
+        utt.assert_allclose(r, g(*call_args))
+
+    # The function computes a batch of independent samples.
+    m = T.dmatrix('m')
+    g = function([m], [m * 2, m.sum(axis=1)])
+    results = g.map([(numpy.arange(3.),), (numpy.ones(3),)], stack=True)
+    utt.assert_allclose(results[0][0], numpy.arange(3.) * 2)
+    utt.assert_allclose(results[1][0], numpy.ones(3) * 2)
+    utt.assert_allclose(results[0][1], 3)
+    utt.assert_allclose(results[1][1], 3)
+    try:
+        g.map([(numpy.arange(3.),), (numpy.ones(2),)], stack=True)
+    except ValueError:
+        pass
+    else:
+        assert False
+    h = function([m], m.sum())
+    try:
+        h.map([(numpy.arange(3.),), (numpy.ones(3),)], stack=True)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+class T_graph_cache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.orig_get_cache_dir = graph_cache.get_cache_dir
+        graph_cache.get_cache_dir = lambda: self.cache_dir
+
+    def tearDown(self):
+        graph_cache.get_cache_dir = self.orig_get_cache_dir
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def key(self, inputs, outputs):
+        fgraph = gof.FunctionGraph(inputs, outputs)
+        query = theano.compile.get_default_mode()._optimizer
+        return graph_cache.graph_key(fgraph, list(map(In, inputs)), query)
+
+    def test_key(self):
+        x, y = T.vectors('x', 'y')
+        b, a = T.vector(), T.vector()
+        k = self.key([x, y], [T.exp(x) * 2 + y])
+        # Same graph, other names and building order.
+        e = T.exp(a)
+        assert k == self.key([a, b], [e * 2 + b])
+        assert k != self.key([a, b], [T.exp(b) * 2 + a])
+        assert k != self.key([a, b], [e * 3 + b])
+        assert k != self.key([a, b], [e * 2 - b])
+
+    @theano.configparser.change_flags(cache_optimizations=True)
+    def test_reuse(self):
+        w = theano.shared(numpy.ones(3, dtype=config.floatX), 'w')
+        xv = numpy.arange(3).astype(config.floatX)
+        fcts = []
+        for i in range(2):
+            x = T.vector()
+            profile = theano.compile.ProfileStats(atexit_print=False)
+            fcts.append(function([x], T.exp(x) * w + x, profile=profile))
+            assert profile.optimizer_cache_hits == i
+            assert profile.optimizer_cache_misses == 1 - i
+        f1, f2 = fcts
+        utt.assert_allclose(f1(xv), f2(xv))
+        # The loaded graph uses the container of w.
+        w.set_value(numpy.zeros(3, dtype=config.floatX))
+        utt.assert_allclose(f2(xv), xv)
+
+
 if __name__ == '__main__':
 
     if 1:
@@ -104,6 +104,63 @@ class Test_profiling(unittest.TestCase):
             theano.config.profile = config1
             theano.config.profile_memory = config2
 
+    def test_scan_inner_nodes(self):
+        # The nodes of the inner function of scan are reported under the
+        # scan node, in the summary and in the flame graph stacks.
+        if theano.config.mode in ["DebugMode", "DEBUG_MODE", "FAST_COMPILE"]:
+            m = "FAST_RUN"
+        else:
+            m = None
+
+        x = T.matrix('x')
+        w = T.matrix('w')
+        h0 = T.vector('h0')
+        scan_profile = theano.compile.profiling.ScanProfileStats(
+            atexit_print=False, name='rnn')
+        h, _ = theano.scan(lambda x_t, h_tm1: T.tanh(T.dot(h_tm1, w) + x_t),
+                           sequences=[x], outputs_info=[h0],
+                           profile=scan_profile)
+        p = theano.ProfileStats(False, message="test_scan_inner_nodes")
+        f = theano.function([x, w, h0], h[-1], profile=p,
+                            name="test_scan_inner_nodes", mode=m)
+        floatX = theano.config.floatX
+        f(numpy.ones((50, 30), dtype=floatX),
+          numpy.ones((30, 30), dtype=floatX) * .01,
+          numpy.zeros(30, dtype=floatX))
+
+        # The optimizations copy the profile given to scan, so use the one
+        # of the compiled scan.
+        inner = p.inner_profiles()
+        scan_node, = inner.keys()
+        scan_profile = scan_node.op.fn.maker.profile
+        assert list(inner.values()) == [scan_profile]
+        assert isinstance(scan_profile,
+                          theano.compile.profiling.ScanProfileStats)
+        assert scan_profile.name == 'rnn'
+        assert scan_profile.apply_time
+
+        buf = StringIO()
+        p.summary(buf)
+        the_string = buf.getvalue()
+        assert "Inner Apply" in the_string
+        assert "50 steps" in the_string
+
+        stacks = p.folded_stacks()
+        inner_stacks = [s for s, t in stacks if len(s) == 3]
+        assert len(inner_stacks) == len(scan_profile.apply_time)
+        for s in inner_stacks:
+            assert s[0] == "test_scan_inner_nodes"
+            assert s[1].endswith(str(scan_node))
+        assert abs(sum(t for s, t in stacks) -
+                   sum(p.apply_time.values())) < 1e-6
+
+        buf = StringIO()
+        p.dump_flamegraph(buf)
+        for line in buf.getvalue().splitlines():
+            frames, us = line.rsplit(' ', 1)
+            assert int(us) > 0
+            assert len(frames.split(';')) in (2, 3)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -306,6 +306,14 @@ AddConfigVar(
     BoolParam(True),
     in_c_key=False)
 
+AddConfigVar(
+    'tensor.pairwise_sum',
+    ("If True, Sum uses a blocked pairwise summation in its C code. Then "
+     "float32 and complex64 inputs are accumulated in their own dtype "
+     "instead of being upcasted, unless acc_dtype is given."),
+    BoolParam(False),
+    in_c_key=False)
+
 AddConfigVar(
     'gpu.local_elemwise_fusion',
     ("Enable or not in fast_run mode(fast_run optimization) the gpu "
@@ -600,9 +608,9 @@ AddConfigVar('openmp',
              )
 
 AddConfigVar('openmp_elemwise_minsize',
-             "If OpenMP is enabled, this is the minimum size of vectors "
-             "for which the openmp parallelization is enabled "
-             "in element wise ops.",
+             "If OpenMP is enabled, this is the minimum number of "
+             "elements for which the openmp parallelization is enabled "
+             "in element wise ops and reductions.",
              IntParam(200000),
              in_c_key=False,
              )
@@ -617,9 +625,7 @@ AddConfigVar(
 
 AddConfigVar(
     'cache_optimizations',
-    "WARNING: work in progress, does not work yet. "
-    "Specify if the optimization cache should be used. This cache will "
-    "any optimized graph and its optimization. Actually slow downs a lot "
-    "the first optimization, and could possibly still contains some bugs. "
-    "Use at your own risks.",
+    "If True, store the optimized graph of each compiled function in the "
+    "compiledir and load it instead of optimizing the same graph again, "
+    "in the same process or in another one.",
     BoolParam(False))
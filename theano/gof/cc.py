@@ -57,6 +57,60 @@ def get_module_cache(init_args=None):
     return cmodule.get_module_cache(config.compiledir, init_args=init_args)
 
 
+def precompile_nodes(nodes, no_recycling=(), n_workers=None):
+    """
+    Compile in parallel the C modules needed by the thunks of `nodes`.
+
+    The compiled modules are added to the module cache, so the following
+    calls to `make_thunk` on those nodes only load them. Nodes that do not
+    build their thunk through `Op.make_c_thunk`, or whose Op has no C code,
+    are skipped.
+
+    Parameters
+    ----------
+    nodes
+        List of Apply nodes.
+    no_recycling
+        The same list that will be given to `make_thunk`.
+    n_workers : int
+        Number of parallel compilations. Defaults to
+        config.cmodule.compilation_workers.
+
+    """
+    Op = theano.gof.op.Op
+    OpenMPOp = theano.gof.op.OpenMPOp
+    keys_and_lnks = []
+    for node in nodes:
+        op = node.op
+        if (not getattr(op, '_op_use_c_code', False) or
+                type(op).make_thunk not in (Op.make_thunk,
+                                            OpenMPOp.make_thunk)):
+            continue
+        if not getattr(op, '_f16_ok', False):
+            if any(getattr(v.type, 'dtype', '') == 'float16'
+                   for v in node.inputs + node.outputs):
+                continue
+        if isinstance(op, OpenMPOp):
+            # This can change the generated code.
+            op.update_self_openmp()
+        e = theano.gof.fg.FunctionGraph(node.inputs, node.outputs)
+        e_no_recycling = [new_o
+                          for (new_o, old_o) in zip(e.outputs, node.outputs)
+                          if old_o in no_recycling]
+        cl = CLinker().accept(e, no_recycling=e_no_recycling)
+        try:
+            key = cl.cmodule_key()
+            # Generate the code now, so that Ops without C code are detected
+            # before the compilation starts.
+            cl.get_src_code()
+        except (KeyError, NotImplementedError, utils.MethodNotDefined):
+            continue
+        keys_and_lnks.append((key, cl))
+    if keys_and_lnks:
+        get_module_cache().modules_from_keys(keys_and_lnks,
+                                             n_workers=n_workers)
+
+
 _persistent_module_cache = None
 
 
@@ -1419,11 +1473,14 @@ class CLinker(link.Linker):
         mod = self.get_dynamic_module()
         return mod.code()
 
-    def compile_cmodule(self, location=None):
+    def compile_cmodule(self, location=None, py_module=True):
         """
         This compiles the source code for this linker and returns a
         loaded module.
 
+        If `py_module` is False, the module is compiled in `location` but is
+        not loaded, and None is returned.
+
         """
         if location is None:
             location = cmodule.dlimport_workdir(config.compiledir)
@@ -1445,9 +1502,10 @@ class CLinker(link.Linker):
                 preargs.remove('-DREPLACE_WITH_AMDLIBM')
             if 'amdlibm' in libs:
                 libs.remove('amdlibm')
-        # We want to compute the code without the lock
         src_code = mod.code()
-        get_lock()
+        # We do not take the global compilation lock here: `location` is
+        # private to this compilation, and the module cache takes the
+        # per-module lock before calling us.
         try:
             _logger.debug("LOCATION %s", str(location))
             module = c_compiler.compile_str(
@@ -1457,12 +1515,11 @@ class CLinker(link.Linker):
                 include_dirs=self.header_dirs(),
                 lib_dirs=self.lib_dirs(),
                 libs=libs,
-                preargs=preargs)
+                preargs=preargs,
+                py_module=py_module)
         except Exception as e:
             e.args += (str(self.fgraph),)
             raise
-        finally:
-            release_lock()
         return module
 
     def get_dynamic_module(self):
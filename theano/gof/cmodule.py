@@ -17,12 +17,14 @@ import tempfile
 import time
 import platform
 import distutils.sysconfig
+from multiprocessing.pool import ThreadPool
 
 import numpy.distutils  # TODO: TensorType should handle this
 
 import theano
 from theano.compat import PY3, decode, decode_iter
-from six import b, BytesIO, StringIO, string_types, iteritems
+from six import (b, BytesIO, StringIO, string_types, iteritems,
+                 itervalues)
 from theano.gof.utils import flatten
 from theano.configparser import config
 from theano.gof.utils import hash_from_code
@@ -33,7 +35,7 @@ from theano.misc.windows import (subprocess_Popen,
 from theano.gof import compilelock
 from theano.gof.compiledir import gcc_version_str, local_bitwidth
 
-from theano.configparser import AddConfigVar, BoolParam
+from theano.configparser import AddConfigVar, BoolParam, ConfigParam, IntParam
 
 importlib = None
 try:
@@ -71,10 +73,59 @@ AddConfigVar('cmodule.preload_cache',
              BoolParam(False, allow_override=False),
              in_c_key=False)
 
+
+def parse_byte_size(size):
+    """
+    Convert a size like '512', '300M' or '2G' to a number of bytes.
+
+    The suffixes K, M and G are powers of 1024.
+
+    """
+    size = str(size).strip().upper()
+    if size.endswith('B'):
+        size = size[:-1]
+    factor = 1
+    for i, suffix in enumerate('KMG'):
+        if size.endswith(suffix):
+            size = size[:-1]
+            factor = 1024 ** (i + 1)
+            break
+    value = int(float(size) * factor)
+    if value < 0:
+        raise ValueError('A size must be positive', size)
+    return value
+
+
+AddConfigVar('cmodule.max_cache_size',
+             "Maximum size of the compilation cache, in bytes. The suffixes "
+             "K, M and G can be used. When it is exceeded, the least "
+             "recently used modules are deleted at exit. The size is checked "
+             "against the sizes recorded in the cache index, which only "
+             "counts the versioned modules. 0 means no limit.",
+             ConfigParam('0', parse_byte_size),
+             in_c_key=False)
+
+AddConfigVar('cmodule.max_cache_entries',
+             "Maximum number of modules in the compilation cache. When it is "
+             "exceeded, the least recently used modules are deleted at exit. "
+             "0 means no limit.",
+             IntParam(0, lambda i: i >= 0),
+             in_c_key=False)
+
+AddConfigVar('cmodule.compilation_workers',
+             "Number of C modules that can be compiled at the same time "
+             "when a function is compiled. If 1, the modules are compiled "
+             "one after the other.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
 _logger = logging.getLogger("theano.gof.cmodule")
 
 METH_VARARGS = "METH_VARARGS"
 METH_NOARGS = "METH_NOARGS"
+# Format and version of the ModuleCache index file.
+INDEX_FORMAT = "theano_module_cache_index"
+INDEX_VERSION = 4
 # global variable that represent the total time spent in importing module.
 import_time = 0
 
@@ -352,6 +403,16 @@ def last_access_time(path):
     return os.stat(path)[stat.ST_ATIME]
 
 
+def dir_size(dirname, files=None):
+    """
+    Return the total size in bytes of the files of a cache directory.
+
+    """
+    if files is None:
+        files = os.listdir(dirname)
+    return sum(os.path.getsize(os.path.join(dirname, f)) for f in files)
+
+
 def module_name_from_dir(dirname, err=True, files=None):
     """
     Scan the contents of a cache directory and return full path of the
@@ -677,6 +738,14 @@ class ModuleCache(object):
         self.check_for_broken_eq = check_for_broken_eq
         self.loaded_key_pkl = set()
         self.time_spent_in_check_key = 0
+        self.time_spent_in_refresh = 0
+        self._indexed_dirs = {}
+        self._indexed_stamps = {}
+        self._indexed_key_hashes = {}
+        self._index_sizes = {}
+        self._key_hashes = {}
+        self._index_generation = None
+        self._index_offset = 0
 
         if do_refresh:
             self.refresh()
@@ -689,6 +758,20 @@ class ModuleCache(object):
 
     """
 
+    index_name = 'index.txt'
+    """
+    Name of the cache index file, in the cache directory.
+
+    Its first line is a header with the format version, a random generation
+    id that changes each time the index is rebuilt, and the time of the
+    rebuild. Then each line maps the hash of a versioned module to its cache
+    directory, followed by the stamp of the entry (see `_index_stamp`) and
+    the hashes of some of its keys (see `_key_hash`). New modules and keys
+    are appended to it while holding the compilation lock. A module can
+    appear on several lines, the last one has its current stamp.
+
+    """
+
     def _get_module(self, name):
         """
         Fetch a compiled module from the loaded cache or the disk.
@@ -704,9 +787,10 @@ class ModuleCache(object):
         return self.module_from_name[name]
 
     def refresh(self, age_thresh_use=None, delete_if_problem=False,
-                cleanup=True):
+                cleanup=True, full_scan=False):
         """
-        Update cache data by walking the cache directory structure.
+        Update cache data from the cache index, or by walking the cache
+        directory structure.
 
         Load key.pkl files that have not been loaded yet.
         Remove entries which have been removed from the filesystem.
@@ -724,6 +808,12 @@ class ModuleCache(object):
             - Duplicated modules, regardless of their age.
         cleanup : bool
             Do a cleanup of the cache removing expired and broken modules.
+        full_scan : bool
+            If False and the index of the cache directory is valid, only the
+            new entries of the index are read, and their key.pkl files are
+            loaded when they are first needed. Otherwise, all the cache
+            directories are visited, and the index is rebuilt. The returned
+            list is only complete when doing a full scan.
 
         Returns
         -------
@@ -747,200 +837,40 @@ class ModuleCache(object):
             if cleanup:
                 to_delete_empty.append((args, kwargs))
 
-        # add entries that are not in the entry_from_key dictionary
         time_now = time.time()
-        # Go through directories in alphabetical order to ensure consistent
-        # behavior.
-        subdirs = sorted(os.listdir(self.dirname))
-        files, root = None, None  # To make sure the "del" below works
-        for subdirs_elem in subdirs:
-            # Never clean/remove lock_dir
-            if subdirs_elem == 'lock_dir':
-                continue
-            root = os.path.join(self.dirname, subdirs_elem)
-            key_pkl = os.path.join(root, 'key.pkl')
-            if key_pkl in self.loaded_key_pkl:
-                continue
-            if not os.path.isdir(root):
-                continue
-            files = os.listdir(root)
-            if not files:
-                rmtree_empty(root, ignore_nocleanup=True,
-                             msg="empty dir")
-                continue
-            if 'delete.me' in files:
-                rmtree(root, ignore_nocleanup=True,
-                       msg="delete.me found in dir")
-                continue
-            elif 'key.pkl' in files:
-                try:
-                    entry = module_name_from_dir(root, files=files)
-                except ValueError:  # there is a key but no dll!
-                    if not root.startswith("/tmp"):
-                        # Under /tmp, file are removed periodically by the
-                        # os. So it is normal that this happens from time
-                        # to time.
-                        _logger.warning("ModuleCache.refresh() Found key "
-                                        "without dll in cache, deleting it. %s",
-                                        key_pkl)
-                    rmtree(root, ignore_nocleanup=True,
-                           msg="missing module file", level=logging.INFO)
+        index_ok = self._read_index()
+        if full_scan or not index_ok:
+            # Add entries that are not in the entry_from_key dictionary.
+            old_index = self._indexed_dirs
+            old_stamps = self._indexed_stamps
+            self._indexed_dirs = {}
+            self._indexed_stamps = {}
+            # Go through directories in alphabetical order to ensure
+            # consistent behavior.
+            for subdirs_elem in sorted(os.listdir(self.dirname)):
+                # Never clean/remove lock_dir, the per-module locks and the
+                # cache of optimized graphs
+                if subdirs_elem in ('lock_dir', 'module_locks',
+                                    'optimized_graphs'):
                     continue
-                if (time_now - last_access_time(entry)) < age_thresh_use:
-                    _logger.debug('refresh adding %s', key_pkl)
-
-                    def unpickle_failure():
-                        _logger.info("ModuleCache.refresh() Failed to "
-                                     "unpickle cache file %s", key_pkl)
-
-                    try:
-                        with open(key_pkl, 'rb') as f:
-                            key_data = pickle.load(f)
-                    except EOFError:
-                        # Happened once... not sure why (would be worth
-                        # investigating if it ever happens again).
-                        unpickle_failure()
-                        rmtree(root, ignore_nocleanup=True,
-                               msg='broken cache directory [EOF]',
-                               level=logging.WARNING)
-                        continue
-                    except ValueError:
-                        # This can happen when we have bad config value
-                        # in the cuda.nvcc_compiler.py file.
-                        # We should not hide it here, as this will cause
-                        # an unrelated error to appear.
-                        raise
-                    except Exception:
-                        unpickle_failure()
-                        if delete_if_problem:
-                            rmtree(root, ignore_nocleanup=True,
-                                   msg='broken cache directory',
-                                   level=logging.INFO)
-                        else:
-                            # This exception is often triggered by keys
-                            # that contain references to classes that have
-                            # not yet been imported (e.g. when running two
-                            # different Theano-based scripts). They are not
-                            # necessarily broken, but we cannot load them
-                            # now. They will be loaded later if needed.
-                            pass
-                        continue
-
-                    if not isinstance(key_data, KeyData):
-                        # This is some old cache data, that does not fit
-                        # the new cache format. It would be possible to
-                        # update it, but it is not entirely safe since we
-                        # do not know the config options that were used.
-                        # As a result, we delete it instead (which is also
-                        # simpler to implement).
-                        rmtree(root, ignore_nocleanup=True,
-                               msg=(
-                                   'invalid cache entry format -- this '
-                                   'should not happen unless your cache '
-                                   'was really old'),
-                               level=logging.WARN)
-                        continue
-
-                    # Check the path to the module stored in the KeyData
-                    # object matches the path to `entry`. There may be
-                    # a mismatch e.g. due to symlinks, or some directory
-                    # being renamed since last time cache was created.
-                    kd_entry = key_data.get_entry()
-                    if kd_entry != entry:
-                        if is_same_entry(entry, kd_entry):
-                            # Update KeyData object. Note that we also need
-                            # to update the key_pkl field, because it is
-                            # likely to be incorrect if the entry itself
-                            # was wrong.
-                            key_data.entry = entry
-                            key_data.key_pkl = key_pkl
-                        else:
-                            # This is suspicious. Better get rid of it.
-                            rmtree(root, ignore_nocleanup=True,
-                                   msg='module file path mismatch',
-                                   level=logging.INFO)
-                            continue
-
-                    # Find unversioned keys from other processes.
-                    # TODO: check if this can happen at all
-                    to_del = [key for key in key_data.keys if not key[0]]
-                    if to_del:
-                        _logger.warning(
-                            "ModuleCache.refresh() Found unversioned "
-                            "key in cache, removing it. %s", key_pkl)
-                        # Since the version is in the module hash, all
-                        # keys should be unversioned.
-                        if len(to_del) != len(key_data.keys):
-                            _logger.warning(
-                                'Found a mix of unversioned and '
-                                'versioned keys for the same '
-                                'module %s', key_pkl)
-                        rmtree(root, ignore_nocleanup=True,
-                               msg="unversioned key(s) in cache",
-                               level=logging.INFO)
-                        continue
-
-                    mod_hash = key_data.module_hash
-                    if mod_hash in self.module_hash_to_key_data:
-                        # This may happen when two processes running
-                        # simultaneously compiled the same module, one
-                        # after the other. We delete one once it is old
-                        # enough (to be confident there is no other process
-                        # using it), or if `delete_if_problem` is True.
-                        # Note that it is important to walk through
-                        # directories in alphabetical order so as to make
-                        # sure all new processes only use the first one.
-                        if cleanup:
-                            age = time.time() - last_access_time(entry)
-                            if delete_if_problem or age > self.age_thresh_del:
-                                rmtree(root, ignore_nocleanup=True,
-                                       msg='duplicated module',
-                                       level=logging.DEBUG)
-                            else:
-                                _logger.debug('Found duplicated module not '
-                                              'old enough yet to be deleted '
-                                              '(age: %s): %s',
-                                              age, entry)
-                        continue
-
-                    # Remember the map from a module's hash to the KeyData
-                    # object associated with it.
-                    self.module_hash_to_key_data[mod_hash] = key_data
-
-                    for key in key_data.keys:
-                        if key not in self.entry_from_key:
-                            self.entry_from_key[key] = entry
-                            # Assert that we have not already got this
-                            # entry somehow.
-                            assert entry not in self.module_from_name
-                            # Store safe part of versioned keys.
-                            if key[0]:
-                                self.similar_keys.setdefault(
-                                    get_safe_part(key),
-                                    []).append(key)
-                        else:
-                            dir1 = os.path.dirname(self.entry_from_key[key])
-                            dir2 = os.path.dirname(entry)
-                            _logger.warning(
-                                "The same cache key is associated to "
-                                "different modules (%s and %s). This "
-                                "is not supposed to happen! You may "
-                                "need to manually delete your cache "
-                                "directory to fix this.",
-                                dir1, dir2)
-                    # Clean up the name space to prevent bug.
-                    if key_data.keys:
-                        del key
-                    self.loaded_key_pkl.add(key_pkl)
-                else:
+                root = os.path.join(self.dirname, subdirs_elem)
+                entry = self._refresh_dir(
+                    root, age_thresh_use, delete_if_problem, cleanup,
+                    time_now, rmtree, rmtree_empty)
+                if entry is not None:
                     too_old_to_use.append(entry)
-
-            # If the compilation failed, no key.pkl is in that
-            # directory, but a mod.* should be there.
-            # We do nothing here.
-
-        # Clean up the name space to prevent bug.
-        del root, files, subdirs
+            # Keep in the index the modules we could not load now (e.g.
+            # because their key refers to Ops that are not imported).
+            loaded_dirs = set(os.path.dirname(key_data.key_pkl) for key_data
+                              in itervalues(self.module_hash_to_key_data))
+            for module_hash, root in iteritems(old_index):
+                if (module_hash not in self.module_hash_to_key_data and
+                        root not in loaded_dirs and
+                        os.path.exists(os.path.join(root, 'key.pkl'))):
+                    self._indexed_dirs[module_hash] = root
+                    self._indexed_stamps[module_hash] = old_stamps[
+                        module_hash]
+            self._write_index()
 
         # Remove entries that are not in the filesystem.
         items_copy = list(self.module_hash_to_key_data.items())
@@ -994,11 +924,440 @@ class ModuleCache(object):
                     if not files:
                         _rmtree(*a, **kw)
 
-        _logger.debug('Time needed to refresh cache: %s',
-                      (time.time() - start_time))
+        refresh_time = time.time() - start_time
+        self.time_spent_in_refresh += refresh_time
+        _logger.debug('Time needed to refresh cache: %s', refresh_time)
 
         return too_old_to_use
 
+    def _refresh_dir(self, root, age_thresh_use, delete_if_problem, cleanup,
+                     time_now, rmtree, rmtree_empty):
+        """
+        Load the key.pkl file of the cache directory `root`, if needed.
+
+        This is the work done by `refresh` for each cache directory. Broken
+        directories are given to the `rmtree` and `rmtree_empty` functions.
+
+        Returns
+        -------
+        str or None
+            The module file if it is older than `age_thresh_use`, else None.
+
+        """
+        key_pkl = os.path.join(root, 'key.pkl')
+        if key_pkl in self.loaded_key_pkl:
+            return
+        if not os.path.isdir(root):
+            return
+        files = os.listdir(root)
+        if not files:
+            rmtree_empty(root, ignore_nocleanup=True,
+                         msg="empty dir")
+            return
+        if 'delete.me' in files:
+            rmtree(root, ignore_nocleanup=True,
+                   msg="delete.me found in dir")
+            return
+        elif 'key.pkl' in files:
+            try:
+                entry = module_name_from_dir(root, files=files)
+            except ValueError:  # there is a key but no dll!
+                if not root.startswith("/tmp"):
+                    # Under /tmp, file are removed periodically by the
+                    # os. So it is normal that this happens from time
+                    # to time.
+                    _logger.warning("ModuleCache.refresh() Found key "
+                                    "without dll in cache, deleting it. %s",
+                                    key_pkl)
+                rmtree(root, ignore_nocleanup=True,
+                       msg="missing module file", level=logging.INFO)
+                return
+            if (time_now - last_access_time(entry)) < age_thresh_use:
+                _logger.debug('refresh adding %s', key_pkl)
+
+                def unpickle_failure():
+                    _logger.info("ModuleCache.refresh() Failed to "
+                                 "unpickle cache file %s", key_pkl)
+
+                try:
+                    with open(key_pkl, 'rb') as f:
+                        key_data = pickle.load(f)
+                except EOFError:
+                    # Happened once... not sure why (would be worth
+                    # investigating if it ever happens again).
+                    unpickle_failure()
+                    rmtree(root, ignore_nocleanup=True,
+                           msg='broken cache directory [EOF]',
+                           level=logging.WARNING)
+                    return
+                except ValueError:
+                    # This can happen when we have bad config value
+                    # in the cuda.nvcc_compiler.py file.
+                    # We should not hide it here, as this will cause
+                    # an unrelated error to appear.
+                    raise
+                except Exception:
+                    unpickle_failure()
+                    if delete_if_problem:
+                        rmtree(root, ignore_nocleanup=True,
+                               msg='broken cache directory',
+                               level=logging.INFO)
+                    else:
+                        # This exception is often triggered by keys
+                        # that contain references to classes that have
+                        # not yet been imported (e.g. when running two
+                        # different Theano-based scripts). They are not
+                        # necessarily broken, but we cannot load them
+                        # now. They will be loaded later if needed.
+                        pass
+                    return
+
+                if not isinstance(key_data, KeyData):
+                    # This is some old cache data, that does not fit
+                    # the new cache format. It would be possible to
+                    # update it, but it is not entirely safe since we
+                    # do not know the config options that were used.
+                    # As a result, we delete it instead (which is also
+                    # simpler to implement).
+                    rmtree(root, ignore_nocleanup=True,
+                           msg=(
+                               'invalid cache entry format -- this '
+                               'should not happen unless your cache '
+                               'was really old'),
+                           level=logging.WARN)
+                    return
+
+                # Check the path to the module stored in the KeyData
+                # object matches the path to `entry`. There may be
+                # a mismatch e.g. due to symlinks, or some directory
+                # being renamed since last time cache was created.
+                kd_entry = key_data.get_entry()
+                if kd_entry != entry:
+                    if is_same_entry(entry, kd_entry):
+                        # Update KeyData object. Note that we also need
+                        # to update the key_pkl field, because it is
+                        # likely to be incorrect if the entry itself
+                        # was wrong.
+                        key_data.entry = entry
+                        key_data.key_pkl = key_pkl
+                    else:
+                        # This is suspicious. Better get rid of it.
+                        rmtree(root, ignore_nocleanup=True,
+                               msg='module file path mismatch',
+                               level=logging.INFO)
+                        return
+
+                # Find unversioned keys from other processes.
+                # TODO: check if this can happen at all
+                to_del = [key for key in key_data.keys if not key[0]]
+                if to_del:
+                    _logger.warning(
+                        "ModuleCache.refresh() Found unversioned "
+                        "key in cache, removing it. %s", key_pkl)
+                    # Since the version is in the module hash, all
+                    # keys should be unversioned.
+                    if len(to_del) != len(key_data.keys):
+                        _logger.warning(
+                            'Found a mix of unversioned and '
+                            'versioned keys for the same '
+                            'module %s', key_pkl)
+                    rmtree(root, ignore_nocleanup=True,
+                           msg="unversioned key(s) in cache",
+                           level=logging.INFO)
+                    return
+
+                mod_hash = key_data.module_hash
+                if mod_hash in self.module_hash_to_key_data:
+                    # This may happen when two processes running
+                    # simultaneously compiled the same module, one
+                    # after the other. We delete one once it is old
+                    # enough (to be confident there is no other process
+                    # using it), or if `delete_if_problem` is True.
+                    # Note that it is important to walk through
+                    # directories in alphabetical order so as to make
+                    # sure all new processes only use the first one.
+                    if cleanup:
+                        age = time.time() - last_access_time(entry)
+                        if delete_if_problem or age > self.age_thresh_del:
+                            rmtree(root, ignore_nocleanup=True,
+                                   msg='duplicated module',
+                                   level=logging.DEBUG)
+                        else:
+                            _logger.debug('Found duplicated module not '
+                                          'old enough yet to be deleted '
+                                          '(age: %s): %s',
+                                          age, entry)
+                    return
+
+                # Remember the map from a module's hash to the KeyData
+                # object associated with it.
+                self.module_hash_to_key_data[mod_hash] = key_data
+
+                for key in key_data.keys:
+                    if key not in self.entry_from_key:
+                        self.entry_from_key[key] = entry
+                        # Assert that we have not already got this
+                        # entry somehow.
+                        assert entry not in self.module_from_name
+                        # Store safe part of versioned keys.
+                        if key[0]:
+                            self.similar_keys.setdefault(
+                                get_safe_part(key),
+                                []).append(key)
+                    else:
+                        dir1 = os.path.dirname(self.entry_from_key[key])
+                        dir2 = os.path.dirname(entry)
+                        _logger.warning(
+                            "The same cache key is associated to "
+                            "different modules (%s and %s). This "
+                            "is not supposed to happen! You may "
+                            "need to manually delete your cache "
+                            "directory to fix this.",
+                            dir1, dir2)
+                # Clean up the name space to prevent bug.
+                if key_data.keys:
+                    del key
+                self.loaded_key_pkl.add(key_pkl)
+            else:
+                return entry
+
+        # If the compilation failed, no key.pkl is in that
+        # directory, but a mod.* should be there.
+        # We do nothing here.
+
+    def _read_index(self):
+        """
+        Read the entries added to the cache index since the last call.
+
+        Returns
+        -------
+        bool
+            False if the index is missing or invalid.
+
+        """
+        index_file = os.path.join(self.dirname, self.index_name)
+        try:
+            with open(index_file, 'rb') as f:
+                header = f.readline()
+                fields = decode(header).split()
+                if (len(fields) != 4 or fields[0] != INDEX_FORMAT or
+                        fields[1] != str(INDEX_VERSION) or
+                        not header.endswith(b('\n'))):
+                    return False
+                generation = fields[2]
+                if generation != self._index_generation:
+                    # The index was rebuilt, read it from the start.
+                    self._index_generation = generation
+                    self._index_offset = len(header)
+                    self._index_sizes = {}
+                f.seek(self._index_offset)
+                data = f.read()
+        except (IOError, OSError, ValueError):
+            return False
+        # The last line may be in the process of being written.
+        end = data.rfind(b('\n')) + 1
+        self._index_offset += end
+        for line in decode(data[:end]).split('\n'):
+            fields = line.split()
+            if len(fields) < 5 or not fields[4].isdigit():
+                # Ignore corrupted lines.
+                continue
+            module_hash = fields[0]
+            self._index_sizes[module_hash] = int(fields[4])
+            key_hashes = self._key_hashes.setdefault(module_hash, set())
+            for key_hash in fields[5:]:
+                key_hashes.add(key_hash)
+                self._indexed_key_hashes[key_hash] = module_hash
+            if module_hash not in self.module_hash_to_key_data:
+                self._indexed_dirs[module_hash] = os.path.join(self.dirname,
+                                                               fields[1])
+                self._indexed_stamps[module_hash] = tuple(fields[2:4])
+        return True
+
+    def _write_index(self):
+        """
+        Rebuild the cache index from the loaded and indexed modules.
+
+        """
+        entries = []
+        sizes = {}
+        for key_data in itervalues(self.module_hash_to_key_data):
+            if key_data.key_pkl not in self.loaded_key_pkl:
+                continue
+            key_hashes = self._key_hashes.setdefault(key_data.module_hash,
+                                                     set())
+            if not key_hashes:
+                # Modules found by walking the cache directories.
+                for key in key_data.keys:
+                    key_hash = self._key_hash(key)
+                    if key_hash is not None:
+                        key_hashes.add(key_hash)
+            stamp = self._index_stamp(key_data.key_pkl)
+            if stamp is None:
+                continue
+            entries.append((key_data.module_hash,
+                            os.path.dirname(key_data.key_pkl), stamp))
+        entries += [(module_hash, root, self._indexed_stamps[module_hash])
+                    for module_hash, root in iteritems(self._indexed_dirs)]
+        for module_hash, root, stamp in entries:
+            size = self._index_sizes.get(module_hash)
+            if size is None:
+                try:
+                    size = dir_size(root)
+                except OSError:
+                    size = 0
+            sizes[module_hash] = size
+        generation = hash_from_code(repr((os.getpid(), time.time())))
+        index_time = time.time()
+        index_file = os.path.join(self.dirname, self.index_name)
+        tmp_file = '%s.%s' % (index_file, generation)
+        try:
+            with open(tmp_file, 'w') as f:
+                f.write('%s %s %s %r\n' % (INDEX_FORMAT, INDEX_VERSION,
+                                           generation, index_time))
+                for module_hash, root, stamp in sorted(entries):
+                    f.write('%s\n' % ' '.join(
+                        [module_hash, os.path.basename(root)] + list(stamp) +
+                        [str(sizes[module_hash])] +
+                        sorted(self._key_hashes.get(module_hash, ()))))
+            with compilelock.lock_ctx():
+                if os.path.exists(index_file):
+                    # os.rename does not overwrite files on Windows.
+                    os.remove(index_file)
+                os.rename(tmp_file, index_file)
+                # Our own entries are already loaded.
+                self._index_offset = os.path.getsize(index_file)
+        except (IOError, OSError) as e:
+            _logger.warning('Could not write the cache index %s: %s',
+                            index_file, e)
+            return
+        self._index_generation = generation
+        self._index_sizes = sizes
+
+    def _append_to_index(self, module_hash, location, key):
+        """
+        Add a module and one of its keys to the cache index.
+
+        This function expects the compile lock to be held.
+
+        """
+        stamp = self._index_stamp(os.path.join(location, 'key.pkl'))
+        if stamp is None:
+            return
+        try:
+            size = dir_size(location)
+        except OSError:
+            return
+        self._index_sizes[module_hash] = size
+        fields = ([module_hash, os.path.basename(location)] + list(stamp) +
+                  [str(size)])
+        key_hash = self._key_hash(key)
+        if key_hash is not None:
+            self._key_hashes.setdefault(module_hash, set()).add(key_hash)
+            fields.append(key_hash)
+        index_file = os.path.join(self.dirname, self.index_name)
+        if not os.path.exists(index_file):
+            # It will be rebuilt by the next full scan.
+            return
+        try:
+            with open(index_file, 'a') as f:
+                f.write('%s\n' % ' '.join(fields))
+        except (IOError, OSError) as e:
+            _logger.warning('Could not update the cache index %s: %s',
+                            index_file, e)
+
+    @staticmethod
+    def _index_stamp(key_pkl):
+        """
+        Return the stamp of a module in the cache index, or None if its
+        key.pkl file is missing.
+
+        The stamp is the modification time of the key.pkl file and the
+        version of Theano. An index entry whose stamp differs from the
+        current one was written before the module changed, or by another
+        version of Theano, so its key hashes can't be trusted.
+
+        """
+        try:
+            mtime = os.path.getmtime(key_pkl)
+        except OSError:
+            return None
+        return ('%.6f' % mtime,
+                ''.join(str(getattr(theano, '__version__', '')).split()) or
+                'unknown')
+
+    def _check_indexed(self, module_hash):
+        """
+        Check the stamp of an indexed module that is not loaded yet.
+
+        Returns
+        -------
+        bool
+            True if the key hashes of the module in the index can be used.
+            Otherwise they are forgotten, and the module is removed from
+            the index if its key.pkl file is missing.
+
+        """
+        root = self._indexed_dirs[module_hash]
+        stamp = self._index_stamp(os.path.join(root, 'key.pkl'))
+        if stamp == self._indexed_stamps[module_hash]:
+            return True
+        _logger.debug('Stale entry in the cache index: %s', root)
+        for key_hash in self._key_hashes.pop(module_hash, ()):
+            if self._indexed_key_hashes.get(key_hash) == module_hash:
+                del self._indexed_key_hashes[key_hash]
+        if stamp is None:
+            del self._indexed_dirs[module_hash]
+            del self._indexed_stamps[module_hash]
+            self._index_sizes.pop(module_hash, None)
+        else:
+            self._indexed_stamps[module_hash] = stamp
+        return False
+
+    @staticmethod
+    def _key_hash(key):
+        """
+        Return a hash of a versioned key that does not depend on the process.
+
+        It is used to find in the index the module of a key without
+        generating its source code. Keys that are equal usually have the
+        same hash, but this is not guaranteed: a key whose hash is not in the
+        index is looked up by module hash, as before. None is returned for
+        the keys that cannot be pickled.
+
+        """
+        if not key[0]:
+            return None
+        try:
+            return hash_from_code(pickle.dumps(key, protocol=2))
+        except Exception:
+            return None
+
+    def _load_indexed(self, module_hash):
+        """
+        Load the key.pkl file of an indexed module that is not loaded yet.
+
+        """
+        if module_hash not in self._indexed_dirs:
+            return
+        self._check_indexed(module_hash)
+        root = self._indexed_dirs.get(module_hash)
+        if root is None:
+            return
+
+        def no_rmtree(*args, **kwargs):
+            # Broken directories are deleted by the next full scan.
+            pass
+
+        self._refresh_dir(root, self.age_thresh_use, delete_if_problem=False,
+                          cleanup=False, time_now=time.time(),
+                          rmtree=no_rmtree, rmtree_empty=no_rmtree)
+        if module_hash in self.module_hash_to_key_data:
+            del self._indexed_dirs[module_hash]
+            del self._indexed_stamps[module_hash]
+        # Otherwise, the key probably refers to Ops that are not imported
+        # yet: we will try again later.
+
     def _get_from_key(self, key, key_data=None):
         """
         Returns a module if the passed-in key is found in the cache
@@ -1015,6 +1374,13 @@ class ModuleCache(object):
             except (TypeError, ValueError):
                 raise ValueError(
                     "Invalid key. key must have form (version, rest)", key)
+            if key not in self.entry_from_key and self._indexed_key_hashes:
+                module_hash = self._indexed_key_hashes.get(
+                    self._key_hash(key))
+                if (module_hash in self._indexed_dirs and
+                        self._check_indexed(module_hash)):
+                    # The key of an indexed module: load its key.pkl.
+                    self._load_indexed(module_hash)
             if key in self.entry_from_key:
                 name = self.entry_from_key[key]
         else:
@@ -1025,9 +1391,20 @@ class ModuleCache(object):
         return self._get_module(name)
 
     def _get_from_hash(self, module_hash, key, keep_lock=False):
+        if module_hash not in self.module_hash_to_key_data:
+            self._load_indexed(module_hash)
+            # The key may be one of the keys we just loaded.
+            module = self._get_from_key(key)
+            if module is not None:
+                return module
         if module_hash in self.module_hash_to_key_data:
             key_data = self.module_hash_to_key_data[module_hash]
             module = self._get_from_key(None, key_data)
+            if key in key_data.keys:
+                # E.g. the same key appears twice in modules_from_keys.
+                self._update_mappings(key, key_data, module.__file__,
+                                      check_in_keys=True)
+                return module
             with compilelock.lock_ctx(keep_lock=keep_lock):
                 try:
                     key_data.add_key(key, save_pkl=bool(key[0]))
@@ -1041,6 +1418,11 @@ class ModuleCache(object):
                 if (key[0] and not key_broken and
                         self.check_for_broken_eq):
                     self.check_key(key, key_data.key_pkl)
+                if key[0] and not key_broken:
+                    # So that the next processes find it without
+                    # generating the code.
+                    self._append_to_index(
+                        module_hash, os.path.dirname(key_data.key_pkl), key)
             self._update_mappings(key, key_data, module.__file__, check_in_keys=not key_broken)
             return module
         else:
@@ -1094,6 +1476,7 @@ class ModuleCache(object):
             if not key_broken and self.check_for_broken_eq:
                 self.check_key(key, key_pkl)
             self.loaded_key_pkl.add(key_pkl)
+            self._append_to_index(module_hash, location, key)
         elif config.cmodule.warn_no_version:
             key_flat = flatten(key)
             ops = [k for k in key_flat if isinstance(k, theano.Op)]
@@ -1134,30 +1517,35 @@ class ModuleCache(object):
         if module is not None:
             return module
 
-        with compilelock.lock_ctx(keep_lock=keep_lock):
-            # 1) Maybe somebody else compiled it for us while we
-            #    where waiting for the lock. Try to load it again.
-            # 2) If other repo that import Theano have Theano ops defined,
-            #    we need to refresh the cache here. Otherwise, there are import
-            #    order problems.
-            #    When device=gpu, we compile during Theano
-            #    import. This triggers the loading of the cache. But
-            #    unpickling the cache asks that the external Ops are
-            #    completly loaded, which isn't always the case!
-            #    If a module isn't completly loaded and its unpickling
-            #    fails, it means it is safe for this function
-            #    compilation to skip them, but not for future
-            #    compilations. So reloading the cache here
-            #    compilation fixes this problem. (we could do that only once)
-            self.refresh(cleanup=False)
-
-            module = self._get_from_key(key)
-            if module is not None:
-                return module
-
-            module = self._get_from_hash(module_hash, key)
-            if module is not None:
-                return module
+        # Only one process at a time can compile a given module, but
+        # unrelated modules can be compiled concurrently. The global lock is
+        # only held while reading and updating the cache metadata.
+        with compilelock.module_lock_ctx(module_hash):
+            with compilelock.lock_ctx():
+                # 1) Maybe somebody else compiled it for us while we
+                #    where waiting for the lock. Try to load it again.
+                # 2) If other repo that import Theano have Theano ops
+                #    defined, we need to refresh the cache here. Otherwise,
+                #    there are import order problems.
+                #    When device=gpu, we compile during Theano
+                #    import. This triggers the loading of the cache. But
+                #    unpickling the cache asks that the external Ops are
+                #    completly loaded, which isn't always the case!
+                #    If a module isn't completly loaded and its unpickling
+                #    fails, it means it is safe for this function
+                #    compilation to skip them, but not for future
+                #    compilations. So reloading the cache here
+                #    compilation fixes this problem. (we could do that only
+                #    once)
+                self.refresh(cleanup=False)
+
+                module = self._get_from_key(key)
+                if module is not None:
+                    return module
+
+                module = self._get_from_hash(module_hash, key)
+                if module is not None:
+                    return module
 
             hash_key = hash(key)
 
@@ -1186,12 +1574,144 @@ class ModuleCache(object):
             # compilation.
             assert hash(key) == hash_key
 
-            key_data = self._add_to_cache(module, key, module_hash)
-            self.module_hash_to_key_data[module_hash] = key_data
+            with compilelock.lock_ctx(keep_lock=keep_lock):
+                key_data = self._add_to_cache(module, key, module_hash)
+                self.module_hash_to_key_data[module_hash] = key_data
 
         self.stats[2] += 1
         return module
 
+    def modules_from_keys(self, keys_and_lnks, n_workers=None):
+        """
+        Return the modules of several keys, compiling the missing ones in
+        parallel.
+
+        The source code of all the modules is generated first. Then the
+        modules that are not in the cache are compiled concurrently, while
+        holding their per-module locks, and finally all of them are added to
+        the cache at once, while holding the global compilation lock.
+
+        Parameters
+        ----------
+        keys_and_lnks
+            List of (key, lnk) pairs, with the same meaning as the parameters
+            of `module_from_key`. Each `lnk` must also accept a
+            ``py_module=False`` argument to its `compile_cmodule` function.
+        n_workers : int
+            Maximum number of compilations running at the same time. Defaults
+            to config.cmodule.compilation_workers.
+
+        Returns
+        -------
+        list
+            The modules, in the same order as `keys_and_lnks`.
+
+        """
+        if n_workers is None:
+            n_workers = config.cmodule.compilation_workers
+        modules = [None] * len(keys_and_lnks)
+        # module_hash -> list of positions in keys_and_lnks
+        missing = {}
+        missing_order = []
+        for pos, (key, lnk) in enumerate(keys_and_lnks):
+            module = self._get_from_key(key)
+            if module is None:
+                module_hash = get_module_hash(lnk.get_src_code(), key)
+                module = self._get_from_hash(module_hash, key)
+            if module is not None:
+                modules[pos] = module
+            else:
+                if module_hash not in missing:
+                    missing[module_hash] = []
+                    missing_order.append(module_hash)
+                missing[module_hash].append(pos)
+        if not missing:
+            return modules
+
+        with compilelock.module_lock_ctx(missing_order):
+            with compilelock.lock_ctx():
+                # See module_from_key for why we need to refresh here.
+                self.refresh(cleanup=False)
+
+                to_compile = []
+                for module_hash in missing_order:
+                    positions = []
+                    for pos in missing[module_hash]:
+                        key = keys_and_lnks[pos][0]
+                        module = self._get_from_key(key)
+                        if module is None:
+                            module = self._get_from_hash(module_hash, key)
+                        if module is not None:
+                            modules[pos] = module
+                        else:
+                            positions.append(pos)
+                    if positions:
+                        to_compile.append((module_hash, positions))
+
+            hash_keys = [hash(keys_and_lnks[positions[0]][0])
+                         for _, positions in to_compile]
+            locations = [dlimport_workdir(self.dirname)
+                         for _ in to_compile]
+
+            def compile_one(i):
+                pos = to_compile[i][1][0]
+                try:
+                    keys_and_lnks[pos][1].compile_cmodule(locations[i],
+                                                          py_module=False)
+                except Exception as e:
+                    return e
+                return None
+
+            nocleanup = set()
+            try:
+                if n_workers > 1 and len(to_compile) > 1:
+                    pool = ThreadPool(min(n_workers, len(to_compile)))
+                    try:
+                        errors = pool.map(compile_one,
+                                          range(len(to_compile)))
+                    finally:
+                        pool.close()
+                        pool.join()
+                else:
+                    errors = [compile_one(i) for i in range(len(to_compile))]
+                for e in errors:
+                    if e is not None:
+                        raise e
+
+                # Loading the modules is done serially, as dlimport
+                # temporarily modifies sys.path.
+                compiled = []
+                for i, location in enumerate(locations):
+                    open(os.path.join(location, "__init__.py"), 'w').close()
+                    module = dlimport(module_name_from_dir(location))
+                    name = module.__file__
+                    assert name.startswith(location)
+                    assert name not in self.module_from_name
+                    self.module_from_name[name] = module
+                    nocleanup.add(i)
+                    compiled.append(module)
+            finally:
+                for i, location in enumerate(locations):
+                    if i not in nocleanup:
+                        _rmtree(location, ignore_if_missing=True,
+                                msg='exception during compilation')
+
+            with compilelock.lock_ctx():
+                for i, (module_hash, positions) in enumerate(to_compile):
+                    module = compiled[i]
+                    key = keys_and_lnks[positions[0]][0]
+                    # Changing the hash of the key is not allowed during
+                    # compilation.
+                    assert hash(key) == hash_keys[i]
+                    key_data = self._add_to_cache(module, key, module_hash)
+                    self.module_hash_to_key_data[module_hash] = key_data
+                    self.stats[2] += 1
+                    modules[positions[0]] = module
+                    for pos in positions[1:]:
+                        modules[pos] = self._get_from_hash(
+                            module_hash, keys_and_lnks[pos][0])
+        return modules
+
     def check_key(self, key, key_pkl):
         """
         Perform checks to detect broken __eq__ / __hash__ implementations.
@@ -1298,7 +1818,8 @@ class ModuleCache(object):
             # (not loaded in self.entry_from_key).
             too_old_to_use = self.refresh(
                 age_thresh_use=age_thresh_use,
-                delete_if_problem=delete_if_problem)
+                delete_if_problem=delete_if_problem,
+                full_scan=True)
 
             for entry in too_old_to_use:
                 # TODO: we are assuming that modules that haven't been
@@ -1311,6 +1832,100 @@ class ModuleCache(object):
                 _rmtree(parent, msg='old cache directory', level=logging.INFO,
                         ignore_nocleanup=True)
 
+    def trim(self, max_size=None, max_entries=None):
+        """
+        Delete the least recently used modules until the cache fits in the
+        given limits.
+
+        Modules loaded by this process are never deleted. The cache index
+        is rewritten afterwards, so that it records the size of the
+        remaining modules.
+
+        Parameters
+        ----------
+        max_size
+            Maximum total size in bytes of the module directories. Defaults
+            to config.cmodule.max_cache_size. 0 means no limit.
+        max_entries
+            Maximum number of modules. Defaults to
+            config.cmodule.max_cache_entries. 0 means no limit.
+
+        Returns
+        -------
+        tuple
+            The number of deleted modules and the number of bytes freed.
+
+        """
+        if max_size is None:
+            max_size = config.cmodule.max_cache_size
+        if max_entries is None:
+            max_entries = config.cmodule.max_cache_entries
+        if not max_size and not max_entries:
+            return 0, 0
+
+        with compilelock.lock_ctx():
+            # Get the modules indexed by other processes.
+            index_ok = self._read_index()
+            # (last access time, size, directory, module file)
+            entries = []
+            for subdir in os.listdir(self.dirname):
+                if not subdir.startswith('tmp'):
+                    continue
+                root = os.path.join(self.dirname, subdir)
+                try:
+                    files = os.listdir(root)
+                    # Directories without module are being compiled, or are
+                    # cleaned up by clear_unversioned.
+                    entry = module_name_from_dir(root, err=False, files=files)
+                    if entry is None:
+                        continue
+                    size = dir_size(root, files=files)
+                    entries.append((last_access_time(entry), size, root,
+                                    entry))
+                except (OSError, ValueError):
+                    continue
+            entries.sort()
+
+            total_size = sum(e[1] for e in entries)
+            n_entries = len(entries)
+            entry_to_hash = dict((key_data.get_entry(), module_hash)
+                                 for module_hash, key_data in
+                                 iteritems(self.module_hash_to_key_data))
+            root_to_hash = dict((root, module_hash) for module_hash, root in
+                                iteritems(self._indexed_dirs))
+            n_deleted = 0
+            freed = 0
+            for _, size, root, entry in entries:
+                if ((not max_size or total_size <= max_size) and
+                        (not max_entries or n_entries <= max_entries)):
+                    break
+                if entry in self.module_from_name:
+                    continue
+                module_hash = entry_to_hash.get(entry)
+                if module_hash is not None:
+                    key_data = self.module_hash_to_key_data.pop(module_hash)
+                    key_data.delete_keys_from(self.entry_from_key)
+                    self.loaded_key_pkl.discard(key_data.key_pkl)
+                    self._index_sizes.pop(module_hash, None)
+                module_hash = root_to_hash.get(root)
+                if module_hash is not None:
+                    del self._indexed_dirs[module_hash]
+                    del self._indexed_stamps[module_hash]
+                    self._index_sizes.pop(module_hash, None)
+                _rmtree(root, msg='least recently used', level=logging.INFO,
+                        ignore_nocleanup=True)
+                total_size -= size
+                n_entries -= 1
+                n_deleted += 1
+                freed += size
+            if index_ok:
+                # This also drops from the recorded sizes the modules deleted
+                # by other processes.
+                self._write_index()
+        _logger.debug('Trimmed the cache: %s modules deleted, %s bytes freed',
+                      n_deleted, freed)
+        return n_deleted, freed
+
     def clear(self, unversioned_min_age=None, clear_base_files=False,
               delete_if_problem=False):
         """
@@ -1465,8 +2080,19 @@ class ModuleCache(object):
         with compilelock.lock_ctx():
             self.clear_old()
             self.clear_unversioned()
+            # Walking the cache directory is slow on big caches, so we trim
+            # it only when the sizes recorded in the index pass the limits.
+            max_size = config.cmodule.max_cache_size
+            max_entries = config.cmodule.max_cache_entries
+            if ((max_size and
+                    sum(itervalues(self._index_sizes)) > max_size) or
+                    (max_entries and
+                     len(self._index_sizes) > max_entries)):
+                self.trim()
         _logger.debug('Time spent checking keys: %s',
                       self.time_spent_in_check_key)
+        _logger.debug('Time spent refreshing the cache: %s',
+                      self.time_spent_in_refresh)
 
 
 def _rmtree(parent, ignore_nocleanup=False, msg='', level=logging.DEBUG,
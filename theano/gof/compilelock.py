@@ -4,12 +4,14 @@
 import atexit
 import os
 import socket  # only used for gethostname()
+import threading
 import time
 import logging
 
 from contextlib import contextmanager
 
 import numpy as np
+from six import string_types
 
 from theano import config
 from theano.configparser import AddConfigVar, IntParam
@@ -43,6 +45,18 @@ period for running processes.""",
 
 hostname = socket.gethostname()
 
+lock_wait_time = 0
+"""
+Total time (in seconds) this process spent waiting for locks held by other
+processes, in `lock`.
+
+"""
+
+# Protects the process-wide lock state kept as attributes of `get_lock`
+# (mainly the `n_lock` counter), as several threads of the same process can
+# request the lock at the same time (e.g. during parallel compilation).
+_lock_state_mutex = threading.RLock()
+
 
 def force_unlock():
     """
@@ -61,6 +75,49 @@ def lock_ctx(lock_dir=None, keep_lock=False, **kw):
         release_lock()
 
 
+def module_lock_dir(module_hash, compiledir=None):
+    """
+    Return the lock directory protecting the compilation of one module.
+
+    """
+    if compiledir is None:
+        compiledir = config.compiledir
+    return os.path.join(compiledir, 'module_locks', module_hash)
+
+
+@contextmanager
+def module_lock_ctx(module_hashes, **kw):
+    """
+    Hold the compilation locks of the modules whose hashes are given.
+
+    Contrary to `lock_ctx`, those locks only prevent other processes from
+    compiling the same modules at the same time, so processes compiling
+    unrelated modules do not wait for each other.
+
+    Parameters
+    ----------
+    module_hashes
+        A module hash, or a list of module hashes. The locks are always
+        taken in the same order to avoid deadlocks between processes.
+    kw
+        Additional arguments to be forwarded to the `lock` function.
+
+    """
+    if isinstance(module_hashes, string_types):
+        module_hashes = [module_hashes]
+    unlockers = []
+    try:
+        if get_lock_status():
+            for module_hash in sorted(set(module_hashes)):
+                lock_dir = module_lock_dir(module_hash)
+                lock(lock_dir, **kw)
+                unlockers.append(Unlocker(lock_dir))
+        yield
+    finally:
+        for unlocker in reversed(unlockers):
+            unlocker.unlock(force=False)
+
+
 # We define this name with an underscore so that python shutdown
 # deletes this before non-underscore names (like os).  We need to do
 # it this way to avoid errors on shutdown.
@@ -78,6 +135,15 @@ def _get_lock(lock_dir=None, **kw):
     -----
     We can lock only on 1 directory at a time.
 
+    """
+    with _lock_state_mutex:
+        _get_lock_unsafe(lock_dir=lock_dir, **kw)
+
+
+def _get_lock_unsafe(lock_dir=None, **kw):
+    """
+    Implementation of `get_lock`, to be called with `_lock_state_mutex` held.
+
     """
     if lock_dir is None:
         lock_dir = os.path.join(config.compiledir, 'lock_dir')
@@ -134,12 +200,13 @@ def release_lock():
     Release lock on compilation directory.
 
     """
-    get_lock.n_lock -= 1
-    assert get_lock.n_lock >= 0
-    # Only really release lock once all lock requests have ended.
-    if get_lock.lock_is_enabled and get_lock.n_lock == 0:
-        get_lock.start_time = None
-        get_lock.unlocker.unlock(force=False)
+    with _lock_state_mutex:
+        get_lock.n_lock -= 1
+        assert get_lock.n_lock >= 0
+        # Only really release lock once all lock requests have ended.
+        if get_lock.lock_is_enabled and get_lock.n_lock == 0:
+            get_lock.start_time = None
+            get_lock.unlocker.unlock(force=False)
 
 
 def set_lock_status(use_lock):
@@ -156,6 +223,14 @@ def set_lock_status(use_lock):
     """
     get_lock.lock_is_enabled = use_lock
 
+
+def get_lock_status():
+    """
+    Return True if the locks on the compilation directory are enabled.
+
+    """
+    return getattr(get_lock, 'lock_is_enabled', True)
+
 # This is because None is a valid input for timeout
 notset = object()
 
@@ -203,6 +278,8 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
         max_wait = min_wait * 2
     if timeout is notset:
         timeout = config.compile.timeout
+    global lock_wait_time
+    time_start_lock = time.time()
     # Create base of lock directory if required.
     base_lock = os.path.dirname(tmp_dir)
     if not os.path.isdir(base_lock):
@@ -257,7 +334,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                         msg = "process '%s'" % read_owner.split('_')[0]
                         _logger.warning("Overriding existing lock by dead %s "
                                         "(I am process '%s')", msg, my_pid)
-                    get_lock.unlocker.unlock(force=True)
+                    Unlocker(tmp_dir).unlock(force=True)
                     continue
                 if last_owner == read_owner:
                     if (timeout is not None and
@@ -270,7 +347,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                                 msg = "process '%s'" % read_owner.split('_')[0]
                             _logger.warning("Overriding existing lock by %s "
                                             "(I am process '%s')", msg, my_pid)
-                        get_lock.unlocker.unlock(force=True)
+                        Unlocker(tmp_dir).unlock(force=True)
                         continue
                 else:
                     last_owner = read_owner
@@ -316,6 +393,7 @@ def lock(tmp_dir, timeout=notset, min_wait=None, max_wait=None, verbosity=1):
                 continue
             else:
                 # We got the lock, hoorray!
+                lock_wait_time += time.time() - time_start_lock
                 return
 
         except Exception as e:
@@ -347,7 +425,7 @@ def refresh_lock(lock_file):
         # from failing, we release the lock, but as there is a
         # problem, we still keep the original exception.
         # This way, only 1 test would fail.
-        while get_lock.n_lock > 0:
+        while getattr(get_lock, 'n_lock', 0) > 0:
             release_lock()
         _logger.warn('Refreshing lock failed, we release the'
                      ' lock before raising again the exception')
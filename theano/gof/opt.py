@@ -1941,22 +1941,74 @@ class OpKeyOptimizer(NavigatorOptimizer):
 
 
 class ChangeTracker:
-    def __init__(self):
+    def __init__(self, track_nodes=False):
         self.changed = False
         self.nb_imported = 0
+        # If track_nodes, the nodes imported or whose neighborhood changed
+        # since the last call to reset_changed_nodes.
+        self.changed_nodes = OrderedSet() if track_nodes else None
 
     def on_import(self, fgraph, node, reason):
         self.nb_imported += 1
         self.changed = True
+        if self.changed_nodes is not None:
+            self.changed_nodes.add(node)
 
     def on_change_input(self, fgraph, node, i, r, new_r, reason):
         self.changed = True
+        if self.changed_nodes is not None:
+            # The owners of r and new_r lost or gained a client, which can
+            # enable or disable optimizations on them.
+            for n in (node, r.owner, new_r.owner):
+                if n is not None and n != 'output':
+                    self.changed_nodes.add(n)
+
+    def reset_changed_nodes(self):
+        """
+        Return the tracked nodes still in the graph and their clients, in
+        topological order, and start tracking again.
+
+        """
+        fgraph = self.fgraph
+        nodes = OrderedSet()
+        for node in self.changed_nodes:
+            if node in fgraph.apply_nodes:
+                nodes.add(node)
+                for out in node.outputs:
+                    for client, _ in out.clients:
+                        if client != 'output':
+                            nodes.add(client)
+        self.changed_nodes = OrderedSet()
+
+        # Sort them considering only the edges between them.
+        order = []
+        done = set()
+        for node in nodes:
+            stack = [node]
+            while stack:
+                n = stack[-1]
+                if n in done:
+                    stack.pop()
+                    continue
+                deps = [i.owner for i in n.inputs
+                        if i.owner in nodes and i.owner not in done]
+                if deps:
+                    stack.extend(deps)
+                else:
+                    done.add(n)
+                    order.append(n)
+                    stack.pop()
+        return order
 
     def reset(self):
         self.changed = False
 
     def on_attach(self, fgraph):
         fgraph.change_tracker = self
+        self.fgraph = fgraph
+
+    def on_detach(self, fgraph):
+        del self.fgraph
 
 
 class EquilibriumOptimizer(NavigatorOptimizer):
@@ -1972,6 +2024,13 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         times.
     ignore_newtrees
         See EquilibriumDB ignore_newtrees parameter definition.
+    incremental
+        If True, only the first pass applies the local optimizers on all the
+        nodes. The next passes only visit the nodes that were imported or
+        whose neighborhood changed since the previous pass, and their
+        clients. When such a pass changes nothing, a last full pass checks
+        that the graph is at equilibrium, as in the default mode.
+        See the flag optdb.incremental.
 
     """
 
@@ -1980,7 +2039,8 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                  failure_callback=None,
                  ignore_newtrees=True,
                  max_use_ratio=None,
-                 final_optimizers=None):
+                 final_optimizers=None,
+                 incremental=False):
         super(EquilibriumOptimizer, self).__init__(
             None,
             ignore_newtrees=ignore_newtrees,
@@ -2004,6 +2064,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         self.max_use_ratio = max_use_ratio
         assert self.max_use_ratio is not None, (
             'max_use_ratio has to be a number')
+        self.incremental = incremental
 
     def get_local_optimizers(self):
         for opt in self.local_optimizers_all:
@@ -2026,7 +2087,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             opt.add_requirements(fgraph)
 
     def apply(self, fgraph, start_from=None):
-        change_tracker = ChangeTracker()
+        change_tracker = ChangeTracker(track_nodes=self.incremental)
         fgraph.attach_feature(change_tracker)
         if start_from is None:
             start_from = fgraph.outputs
@@ -2035,6 +2096,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                 assert node in fgraph.outputs
 
         changed = True
+        full_pass = True
         max_use_abort = False
         opt_name = None
         global_process_count = {}
@@ -2088,11 +2150,17 @@ class EquilibriumOptimizer(NavigatorOptimizer):
 
             # apply local optimizer
             topo_t0 = time.time()
-            q = deque(graph.io_toposort(fgraph.inputs, start_from))
+            if full_pass:
+                q = deque(graph.io_toposort(fgraph.inputs, start_from))
+                max_nb_nodes = max(max_nb_nodes, len(q))
+                if self.incremental:
+                    change_tracker.reset_changed_nodes()
+            else:
+                q = deque(change_tracker.reset_changed_nodes())
+                max_nb_nodes = max(max_nb_nodes, len(fgraph.apply_nodes))
             io_toposort_timing.append(time.time() - topo_t0)
 
             nb_nodes.append(len(q))
-            max_nb_nodes = max(max_nb_nodes, len(q))
             max_use = max_nb_nodes * self.max_use_ratio
 
             def importer(node):
@@ -2162,6 +2230,13 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             loop_process_count.append(process_count)
             loop_timing.append(float(time.time() - t0))
 
+            if self.incremental:
+                if changed:
+                    full_pass = False
+                elif not full_pass:
+                    # Check the equilibrium on the whole graph.
+                    changed = full_pass = True
+
         end_nb_nodes = len(fgraph.apply_nodes)
 
         if max_use_abort:
@@ -7,7 +7,7 @@ from theano.compat import DefaultOrderedDict
 from theano.misc.ordered_set import OrderedSet
 from six import StringIO
 from theano.gof import opt
-from theano.configparser import AddConfigVar, FloatParam
+from theano.configparser import AddConfigVar, BoolParam, FloatParam
 from theano import config
 
 AddConfigVar('optdb.position_cutoff',
@@ -19,6 +19,12 @@ AddConfigVar('optdb.max_use_ratio',
              'A ratio that prevent infinite loop in EquilibriumOptimizer.',
              FloatParam(5),
              in_c_key=False)
+AddConfigVar('optdb.incremental',
+             'If True, after their first pass, the EquilibriumOptimizer only'
+             ' revisit the nodes changed by the previous pass and their'
+             ' clients, then check the equilibrium with a last full pass.',
+             BoolParam(False),
+             in_c_key=False)
 
 
 class DB(object):
@@ -263,7 +269,8 @@ class EquilibriumDB(DB):
             max_use_ratio=config.optdb.max_use_ratio,
             ignore_newtrees=self.ignore_newtrees,
             failure_callback=opt.NavigatorOptimizer.warn_inplace,
-            final_optimizers=final_opts)
+            final_optimizers=final_opts,
+            incremental=config.optdb.incremental)
 
 
 class SequenceDB(DB):
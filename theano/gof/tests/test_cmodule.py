@@ -4,10 +4,17 @@ But this one tests a current behavior that isn't good: the c_code isn't
 deterministic based on the input type and the op.
 
 """
+import os
+import shutil
+import tempfile
+import threading
+import time
+
 import numpy
+from nose.plugins.skip import SkipTest
 
 import theano
-from theano.gof.cmodule import GCC_compiler
+from theano.gof.cmodule import GCC_compiler, ModuleCache, parse_byte_size
 
 
 class MyOp(theano.compile.ops.DeepCopyOp):
@@ -67,3 +74,244 @@ def test_flag_detection():
     # but was not detected because that path is not usually taken,
     # so we test it here directly.
     GCC_compiler.try_flags(["-lblas"])
+
+
+@theano.configparser.change_flags(**{'cmodule.compilation_workers': 4})
+def test_parallel_compilation():
+    if theano.config.cxx == "":
+        raise SkipTest("Need cxx to test the C module cache")
+    x = theano.tensor.dvector('x')
+    outs = [theano.tensor.exp(x * i) + i for i in range(1, 4)]
+    mode = theano.compile.Mode(linker='cvm', optimizer=None)
+    f = theano.function([x], outs, mode=mode)
+    xv = numpy.arange(5.)
+    for i, out in enumerate(f(xv)):
+        assert numpy.allclose(out, numpy.exp(xv * (i + 1)) + (i + 1))
+
+    # All the modules were put in the cache by the batched compilation, so
+    # doing it again must not compile anything.
+    cache = theano.gof.cc.get_module_cache()
+    nb_compiled = cache.stats[2]
+    theano.gof.cc.precompile_nodes(f.maker.fgraph.toposort(),
+                                   f.maker.linker.no_recycling)
+    assert cache.stats[2] == nb_compiled
+
+    # The missing modules are compiled by the threads of the pool.
+    keys_and_lnks = []
+    for op in [theano.tensor.exp, theano.tensor.tanh, theano.tensor.sin]:
+        fgraph = theano.gof.FunctionGraph([x], [op(x)])
+        lnk = theano.gof.CLinker().accept(fgraph)
+        keys_and_lnks.append((lnk.cmodule_key(), lnk))
+    threads = []
+    compile_cmodule = theano.gof.CLinker.compile_cmodule
+
+    def count_compile_cmodule(self, *args, **kwargs):
+        threads.append(threading.current_thread())
+        return compile_cmodule(self, *args, **kwargs)
+
+    dirname = tempfile.mkdtemp()
+    theano.gof.CLinker.compile_cmodule = count_compile_cmodule
+    try:
+        cache = ModuleCache(dirname, check_for_broken_eq=False)
+        modules = cache.modules_from_keys(keys_and_lnks, n_workers=3)
+        assert all(modules)
+        assert len(threads) == 3
+        assert threading.current_thread() not in threads
+        # They are in the cache now.
+        cache.modules_from_keys(keys_and_lnks, n_workers=3)
+        assert len(threads) == 3
+    finally:
+        theano.gof.CLinker.compile_cmodule = compile_cmodule
+        shutil.rmtree(dirname)
+
+
+def test_module_lock():
+    from theano.gof import compilelock
+    if not compilelock.get_lock_status():
+        raise SkipTest("The compilation locks are disabled")
+    lock_dirs = [compilelock.module_lock_dir(h) for h in ('hash_b', 'hash_a')]
+    with compilelock.module_lock_ctx(['hash_b', 'hash_a']):
+        for lock_dir in lock_dirs:
+            assert os.path.isdir(lock_dir)
+        # Locking other modules must not wait for these ones.
+        with compilelock.module_lock_ctx('hash_c', timeout=0):
+            pass
+    for lock_dir in lock_dirs:
+        assert not os.path.exists(lock_dir)
+
+
+def test_cache_index():
+    if theano.config.cxx == "":
+        raise SkipTest("Need cxx to test the C module cache")
+    x = theano.tensor.dvector('x')
+    mode = theano.compile.Mode(linker='c', optimizer=None)
+    f = theano.function([x], theano.tensor.exp(x) * 2, mode=mode)
+    f(numpy.arange(3.))
+
+    cache = theano.gof.cc.get_module_cache()
+    # Rebuild the index from the content of the cache directory.
+    cache.refresh(full_scan=True)
+    versioned = [key_data for key_data in cache.module_hash_to_key_data.values()
+                 if key_data.key_pkl in cache.loaded_key_pkl]
+    if not versioned:
+        raise SkipTest("No versioned module in the cache")
+
+    # A new cache reads the index, but does not load any key.pkl file until
+    # the corresponding module is needed.
+    new_cache = ModuleCache(cache.dirname, check_for_broken_eq=False)
+    assert not new_cache.loaded_key_pkl
+    module_hash = versioned[0].module_hash
+    assert module_hash in new_cache._indexed_dirs
+    new_cache._load_indexed(module_hash)
+    assert module_hash in new_cache.module_hash_to_key_data
+    assert module_hash not in new_cache._indexed_dirs
+    assert new_cache.time_spent_in_refresh > 0
+
+
+def test_cache_index_new_process():
+    if theano.config.cxx == "":
+        raise SkipTest("Need cxx to test the C module cache")
+
+    def get_module(cache):
+        # Like a new process, use a new graph.
+        x = theano.tensor.dvector('x')
+        fgraph = theano.gof.FunctionGraph([x], [theano.tensor.exp(x) * 2])
+        lnk = theano.gof.CLinker().accept(fgraph)
+        get_src_code = lnk.get_src_code
+        nb_src_code = []
+
+        def count_src_code():
+            nb_src_code.append(1)
+            return get_src_code()
+        lnk.get_src_code = count_src_code
+        module = cache.module_from_key(lnk.cmodule_key(), lnk)
+        return module, len(nb_src_code)
+
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = ModuleCache(dirname, check_for_broken_eq=False)
+        module, nb_src_code = get_module(cache)
+        assert cache.stats[2] == 1
+
+        # The key hash in the index finds the module without generating
+        # the code.
+        new_cache = ModuleCache(dirname, check_for_broken_eq=False)
+        new_module, nb_src_code = get_module(new_cache)
+        assert new_module.__file__ == module.__file__
+        assert nb_src_code == 0
+        assert new_cache.stats[2] == 0
+
+        # Without it, the key is found in the key.pkl file loaded from the
+        # module hash.
+        new_cache = ModuleCache(dirname, check_for_broken_eq=False)
+        new_cache._indexed_key_hashes.clear()
+        new_module, nb_src_code = get_module(new_cache)
+        assert new_module.__file__ == module.__file__
+        assert nb_src_code == 1
+        assert new_cache.stats[2] == 0
+
+        # The key hashes of an entry are not used when its key.pkl file
+        # changed since it was indexed, or when it was indexed by another
+        # version of Theano.
+        key_pkl = os.path.join(os.path.dirname(module.__file__), 'key.pkl')
+        mtime = os.path.getmtime(key_pkl)
+        os.utime(key_pkl, (mtime + 10, mtime + 10))
+        new_cache = ModuleCache(dirname, check_for_broken_eq=False)
+        new_module, nb_src_code = get_module(new_cache)
+        assert new_module.__file__ == module.__file__
+        assert nb_src_code == 1
+        os.utime(key_pkl, (mtime, mtime))
+        version = theano.__version__
+        new_cache = ModuleCache(dirname, check_for_broken_eq=False)
+        try:
+            theano.__version__ = version + '.other'
+            new_module, nb_src_code = get_module(new_cache)
+        finally:
+            theano.__version__ = version
+        assert new_module.__file__ == module.__file__
+        assert nb_src_code == 1
+        assert new_cache.stats[2] == 0
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_parse_byte_size():
+    assert parse_byte_size('0') == 0
+    assert parse_byte_size('512') == 512
+    assert parse_byte_size('2k') == 2048
+    assert parse_byte_size('1.5M') == 3 * 2 ** 19
+    assert parse_byte_size('2GB') == 2 * 2 ** 30
+
+
+def test_trim():
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = ModuleCache(dirname, do_refresh=False)
+        now = time.time()
+        for i in range(4):
+            root = os.path.join(dirname, 'tmp%d' % i)
+            os.mkdir(root)
+            entry = os.path.join(root, 'mod%d.so' % i)
+            with open(entry, 'wb') as f:
+                f.write(b'x' * 1000)
+            # The oldest module is tmp0.
+            os.utime(entry, (now - 100 * (4 - i), now))
+
+        assert cache.trim(max_entries=3) == (1, 1000)
+        assert not os.path.exists(os.path.join(dirname, 'tmp0'))
+        assert cache.trim(max_size=1500) == (2, 2000)
+        assert [d for d in os.listdir(dirname) if d.startswith('tmp')] == [
+            'tmp3']
+        assert cache.trim(max_size=0, max_entries=0) == (0, 0)
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_trim_on_exit():
+    if theano.config.cxx == "":
+        raise SkipTest("Need cxx to test the C module cache")
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = ModuleCache(dirname, check_for_broken_eq=False)
+        x = theano.tensor.dvector('x')
+        fgraph = theano.gof.FunctionGraph([x], [theano.tensor.exp(x) * 2])
+        lnk = theano.gof.CLinker().accept(fgraph)
+        module = cache.module_from_key(lnk.cmodule_key(), lnk)
+        root = os.path.dirname(module.__file__)
+        if not cache._index_sizes:
+            raise SkipTest("No versioned module in the cache")
+        # The index records the size of the module directory.
+        size = sum(os.path.getsize(os.path.join(root, f))
+                   for f in os.listdir(root))
+        assert list(cache._index_sizes.values()) == [size]
+        new_cache = ModuleCache(dirname, check_for_broken_eq=False)
+        assert new_cache._index_sizes == cache._index_sizes
+
+        # The cache directory is not trimmed while the recorded size is
+        # below the limit, but the old modules are cleared at each exit.
+        trimmed = []
+        cleared = []
+        new_cache.trim = lambda: trimmed.append(1)
+        new_cache.clear_old = lambda: cleared.append(1)
+        max_size = theano.config.cmodule.max_cache_size
+        try:
+            theano.config.cmodule.max_cache_size = size
+            new_cache._on_atexit()
+            assert not trimmed
+            assert len(cleared) == 1
+            theano.config.cmodule.max_cache_size = size - 1
+            new_cache._on_atexit()
+            assert trimmed
+            assert len(cleared) == 2
+        finally:
+            theano.config.cmodule.max_cache_size = max_size
+
+        # Trimming removes the deleted modules from the index.
+        new_cache = ModuleCache(dirname, check_for_broken_eq=False)
+        assert new_cache.trim(max_entries=1) == (0, 0)
+        assert new_cache.trim(max_size=1) == (1, size)
+        assert not os.path.exists(root)
+        assert not new_cache._index_sizes
+        assert not ModuleCache(dirname)._index_sizes
+    finally:
+        shutil.rmtree(dirname)
@@ -1,6 +1,6 @@
 
 from theano.gof.type import Type
-from theano.gof.graph import Variable, Apply, Constant
+from theano.gof.graph import Variable, Apply, Constant, is_same_graph
 from theano.gof.op import Op
 from theano.gof.opt import *  # noqa
 from theano.gof.fg import FunctionGraph
@@ -567,6 +567,39 @@ class TestEquilibrium(object):
         # print 'after', g
         assert str(g) == '[Op1(x, y)]'
 
+    def test_incremental(self):
+        def optimize(incremental):
+            x, y, z = map(MyVariable, 'xyz')
+            outs = [op3(op4(x, y))]
+            for i in range(20):
+                outs.append(op1(op2(x, y), outs[-1]))
+            g = FunctionGraph([x, y, z], outs)
+            opt = EquilibriumOptimizer(
+                [PatternSub((op1, 'x', 'y'), (op2, 'x', 'y')),
+                 PatternSub((op4, 'x', 'y'), (op1, 'x', 'y')),
+                 PatternSub((op3, (op2, 'x', 'y')), (op4, 'x', 'y'))
+                 ],
+                max_use_ratio=10, incremental=incremental)
+            prof = opt.optimize(g)
+            n = len(g.apply_nodes)
+            inputs, outputs = g.inputs, g.outputs
+            g.disown()
+            return inputs, outputs, n, prof[5]
+
+        inputs, expected, n, nb_nodes = optimize(False)
+        inc_inputs, outputs, inc_n, inc_nb_nodes = optimize(True)
+        # The names given in str(g) to the variables used several times
+        # change from one graph to the other, so compare the computations.
+        givens = list(zip(inc_inputs, inputs))
+        assert len(outputs) == len(expected)
+        for out, expected_out in zip(outputs, expected):
+            assert is_same_graph(out, expected_out, givens=givens)
+        # The first and the last passes visit the whole graph, the other
+        # ones only the nodes that changed.
+        assert inc_nb_nodes[0] == nb_nodes[0]
+        assert inc_nb_nodes[-1] == inc_n == n
+        assert sum(inc_nb_nodes[1:-1]) < sum(nb_nodes[1:-1])
+
 
 def test_pre_constant_merge_slice():
     ms = theano.tensor.type_other.MakeSlice()(1)
@@ -6,7 +6,7 @@ import unittest
 
 from nose.plugins.skip import SkipTest
 import numpy
-from six import itervalues
+from six import iteritems, itervalues
 
 from theano import function
 from theano.gof import vm
@@ -16,6 +16,7 @@ from theano.compile import Mode
 
 from theano import tensor
 from theano.ifelse import ifelse
+from theano.tests import unittest_tools as utt
 import theano
 
 
@@ -396,3 +397,150 @@ def test_reallocation():
         assert check_storage(storage_map)[0]
         assert len(set(id(v) for v in
                        itervalues(storage_map))) < len(storage_map)
+
+
+def build_storage_plan_graph():
+    x = tensor.matrix('x')
+    z = x
+    for i in range(6):
+        z = tensor.tanh(tensor.dot(z, x) + i)
+    return x, z
+
+
+def test_storage_plan():
+    x, z = build_storage_plan_graph()
+    xv = numpy.random.rand(4, 4).astype(theano.config.floatX)
+    f_ref = function([x], z)
+
+    for allow_gc in [False, True]:
+        linker = vm.VM_Linker(allow_gc=allow_gc, lazy=False, use_cloop=False)
+        mode = theano.compile.get_mode(theano.Mode(linker=linker))
+        f = function([x], z, mode=mode.excluding('fusion', 'inplace'))
+        order = f.maker.fgraph.toposort()
+        plan = f.fn.storage_plan
+        assert plan
+        position = dict((node, i) for i, node in enumerate(order))
+        for group in plan:
+            # All the variables of a group have the same type, and each one
+            # is computed after the last use of the previous one.
+            assert all(var.type == group[0].type for var in group)
+            for prev, var in zip(group, group[1:]):
+                last_use = max([position[prev.owner]] +
+                               [position[c] for c, _ in prev.clients
+                                if c != 'output'])
+                assert last_use < position[var.owner]
+                assert f.fn.storage_map[prev] is f.fn.storage_map[var]
+        for i in range(2):
+            utt.assert_allclose(f(xv + i), f_ref(xv + i))
+
+    # The C loop doesn't use the plan, so it isn't computed.
+    if theano.config.cxx:
+        linker = vm.VM_Linker(allow_gc=False, lazy=False, use_cloop=True)
+        mode = theano.compile.get_mode(theano.Mode(linker=linker))
+        f = function([x], z, mode=mode.excluding('fusion', 'inplace'))
+        assert not f.fn.storage_plan
+
+
+def test_storage_plan_memory():
+    x, z = build_storage_plan_graph()
+    xv = numpy.random.rand(50, 50).astype(theano.config.floatX)
+
+    def held_memory(memory_plan, allow_gc):
+        # The memory held by the intermediate results after a call
+        orig = theano.config.vm.memory_plan
+        theano.config.vm.memory_plan = memory_plan
+        try:
+            linker = vm.VM_Linker(allow_gc=allow_gc, lazy=False,
+                                  use_cloop=False)
+            mode = theano.compile.get_mode(theano.Mode(linker=linker))
+            f = function([x], z, mode=mode.excluding('fusion', 'inplace'))
+        finally:
+            theano.config.vm.memory_plan = orig
+        f(xv)
+        storages = dict((id(storage), storage)
+                        for var, storage in iteritems(f.fn.storage_map)
+                        if var.owner and var not in f.maker.fgraph.outputs)
+        return sum(getattr(s[0], 'nbytes', 0) for s in itervalues(storages))
+
+    # Loop keeps one buffer per group instead of one per result.
+    assert held_memory(True, False) < held_memory(False, False)
+    # LoopGC frees the shared storage after its last use.
+    assert held_memory(True, True) == held_memory(False, True) == 0
+
+
+@theano.configparser.change_flags(**{'vm.memory_plan': False})
+def test_storage_plan_disabled():
+    x, z = build_storage_plan_graph()
+    xv = numpy.random.rand(4, 4).astype(theano.config.floatX)
+    linker = vm.VM_Linker(allow_gc=False, lazy=False, use_cloop=False)
+    mode = theano.compile.get_mode(theano.Mode(linker=linker))
+    f = function([x], z, mode=mode.excluding('fusion', 'inplace'))
+    assert not f.fn.storage_plan
+    utt.assert_allclose(f(xv), function([x], z)(xv))
+
+
+def test_parallel_loop():
+    x = tensor.matrix('x')
+    y = tensor.matrix('y')
+    # Independent branches, and an inplace op that must wait for the other
+    # client of the variable it destroys.
+    outs = [tensor.dot(x + i, y) for i in range(4)]
+    h = x * y
+    outs.append(tensor.exp(h) * h.sum())
+    xv = numpy.random.rand(5, 5).astype(theano.config.floatX)
+    yv = numpy.random.rand(5, 5).astype(theano.config.floatX)
+    f_ref = function([x, y], outs)
+    expected = f_ref(xv, yv)
+
+    for allow_gc in [True, False]:
+        linker = vm.VM_Linker(allow_gc=allow_gc, use_cloop=False,
+                              n_threads=3)
+        f = function([x, y], outs, mode=Mode(linker=linker,
+                                             optimizer='fast_run'))
+        assert isinstance(f.fn, vm.ParallelLoop)
+        for i in range(3):
+            for out, exp in zip(f(xv, yv), expected):
+                utt.assert_allclose(out, exp)
+        if allow_gc:
+            for var, storage in iteritems(f.fn.storage_map):
+                if var.owner and var not in f.maker.fgraph.outputs:
+                    assert storage[0] is None
+
+    # The errors are raised with the node information.
+    f = function([x, y], outs,
+                 mode=Mode(linker=vm.VM_Linker(use_cloop=False, n_threads=3),
+                           optimizer='fast_run'))
+    try:
+        f(xv, yv[:3])
+        assert False
+    except ValueError as e:
+        # The first node to fail depends on the order of the threads.
+        assert 'Apply node that caused the error' in str(e)
+        assert 'Inputs shapes' in str(e)
+
+
+def test_speed_parallel():
+    # Not a real test: compare the execution time of the python VMs on a
+    # wide graph of operations that release the GIL.
+    def time_linker(name, linker, width=8, size=300):
+        x = tensor.matrix()
+        outs = [tensor.dot(x + i, x) for i in range(width)]
+        f = function([x], outs, mode=Mode(optimizer=None, linker=linker()))
+        xv = numpy.random.rand(size, size).astype(theano.config.floatX)
+        f(xv)
+        t0 = time.time()
+        for i in xrange(10):
+            f(xv)
+        t1 = time.time()
+        print("%s takes %f s/call" % (name, (t1 - t0) / 10))
+
+    time_linker('vmLinker_Loop',
+                lambda: vm.VM_Linker(allow_gc=False, lazy=False,
+                                     c_thunks=False))
+    time_linker('vmLinker_Stack',
+                lambda: vm.VM_Linker(allow_gc=False, lazy=True,
+                                     c_thunks=False))
+    for n_threads in [2, 4]:
+        time_linker('vmLinker_ParallelLoop_%d' % n_threads,
+                    lambda: vm.VM_Linker(allow_gc=False, c_thunks=False,
+                                         n_threads=n_threads))
@@ -10,16 +10,19 @@ from collections import defaultdict
 import logging
 import os
 import sys
+import threading
 import time
 import warnings
+import weakref
 
 from theano.configparser import (config, AddConfigVar,
-                                 BoolParam, ConfigParam, _config_var_list)
+                                 BoolParam, ConfigParam, IntParam,
+                                 _config_var_list)
 
 import theano.gof.cmodule
 
 from six import iteritems, itervalues
-from six.moves import xrange
+from six.moves import queue, xrange
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +59,24 @@ AddConfigVar('vm.lazy',
              ConfigParam('None', filter_vm_lazy),
              in_c_key=False)
 
+AddConfigVar('vm.n_threads',
+             "Useful only for the vm linkers. When bigger than 1 and the"
+             " graph doesn't need lazy evaluation, run the independent"
+             " nodes of the graph at the same time with that many threads."
+             " This only helps when the thunks release the GIL.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
+AddConfigVar('vm.memory_plan',
+             "Useful only for the vm linkers that execute the nodes in order"
+             " (Loop and LoopGC). If True, the intermediate results whose"
+             " lifetimes don't overlap share the same storage, so the thunks"
+             " can reuse the buffers of the results that are no longer"
+             " needed. If False, only scalars are reused. The cvm linker"
+             " doesn't use it.",
+             BoolParam(True),
+             in_c_key=False)
+
 
 def calculate_reallocate_info(order, fgraph, storage_map, compute_map_re,
                               dependencies):
@@ -143,6 +164,107 @@ def calculate_reallocate_info(order, fgraph, storage_map, compute_map_re,
     return reallocated_info
 
 
+def _storage_shape_key(fgraph, var):
+    """
+    Return a hashable description of the shape of `var` computed by the
+    ShapeFeature of `fgraph`, or None if it isn't known.
+
+    """
+    shape_feature = getattr(fgraph, 'shape_feature', None)
+    if shape_feature is None:
+        return None
+    shape = shape_feature.shape_of.get(var)
+    if shape is None:
+        return None
+    return tuple(int(s.data) if isinstance(s, theano.Constant) else s
+                 for s in shape)
+
+
+def calculate_storage_plan(order, fgraph, storage_map):
+    """
+    Plan which intermediate results can share the same storage.
+
+    The live interval of an intermediate result goes from the node that
+    computes it to the last node that uses it, or one of its views, in
+    `order`. The intervals are coloured greedily in execution order: a new
+    result takes the storage of a result of the same type that is dead
+    before its node starts, preferring one that has the same symbolic shape
+    so that the thunk can reuse the buffer without reallocating it.
+
+    The inputs, constants, outputs of the function, and the results that
+    are a view of another variable or are destroyed by a node that returns
+    a view, aren't planned.
+
+    Parameters
+    ----------
+    order
+        The list of nodes in execution order.
+    fgraph
+        The FunctionGraph of the nodes.
+    storage_map
+        The storage of the variables.
+
+    Returns
+    -------
+    list of lists of variables
+        The variables of each list have disjoint live intervals, are sorted
+        by execution order, and can use the same storage.
+
+    """
+    view_of = {}
+    for node in order:
+        dmap = getattr(node.op, 'destroy_map', None) or {}
+        vmap = getattr(node.op, 'view_map', None) or {}
+        for idx_o, out in enumerate(node.outputs):
+            idx_v = dmap.get(idx_o, vmap.get(idx_o))
+            if idx_v:
+                ins = node.inputs[idx_v[0]]
+                view_of[out] = view_of.get(ins, ins)
+
+    # The index of the last node that needs the storage of each origin.
+    never = len(order)
+    last_use = {}
+    for i, node in enumerate(order):
+        for out in node.outputs:
+            origin = view_of.get(out, out)
+            last_use[origin] = max(last_use.get(origin, i), i)
+        for ins in node.inputs:
+            origin = view_of.get(ins, ins)
+            last_use[origin] = max(last_use.get(origin, i), i)
+    for out in fgraph.outputs:
+        last_use[view_of.get(out, out)] = never
+
+    groups = []
+    free = {}  # type -> list of indices in groups of free storage
+    ending = defaultdict(list)  # node index -> storage freed after it
+    for i, node in enumerate(order):
+        if i > 0:
+            for g in ending.pop(i - 1, ()):
+                free.setdefault(groups[g][-1].type, []).append(g)
+        for out in node.outputs:
+            if (out in view_of or storage_map[out][0] is not None or
+                    last_use[out] == never):
+                continue
+            candidates = free.get(out.type)
+            g = None
+            if candidates:
+                shape = _storage_shape_key(fgraph, out)
+                if shape is not None:
+                    for c in reversed(candidates):
+                        if _storage_shape_key(fgraph, groups[c][-1]) == shape:
+                            g = c
+                            break
+                if g is None:
+                    g = candidates[-1]
+                candidates.remove(g)
+                groups[g].append(out)
+            else:
+                g = len(groups)
+                groups.append([out])
+            ending[last_use[out]].append(g)
+    return [g for g in groups if len(g) > 1]
+
+
 class VM(object):
     """
     A VM object's __call__ method evaluates a Theano program.
@@ -245,6 +367,9 @@ class VM(object):
         if hasattr(self, 'dependencies'):
             profile.dependencies = self.dependencies
 
+        if hasattr(self, 'storage_plan'):
+            profile.storage_plan = self.storage_plan
+
         # clear the timer info out of the buffers
         for i in xrange(len(self.call_times)):
             self.call_times[i] = 0.0
@@ -331,6 +456,162 @@ class LoopGC(VM):
                 link.raise_with_op(node, thunk)
 
 
+def _parallel_loop_worker(tasks, done):
+    """
+    Run the thunks received from `tasks` until a None is received, and
+    report each of them on `done` as a tuple (index, runtime, exc_info).
+
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        i, thunk = task
+        try:
+            t0 = time.time()
+            thunk()
+            t1 = time.time()
+            done.put((i, t1 - t0, None))
+        except Exception:
+            done.put((i, 0, sys.exc_info()))
+
+# The weak references to the ParallelLoop that have started threads. Their
+# callbacks stop the threads when the ParallelLoop is collected.
+_parallel_loop_refs = set()
+
+
+class ParallelLoop(VM):
+    """
+    Unconditional program execution in Python, running the independent
+    thunks at the same time in a pool of threads.
+
+    A node is started as soon as all the nodes it depends on are done: the
+    owners of its inputs, and the nodes that must run before it because of
+    the destroy_map (see `FunctionGraph.orderings`).
+
+    Only the thunks that release the GIL (BLAS calls done by numpy for
+    instance) can run at the same time, so this is slower than `Loop` for
+    graphs of small operations. Lazy thunks aren't supported.
+
+    Parameters
+    ----------
+    nodes
+        A list of nodes in toposort order.
+    thunks
+        A list of thunks to execute those nodes, in toposort order.
+    pre_call_clear
+        A list of containers to empty at the beginning of each call.
+    fgraph
+        The FunctionGraph of the nodes.
+    allow_gc
+        If True, free the intermediate results when their last client is
+        done.
+    n_threads
+        The number of threads that run the thunks.
+
+    """
+
+    def __init__(self, nodes, thunks, pre_call_clear, fgraph, allow_gc,
+                 n_threads):
+        super(ParallelLoop, self).__init__(nodes, thunks, pre_call_clear)
+        self.allow_gc = allow_gc
+        self.n_threads = n_threads
+        self._tasks = None
+        self._done = None
+
+        node_idx = dict((node, i) for i, node in enumerate(nodes))
+        orderings = fgraph.orderings()
+        # successors[i] is the list of the nodes that wait for node i.
+        self.successors = [[] for node in nodes]
+        self.n_predecessors = []
+        for i, node in enumerate(nodes):
+            preds = set(node_idx[v.owner] for v in node.inputs
+                        if v.owner in node_idx)
+            preds.update(node_idx[p] for p in orderings.get(node, ()))
+            for p in preds:
+                self.successors[p].append(i)
+            self.n_predecessors.append(len(preds))
+        self.roots = [i for i, n in enumerate(self.n_predecessors) if n == 0]
+
+        # gc_inputs[i] is the list of (variable index, storage) of the
+        # intermediate results used by node i. n_clients[v] is the number of
+        # nodes that use the variable of index v.
+        self.gc_inputs = [[] for node in nodes]
+        self.n_clients = []
+        if allow_gc:
+            var_idx = {}
+            for i, (node, thunk) in enumerate(zip(nodes, thunks)):
+                for var, storage in zip(node.inputs, thunk.inputs):
+                    if (var.owner is None or var in fgraph.outputs or
+                            any(var is v for v, s in self.gc_inputs[i])):
+                        continue
+                    if var not in var_idx:
+                        var_idx[var] = len(self.n_clients)
+                        self.n_clients.append(0)
+                    self.n_clients[var_idx[var]] += 1
+                    self.gc_inputs[i].append((var, storage))
+            self.gc_inputs = [[(var_idx[var], storage)
+                               for var, storage in inputs]
+                              for inputs in self.gc_inputs]
+
+    def _start_threads(self):
+        tasks = queue.Queue()
+        done = queue.Queue()
+        for i in xrange(self.n_threads):
+            thread = threading.Thread(target=_parallel_loop_worker,
+                                      args=(tasks, done))
+            thread.daemon = True
+            thread.start()
+
+        def stop_threads(ref, tasks=tasks, n_threads=self.n_threads):
+            _parallel_loop_refs.discard(ref)
+            for i in xrange(n_threads):
+                tasks.put(None)
+        _parallel_loop_refs.add(weakref.ref(self, stop_threads))
+        self._tasks = tasks
+        self._done = done
+
+    def __call__(self):
+        for cont in self.pre_call_clear:
+            cont[0] = None
+        if self._tasks is None:
+            self._start_threads()
+        tasks = self._tasks
+        done = self._done
+        thunks = self.thunks
+        n_predecessors = list(self.n_predecessors)
+        n_clients = list(self.n_clients)
+        error = None
+
+        for i in self.roots:
+            tasks.put((i, thunks[i]))
+        n_running = len(self.roots)
+        while n_running:
+            i, t, exc_info = done.get()
+            n_running -= 1
+            if error is not None:
+                # Wait for the running thunks before raising.
+                continue
+            if exc_info is not None:
+                error = (i, exc_info)
+                continue
+            if self.time_thunks:
+                self.call_counts[i] += 1
+                self.call_times[i] += t
+            for j in self.successors[i]:
+                n_predecessors[j] -= 1
+                if n_predecessors[j] == 0:
+                    tasks.put((j, thunks[j]))
+                    n_running += 1
+            for v, storage in self.gc_inputs[i]:
+                n_clients[v] -= 1
+                if n_clients[v] == 0:
+                    storage[0] = None
+        if error is not None:
+            i, exc_info = error
+            link.raise_with_op(self.nodes[i], thunks[i], exc_info)
+
+
 class Stack(VM):
     """
     Finish-to-start evalution order of thunks.
@@ -714,11 +995,15 @@ class VM_Linker(link.LocalLinker):
     c_thunks
         If None or True, don't change the default. If False,
         don't compile c code for the thunks.
+    n_threads
+        Useful only when use_cloop is False. If bigger than 1 and the graph
+        doesn't need lazy evaluation, use the ParallelLoop VM with that many
+        threads. If None, use the Theano flag vm.n_threads.
 
     """
 
     def __init__(self, allow_gc=None, use_cloop=False, callback=None,
-                 lazy=None, schedule=None, c_thunks=None):
+                 lazy=None, schedule=None, c_thunks=None, n_threads=None):
         # Note: if more parameters are added to __init__, make sure to forward
         # them in the "type(self)(...)" call in the "accept" method below.
         if allow_gc is None:
@@ -729,6 +1014,9 @@ class VM_Linker(link.LocalLinker):
         self.callback = callback
         self.lazy = lazy
         self.c_thunks = c_thunks
+        if n_threads is None:
+            n_threads = config.vm.n_threads
+        self.n_threads = n_threads
         self.updated_vars = {}
         if schedule:
             self.schedule = schedule
@@ -776,6 +1064,7 @@ class VM_Linker(link.LocalLinker):
                 lazy=self.lazy,
                 schedule=self.schedule,
                 c_thunks=self.c_thunks,
+                n_threads=self.n_threads,
             ).accept(fgraph, no_recycling)
         self.fgraph = fgraph
         self.no_recycling = no_recycling
@@ -842,6 +1131,12 @@ class VM_Linker(link.LocalLinker):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
 
+        lazy = self.lazy
+        if lazy is None:
+            lazy = config.vm.lazy
+        if lazy is None:
+            lazy = not all([(not th.lazy) for th in thunks])
+
         if (self.callback is not None or
                 (config.profile and config.profile_memory)):
 
@@ -858,6 +1153,9 @@ class VM_Linker(link.LocalLinker):
                 self.fgraph, self.allow_gc,
                 dependencies=deps,
                 callback=self.callback)
+        elif self.n_threads > 1 and not self.use_cloop and not lazy:
+            vm = ParallelLoop(nodes, thunks, pre_call_clear,
+                              self.fgraph, self.allow_gc, self.n_threads)
         elif self.use_cloop:
             # create a map from nodes to ints and vars to ints
             nodes_idx = {}
@@ -968,11 +1266,6 @@ class VM_Linker(link.LocalLinker):
             )
             assert c0 == sys.getrefcount(node_n_inputs)
         else:
-            lazy = self.lazy
-            if lazy is None:
-                lazy = config.vm.lazy
-            if lazy is None:
-                lazy = not all([(not th.lazy) for th in thunks])
             if not lazy:
                 # there is no conditional in the graph
                 if self.allow_gc:
@@ -999,34 +1292,12 @@ class VM_Linker(link.LocalLinker):
                 )
         return vm
 
-    def make_all(self, profiler=None, input_storage=None,
-                 output_storage=None, storage_map=None,
-                 ):
-        fgraph = self.fgraph
-        order = self.schedule(fgraph)
-        no_recycling = self.no_recycling
-
-        input_storage, output_storage, storage_map = link.map_storage(
-            fgraph, order, input_storage, output_storage, storage_map)
-        compute_map = {}
-        for k in storage_map:
-            compute_map[k] = [k.owner is None]
+    def make_thunks(self, order, storage_map, compute_map):
+        """
+        Return the list of the thunks of the nodes in `order`.
 
+        """
         thunks = []
-
-        # Collect Reallocation Info
-        compute_map_re = defaultdict(lambda: [0])
-        for var in fgraph.inputs:
-            compute_map_re[var][0] = 1
-
-        if getattr(fgraph.profile, 'dependencies', None):
-            dependencies = getattr(fgraph.profile, 'dependencies')
-        else:
-            dependencies = self.compute_gc_dependencies(storage_map)
-
-        reallocated_info = calculate_reallocate_info(
-            order, fgraph, storage_map, compute_map_re, dependencies)
-
         for node in order:
             try:
                 if self.c_thunks is False:
@@ -1034,7 +1305,7 @@ class VM_Linker(link.LocalLinker):
                 thunks.append(node.op.make_thunk(node,
                                                  storage_map,
                                                  compute_map,
-                                                 no_recycling))
+                                                 self.no_recycling))
                 if not hasattr(thunks[-1], 'lazy'):
                     # We don't want all ops maker to think about lazy Ops.
                     # So if they didn't specify that its lazy or not, it isn't.
@@ -1044,20 +1315,106 @@ class VM_Linker(link.LocalLinker):
                 e.args = ("The following error happened while"
                           " compiling the node", node, "\n") + e.args
                 raise
-        for node, thunk in zip(order, thunks):
-            thunk.inputs = [storage_map[v] for v in node.inputs]
-            thunk.outputs = [storage_map[v] for v in node.outputs]
+        return thunks
+
+    def make_all(self, profiler=None, input_storage=None,
+                 output_storage=None, storage_map=None,
+                 ):
+        fgraph = self.fgraph
+        order = self.schedule(fgraph)
+        no_recycling = self.no_recycling
+
+        input_storage, output_storage, storage_map = link.map_storage(
+            fgraph, order, input_storage, output_storage, storage_map)
+        compute_map = {}
+        for k in storage_map:
+            compute_map[k] = [k.owner is None]
 
         lazy = self.lazy
         if lazy is None:
             lazy = config.vm.lazy
+        # Only Loop and LoopGC execute the nodes in `order`. The ParallelLoop
+        # can also run two nodes that share a storage at the same time.
+        loop_vm = not (lazy or self.use_cloop or self.callback or
+                       self.n_threads > 1)
+        # The memory profile needs the storage of each variable.
+        reuse_storage = loop_vm and not (config.profile and
+                                         config.profile_memory)
+
+        # Collect Reallocation Info
+        if config.vm.memory_plan:
+            if loop_vm:
+                storage_plan = calculate_storage_plan(order, fgraph,
+                                                      storage_map)
+            else:
+                # The other VMs wouldn't use it, and the profile would
+                # report memory savings that don't happen.
+                storage_plan = []
+            reallocated_info = {}
+        else:
+            storage_plan = []
+            compute_map_re = defaultdict(lambda: [0])
+            for var in fgraph.inputs:
+                compute_map_re[var][0] = 1
+
+            if getattr(fgraph.profile, 'dependencies', None):
+                dependencies = getattr(fgraph.profile, 'dependencies')
+            else:
+                dependencies = self.compute_gc_dependencies(storage_map)
+
+            reallocated_info = calculate_reallocate_info(
+                order, fgraph, storage_map, compute_map_re, dependencies)
+
+        # The storage must be shared before building the thunks, as they
+        # keep a reference to the storage of their inputs and outputs.
+        planned_storage_map = storage_map
+        if reuse_storage and storage_plan:
+            planned_storage_map = dict(storage_map)
+            for group in storage_plan:
+                for var in group[1:]:
+                    planned_storage_map[var] = storage_map[group[0]]
+
+        if (config.cmodule.compilation_workers > 1 and
+                self.c_thunks is not False):
+            # Compile all the missing C modules at once, so that the
+            # make_thunk calls below only need to load them.
+            theano.gof.cc.precompile_nodes(order, no_recycling)
+
+        thunks = self.make_thunks(order, planned_storage_map, compute_map)
+
         if lazy is None:
             lazy = not all([(not th.lazy) for th in thunks])
-        if not (lazy or (config.profile and config.profile_memory) or
-                self.use_cloop or self.callback):
+            if lazy:
+                reuse_storage = False
+                storage_plan = []
+                if planned_storage_map is not storage_map:
+                    # The Stack doesn't follow `order`, so the storage can't
+                    # be shared.
+                    planned_storage_map = storage_map
+                    thunks = self.make_thunks(order, storage_map,
+                                              compute_map)
+        storage_map = planned_storage_map
+
+        for node, thunk in zip(order, thunks):
+            thunk.inputs = [storage_map[v] for v in node.inputs]
+            thunk.outputs = [storage_map[v] for v in node.outputs]
+
+        if reuse_storage:
             for pair in itervalues(reallocated_info):
                 storage_map[pair[1]] = storage_map[pair[0]]
 
+        # The variables of a group use the shared storage one after the
+        # other, so it is only cleared after the last use of the last one.
+        # Like the reallocated scalars, the storage of scalars is kept
+        # between calls.
+        shared_storage = set()
+        if reuse_storage:
+            for group in storage_plan:
+                if getattr(group[0], 'ndim', None) == 0:
+                    shared_storage.update(group)
+                else:
+                    shared_storage.update(group[:-1])
+
         computed, last_user = link.gc_helper(order)
         if self.allow_gc:
             post_thunk_clear = []
@@ -1067,7 +1424,8 @@ class VM_Linker(link.LocalLinker):
                     if (input in computed and
                             input not in fgraph.outputs and
                             node == last_user[input] and
-                            input not in reallocated_info):
+                            input not in reallocated_info and
+                            input not in shared_storage):
                         clear_after_this_thunk.append(storage_map[input])
                 post_thunk_clear.append(clear_after_this_thunk)
         else:
@@ -1082,6 +1440,7 @@ class VM_Linker(link.LocalLinker):
                           )
 
         vm.storage_map = storage_map
+        vm.storage_plan = storage_plan
 
         return (vm,
                 [link.Container(input, storage)
@@ -1095,3 +1454,5 @@ class VM_Linker(link.LocalLinker):
         self.__dict__.update(d)
         if not hasattr(self, 'c_thunks'):
             self.c_thunks = True
+        if not hasattr(self, 'n_threads'):
+            self.n_threads = 1
@@ -6,7 +6,7 @@ import time
 import warnings
 
 import numpy  # for numeric_grad
-from six import itervalues
+from six import iteritems, itervalues
 
 import theano
 
@@ -359,7 +359,8 @@ def Lop(f, wrt, eval_points, consider_constant=None,
 
 def grad(cost, wrt, consider_constant=None,
          disconnected_inputs='raise', add_names=True,
-         known_grads=None, return_disconnected='zero'):
+         known_grads=None, return_disconnected='zero',
+         rematerialize=None):
     """
     Return symbolic gradients for one or more variables with respect to some
     cost.
@@ -406,6 +407,19 @@ def grad(cost, wrt, consider_constant=None,
                    None
         - 'Disconnected' : returns variables of type DisconnectedType
 
+    :type rematerialize: None, False, list of variables or number
+    :param rematerialize: Trade computation for memory by keeping only
+        some intermediate results of the graph (the checkpoints) for the
+        gradient. The other intermediate results needed by the gradient are
+        recomputed from the checkpoints during the backward pass, so they
+        don't stay in memory between the forward and the backward pass.
+        - None : The checkpoints are the variables marked with
+                 `checkpoint`. If there are none, nothing is recomputed.
+        - False : Nothing is recomputed.
+        - list of variables : The checkpoints.
+        - number : A memory budget in bytes given to `plan_checkpoints`,
+                   that chooses the checkpoints.
+
     :rtype: variable or list/tuple of Variables (matching `wrt`)
 
     :return: symbolic expression of gradient of `cost` with respect to each
@@ -543,8 +557,17 @@ def grad(cost, wrt, consider_constant=None,
         if hasattr(g.type, 'dtype'):
             assert g.type.dtype in tensor.float_dtypes
 
+    if rematerialize is None:
+        checkpoints = _marked_checkpoints(var_to_app_to_idx) or None
+    elif rematerialize is False:
+        checkpoints = None
+    elif isinstance(rematerialize, (list, tuple)):
+        checkpoints = set(rematerialize)
+    else:
+        checkpoints = set(plan_checkpoints(outputs, rematerialize))
+
     rval = _populate_grad_dict(var_to_app_to_idx,
-                               grad_dict, wrt, cost_name)
+                               grad_dict, wrt, cost_name, checkpoints)
 
     for i in xrange(len(rval)):
         if isinstance(rval[i].type, DisconnectedType):
@@ -912,7 +935,7 @@ class DisconnectedInputError(ValueError):
 
 
 def _populate_grad_dict(var_to_app_to_idx,
-                        grad_dict, wrt, cost_name=None):
+                        grad_dict, wrt, cost_name=None, checkpoints=None):
     """
         Helper function for grad function.
 
@@ -936,6 +959,11 @@ def _populate_grad_dict(var_to_app_to_idx,
                     used to name the grad with respect to x as
                     (d<cost_name>/dx)
 
+        checkpoints: If not None, a set of variables. The other
+                    intermediate results passed to the grad methods of the
+                    Ops are recomputed from the checkpoints (see the
+                    rematerialize argument of grad).
+
         returns: a list of gradients corresponding to wrt
 
     """
@@ -943,6 +971,35 @@ def _populate_grad_dict(var_to_app_to_idx,
     # its inputs' gradients
     term_dict = OrderedDict()
 
+    # map a variable to its recomputation from the checkpoints
+    recomputed = {}
+
+    def recompute(var, after):
+        """ Return a copy of the computation of var from the checkpoints,
+        that can only start once `after` is computed """
+        if var not in recomputed:
+            if isinstance(var, gof.Constant):
+                recomputed[var] = var
+            elif var.owner is None or var in checkpoints:
+                # The Recompute op keeps the copy from being merged with the
+                # forward computation and from being executed before the
+                # backward pass needs it.
+                recomputed[var] = recompute_(var, after)
+            else:
+                new_inputs = [recompute(ipt, after)
+                              for ipt in var.owner.inputs]
+                new_node = var.owner.clone_with_new_inputs(new_inputs)
+                for out, new_out in zip(var.owner.outputs,
+                                        new_node.outputs):
+                    recomputed[out] = new_out
+        return recomputed[var]
+
+    def rematerialize(var, after):
+        if (after is None or var.owner is None or var in checkpoints or
+                isinstance(var, gof.Constant)):
+            return var
+        return recompute(var, after)
+
     def access_term_cache(node):
         """ Populates term_dict[node] and returns it """
 
@@ -1023,6 +1080,17 @@ def _populate_grad_dict(var_to_app_to_idx,
 
                 inputs = [try_to_copy_if_needed(ipt) for ipt in inputs]
 
+                if checkpoints is not None:
+                    # The recomputation starts with the backward pass of
+                    # this node.
+                    after = None
+                    for og in output_grads:
+                        if not isinstance(og.type,
+                                          (NullType, DisconnectedType)):
+                            after = og
+                            break
+                    inputs = [rematerialize(ipt, after) for ipt in inputs]
+
                 # Build a list of output gradients with the same dtype as
                 # the corresponding output variable.
                 # If an output is of a float dtype, we want to cast the
@@ -2020,3 +2088,153 @@ def grad_clip(x, lower_bound, upper_bound):
 
     """
     return GradClip(lower_bound, upper_bound)(x)
+
+
+class Checkpoint(ViewOp):
+    # See doc in user fct checkpoint
+    pass
+
+
+checkpoint_ = Checkpoint()
+
+
+def checkpoint(x):
+    """
+    Mark an expression as a checkpoint for the rematerialization of grad.
+
+    The expression itself is unaffected. When the gradient of an expression
+    that uses it is computed with the default `rematerialize` argument of
+    `grad`, the intermediate results between the checkpoints that the
+    gradient needs are recomputed from the checkpoints during the backward
+    pass instead of being kept from the forward pass. This reduces the
+    memory used by the training graphs of deep networks, at the cost of
+    computing the forward pass of the recomputed parts twice.
+
+    :param x: A Theano expression to keep for the backward pass.
+
+    :return: The expression is returned unmodified, but it is now a
+        checkpoint.
+
+    :examples:
+
+        x = theano.tensor.matrix()
+        h = x
+        for w in weights:
+            h = theano.gradient.checkpoint(theano.tensor.tanh(h.dot(w)))
+        g = theano.grad(h.sum(), weights)
+
+    :note: We register an opt in tensor/opt.py that remove the Checkpoint.
+    """
+    return checkpoint_(x)
+
+
+class Recompute(ViewOp):
+    """
+    Return a view of its first input, once its second input is computed.
+
+    The recomputation of the intermediate results by `grad` starts from the
+    checkpoints passed through this op, with a gradient of the backward
+    pass as second input. That way, the recomputation isn't merged with the
+    forward computation, and it isn't executed before the backward pass
+    needs it.
+
+    """
+
+    def make_node(self, x, after):
+        return gof.Apply(self, [x, after], [x.type()])
+
+    def perform(self, node, inp, out):
+        out[0][0] = inp[0]
+
+    def c_code(self, node, nodename, inp, out, sub):
+        return super(Recompute, self).c_code(node, nodename, inp[:1], out,
+                                             sub)
+
+    def infer_shape(self, node, input_shapes):
+        return input_shapes[:1]
+
+    def grad(self, args, g_outs):
+        return [g_outs[0], disconnected_type()]
+
+    def connection_pattern(self, node):
+        return [[True], [False]]
+
+
+recompute_ = Recompute()
+
+
+def _marked_checkpoints(var_to_app_to_idx):
+    """
+    Return the set of the variables marked with `checkpoint` in the graph
+    described by var_to_app_to_idx, with the variables they mark.
+    """
+    checkpoints = set()
+    for var, app_to_idx in iteritems(var_to_app_to_idx):
+        for app in app_to_idx:
+            if isinstance(app.op, Checkpoint):
+                checkpoints.update(app.inputs + app.outputs)
+    return checkpoints
+
+
+def _variable_size(var):
+    """
+    Return the size in bytes of the test value of var, or 1 if it is
+    unknown.
+    """
+    if isinstance(var, gof.Constant):
+        value = var.data
+    else:
+        value = getattr(var.tag, 'test_value', None)
+    if value is None or not hasattr(var.type, 'get_size'):
+        return 1
+    try:
+        return var.type.get_size(value.shape)
+    except Exception:
+        return 1
+
+
+def plan_checkpoints(outputs, memory_budget, sizes=None):
+    """
+    Choose the checkpoints for the rematerialization of grad.
+
+    The nodes computing `outputs` are visited in topological order, and an
+    output of a node becomes a checkpoint as soon as the intermediate
+    results computed since the previous checkpoint take more than
+    `memory_budget` bytes. So during the backward pass, the recomputed
+    results of each segment between two checkpoints take about
+    `memory_budget` bytes. This is the greedy planner of Chen et al.,
+    "Training Deep Nets with Sublinear Memory Cost", 2016.
+
+    :type outputs: variable or list of variables
+    :param outputs: The variables that will be differentiated, like the
+        cost.
+
+    :type memory_budget: number
+    :param memory_budget: The memory in bytes allowed for each segment.
+
+    :type sizes: dict
+    :param sizes: An optional dict mapping variables to their size in
+        bytes, like the sizes measured by the memory profile of a previous
+        run (see `ProfileStats.variable_shape`). The variables missing from
+        it use the size of their test value if they have one (see
+        config.compute_test_value), else they count for 1 byte.
+
+    :rtype: list of variables
+    :return: The checkpoints, in topological order.
+    """
+    if not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+    if sizes is None:
+        sizes = {}
+    checkpoints = []
+    segment_size = 0
+    for node in gof.graph.io_toposort(gof.graph.inputs(outputs), outputs):
+        for var in node.outputs:
+            size = sizes.get(var)
+            if size is None:
+                size = _variable_size(var)
+            segment_size += size
+            if segment_size > memory_budget:
+                checkpoints.append(var)
+                segment_size = 0
+    return checkpoints
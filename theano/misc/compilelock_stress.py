@@ -0,0 +1,95 @@
+"""
+Start several processes that compile functions at the same time in a shared
+compilation directory, and report how long each of them waited for the
+compilation locks.
+
+"""
+from __future__ import print_function
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+parser = OptionParser(usage='%prog <options>\n Measure the time spent'
+                      ' waiting for the compilation locks by concurrent'
+                      ' processes')
+parser.add_option('-N', '--N', action='store', dest='N',
+                  default=8, type="int",
+                  help="Number of processes to start")
+parser.add_option('--n-graphs', action='store', dest='n_graphs',
+                  default=5, type="int",
+                  help="Number of functions compiled by each process")
+parser.add_option('--compiledir', action='store', dest='compiledir',
+                  default=None,
+                  help="Shared compilation directory (default: a new"
+                  " temporary directory)")
+parser.add_option('--worker', action='store', dest='worker',
+                  default=None, type="int",
+                  help="Internal: run as worker number WORKER")
+
+
+def compile_graphs(worker, n_graphs):
+    import theano
+    import theano.tensor as T
+    from theano.gof import compilelock
+
+    # lock_wait_time also counts the waits of the import of theano.
+    t0 = time.time()
+    waited0 = compilelock.lock_wait_time
+    x = T.dvector('x')
+    for i in range(n_graphs):
+        # The constants are inlined in the C code, so each worker compiles
+        # its own modules, except for the first graph that all workers share.
+        c = 0 if i == 0 else worker * n_graphs + i
+        theano.function([x], T.tanh(x * (c + 1.5)) + c)
+    return time.time() - t0, compilelock.lock_wait_time - waited0
+
+
+def run_workers(N, n_graphs, compiledir):
+    script = os.path.abspath(__file__)
+    env = dict(os.environ)
+    env['THEANO_FLAGS'] = (env.get('THEANO_FLAGS', '') +
+                           ',base_compiledir=%s' % compiledir)
+    procs = [subprocess.Popen([sys.executable, script, '--worker', str(i),
+                               '--n-graphs', str(n_graphs)],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              env=env)
+             for i in range(N)]
+    results = []
+    for i, proc in enumerate(procs):
+        out, err = proc.communicate()
+        if proc.returncode:
+            print(err.decode())
+            sys.exit(1)
+        results.append(list(map(float, out.decode().split())))
+    return results
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args(sys.argv)
+    if options.worker is not None:
+        total, waited = compile_graphs(options.worker, options.n_graphs)
+        sys.stdout.write("%2.6f %2.6f\n" % (total, waited))
+        sys.stdout.flush()
+        sys.exit(0)
+
+    compiledir = options.compiledir
+    if compiledir is None:
+        compiledir = tempfile.mkdtemp()
+    try:
+        t0 = time.time()
+        results = run_workers(options.N, options.n_graphs, compiledir)
+        wall = time.time() - t0
+    finally:
+        if options.compiledir is None:
+            shutil.rmtree(compiledir, ignore_errors=True)
+
+    print("%d processes compiling %d functions each in %s" % (
+        options.N, options.n_graphs, compiledir))
+    for i, (total, waited) in enumerate(results):
+        print("process %2d: compilation %8.3fs, waiting for locks %8.3fs"
+              " (%5.1f%%)" % (i, total, waited, 100. * waited / total))
+    print("wall time %.3fs, mean lock wait %.3fs" % (
+        wall, sum(r[1] for r in results) / len(results)))
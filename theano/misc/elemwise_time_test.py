@@ -1,5 +1,6 @@
 from __future__ import print_function
 from optparse import OptionParser
+import math
 import sys
 import time
 
@@ -17,6 +18,16 @@ parser.add_option('-N', '--N', action='store', dest='N',
 parser.add_option('--script', action='store_true', dest='script',
                   default=False,
                   help="Run program as script and print results on stdoutput")
+parser.add_option('--reduce', action='store_true', dest='reduce',
+                  default=False,
+                  help="Time a full sum, a sum over the rows and a strided"
+                  " elemwise of a matrix of about N elements")
+parser.add_option('--sum', action='store_true', dest='sum',
+                  default=False,
+                  help="Compare the time and the relative error of float32"
+                  " sums with a float32 accumulator, with the pairwise"
+                  " summation and with a float64 accumulator, which is"
+                  " what Sum does when tensor.pairwise_sum is False")
 
 
 def evalTime(f, v, script=False, loops=1000):
@@ -47,12 +58,69 @@ def ElemwiseOpTime(N, script=False, loops=1000):
     costlyTime = evalTime(f1, v, script=script, loops=loops)
     return (ceapTime, costlyTime)
 
+
+def ReduceOpTime(N, script=False, loops=1000):
+    x = T.matrix('x')
+    np.random.seed(1235)
+    rows = max(int(np.sqrt(N)), 1)
+    # Twice the rows, so that the strided view has about N elements
+    v = np.random.random((2 * rows, max(N // rows, 1))).astype(
+        theano.config.floatX)
+    f_all = theano.function([x], x.sum())
+    f_rows = theano.function([x], x.sum(axis=1))
+    f_strided = theano.function([x], 2 * x + x * x)
+    times = []
+    for name, f, data in [("Full sum", f_all, v[:rows]),
+                          ("Sum of rows", f_rows, v[:rows]),
+                          ("Strided elemwise", f_strided, v[::2])]:
+        if not script:
+            print("%s " % name, end=' ')
+        times.append(evalTime(f, data, script=script, loops=loops))
+    return times
+
+
+def SumPrecisionTime(N, script=False, loops=1000):
+    x = T.vector('x', dtype='float32')
+    np.random.seed(1235)
+    v = np.random.random(N).astype('float32')
+    exact = math.fsum(v.astype('float64'))
+    results = []
+    for name, s in [
+            ("float32 accumulator",
+             T.elemwise.Sum(acc_dtype='float32', pairwise=False)(x)),
+            ("float32 pairwise",
+             T.elemwise.Sum(acc_dtype='float32', pairwise=True)(x)),
+            # The default of Sum without pairwise summation
+            ("float64 accumulator",
+             T.elemwise.Sum(pairwise=False)(x))]:
+        f = theano.function([x], s)
+        error = abs(float(f(v)) - exact) / exact
+        if not script:
+            print("%s relative error %.3g" % (name, error), end=' ')
+        results.append((evalTime(f, v, script=script, loops=loops), error))
+    return results
+
 if __name__ == '__main__':
     options, arguments = parser.parse_args(sys.argv)
     if hasattr(options, "help"):
         print(options.help)
         sys.exit(0)
 
+    if options.sum:
+        results = SumPrecisionTime(N=options.N, script=options.script)
+        if options.script:
+            sys.stdout.write(" ".join("%2.9f %.3g" % r for r in results) +
+                             "\n")
+            sys.stdout.flush()
+        sys.exit(0)
+
+    if options.reduce:
+        times = ReduceOpTime(N=options.N, script=options.script)
+        if options.script:
+            sys.stdout.write(" ".join("%2.9f" % t for t in times) + "\n")
+            sys.stdout.flush()
+        sys.exit(0)
+
     (cheapTime, costlyTime) = ElemwiseOpTime(N=options.N,
                                              script=options.script)
 
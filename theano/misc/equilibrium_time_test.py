@@ -0,0 +1,63 @@
+"""
+Compare the optimization time of a large graph with the default and the
+incremental (optdb.incremental) modes of the EquilibriumOptimizer.
+
+"""
+from __future__ import print_function
+from optparse import OptionParser
+
+import theano
+import theano.tensor as T
+from six.moves import xrange
+
+parser = OptionParser(usage='%prog <options>\n Compare the optimization time'
+                      ' of the default and incremental EquilibriumOptimizer')
+parser.add_option('-N', '--N', action='store', dest='N',
+                  default=10000, type="int",
+                  help="Approximative number of nodes in the graph")
+parser.add_option('--chain', action='store', dest='chain',
+                  default=100, type="int",
+                  help="Number of steps in each independent chain")
+
+
+def build_graph(N, chain):
+    # Each step creates 6 nodes. The optimizations of a step enable
+    # optimizations of the next one, so the equilibrium needs several
+    # passes.
+    x = T.vector('x')
+    outs = []
+    for i in xrange(max(1, N // (6 * chain))):
+        y = x
+        for j in xrange(chain):
+            y = -(-((y * 2 + x) * 1 - 0))
+        outs.append(y)
+    return x, outs
+
+
+def optimization_time(N, chain, incremental):
+    x, outs = build_graph(N, chain)
+    profile = theano.compile.ProfileStats(atexit_print=False)
+    orig = theano.config.optdb.incremental
+    theano.config.optdb.incremental = incremental
+    try:
+        f = theano.function([x], outs, mode=theano.Mode(linker='py'),
+                            profile=profile)
+    finally:
+        theano.config.optdb.incremental = orig
+    return profile.optimizer_time, f.maker.fgraph
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args()
+    x, outs = build_graph(options.N, options.chain)
+    print("Graph of %d nodes" % len(theano.gof.graph.io_toposort([x], outs)))
+    default, g1 = optimization_time(options.N, options.chain, False)
+    incremental, g2 = optimization_time(options.N, options.chain, True)
+    print("default     optimization time %.3fs, %d nodes after" % (
+        default, len(g1.apply_nodes)))
+    print("incremental optimization time %.3fs, %d nodes after" % (
+        incremental, len(g2.apply_nodes)))
+    print("speed up %.2fx" % (default / incremental))
+    same = (theano.printing.debugprint(g1.outputs, file='str') ==
+            theano.printing.debugprint(g2.outputs, file='str'))
+    print("same optimized graph: %s" % same)
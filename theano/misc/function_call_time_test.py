@@ -0,0 +1,92 @@
+"""
+Measure the overhead of calling a Theano function with 1, 10 and 100
+inputs, with the call path for positional arguments, with the general call
+path (used for keyword arguments) and with trust_input=True.
+
+Then compare a Python loop of calls with Function.map, with and without
+stacking the calls into one batch.
+
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import time
+
+import numpy as np
+
+import theano
+import theano.tensor as T
+from six.moves import xrange
+
+parser = OptionParser(usage='%prog <options>\n Measure the call overhead'
+                      ' of Theano functions')
+parser.add_option('--loops', action='store', dest='loops',
+                  default=10000, type="int",
+                  help="Number of calls of each function")
+parser.add_option('--linker', action='store', dest='linker',
+                  default='cvm', help="Linker of the functions")
+parser.add_option('--n-calls', action='store', dest='n_calls',
+                  default=1000, type="int",
+                  help="Number of calls done by Function.map")
+
+
+def call_time(f, args, loops, kwargs=None):
+    best = 1e10
+    for i in xrange(5):
+        t0 = time.time()
+        if kwargs is None:
+            for j in xrange(loops):
+                f(*args)
+        else:
+            for j in xrange(loops):
+                f(**kwargs)
+        best = min(best, time.time() - t0)
+    return best / loops
+
+
+def bench(n_inputs, loops, linker):
+    xs = [T.vector('x%d' % i) for i in xrange(n_inputs)]
+    f = theano.function(xs, theano.Out(T.add(*xs), borrow=True),
+                        mode=theano.Mode(linker=linker))
+    args = [np.ones(1, dtype=theano.config.floatX)
+            for i in xrange(n_inputs)]
+    kwargs = dict(('x%d' % i, a) for i, a in enumerate(args))
+
+    fast = call_time(f, args, loops)
+    general = call_time(f, None, loops, kwargs)
+    f.trust_input = True
+    trusted = call_time(f, args, loops)
+    print("%3d inputs: positional %8.2fus, keywords %8.2fus,"
+          " trust_input %8.2fus" % (n_inputs, fast * 1e6, general * 1e6,
+                                    trusted * 1e6))
+
+
+def bench_map(n_calls, linker, size=64):
+    mode = theano.Mode(linker=linker)
+    w = theano.shared(np.random.rand(size, size).astype(theano.config.floatX))
+    x = T.vector('x')
+    f = theano.function([x], T.tanh(T.dot(x, w)), mode=mode)
+    xb = T.matrix('xb')
+    f_batch = theano.function([xb], T.tanh(T.dot(xb, w)), mode=mode)
+    args_list = [(np.random.rand(size).astype(theano.config.floatX),)
+                 for i in xrange(n_calls)]
+
+    def best_of(g):
+        best = 1e10
+        for i in xrange(5):
+            t0 = time.time()
+            g()
+            best = min(best, time.time() - t0)
+        return best
+
+    loop = best_of(lambda: [f(*args) for args in args_list])
+    mapped = best_of(lambda: f.map(args_list))
+    stacked = best_of(lambda: f_batch.map(args_list, stack=True))
+    print("%d calls: python loop %.2fms, map %.2fms, map(stack=True) %.2fms"
+          % (n_calls, loop * 1e3, mapped * 1e3, stacked * 1e3))
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args()
+    for n in [1, 10, 100]:
+        bench(n, options.loops, options.linker)
+    bench_map(options.n_calls, options.linker)
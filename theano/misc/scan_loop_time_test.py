@@ -0,0 +1,87 @@
+"""
+Compare the time of an LSTM with a small hidden size, computed by a scan
+with the default implementation and with the C loop of the CVM
+(config.scan.compiled_loop).
+
+"""
+from __future__ import print_function
+from optparse import OptionParser
+import time
+
+import numpy
+
+import theano
+import theano.tensor as T
+
+parser = OptionParser(usage='%prog <options>\n Compare the time of a small'
+                      ' LSTM with and without scan.compiled_loop')
+parser.add_option('-n', '--n_steps', action='store', dest='n_steps',
+                  default=2000, type="int",
+                  help="The number of steps of the scan")
+parser.add_option('--hidden', action='store', dest='hidden',
+                  default=10, type="int",
+                  help="The hidden size of the LSTM")
+parser.add_option('--batch', action='store', dest='batch',
+                  default=1, type="int",
+                  help="The number of sequences computed together")
+parser.add_option('--iter', action='store', dest='iter',
+                  default=10, type="int",
+                  help="The number of calls of the function")
+
+
+def lstm(hidden):
+    x = T.tensor3('x')
+    rng = numpy.random.RandomState(23455)
+    floatX = theano.config.floatX
+    W = theano.shared(rng.uniform(-.1, .1, (hidden, 4 * hidden)).astype(floatX))
+    U = theano.shared(rng.uniform(-.1, .1, (hidden, 4 * hidden)).astype(floatX))
+    b = theano.shared(numpy.zeros(4 * hidden, dtype=floatX))
+
+    def step(x_t, h_tm1, c_tm1, W, U, b):
+        gates = T.dot(x_t, W) + T.dot(h_tm1, U) + b
+        i = T.nnet.sigmoid(gates[:, :hidden])
+        f = T.nnet.sigmoid(gates[:, hidden:2 * hidden])
+        o = T.nnet.sigmoid(gates[:, 2 * hidden:3 * hidden])
+        g = T.tanh(gates[:, 3 * hidden:])
+        c_t = f * c_tm1 + i * g
+        h_t = o * T.tanh(c_t)
+        return h_t, c_t
+
+    h0 = T.zeros((x.shape[1], hidden), dtype=floatX)
+    (h, c), _ = theano.scan(step, sequences=[x],
+                            outputs_info=[h0, h0],
+                            non_sequences=[W, U, b])
+    return x, h
+
+
+def run(n_steps, hidden, batch, n_iter, compiled_loop):
+    x, h = lstm(hidden)
+    orig = theano.config.scan.compiled_loop
+    theano.config.scan.compiled_loop = compiled_loop
+    try:
+        f = theano.function([x], h)
+    finally:
+        theano.config.scan.compiled_loop = orig
+    x_val = numpy.random.rand(n_steps, batch, hidden).astype(
+        theano.config.floatX)
+    f(x_val)
+    t0 = time.time()
+    for i in range(n_iter):
+        out = f(x_val)
+    return (time.time() - t0) / n_iter, out
+
+
+if __name__ == '__main__':
+    options, arguments = parser.parse_args()
+    default, out1 = run(options.n_steps, options.hidden, options.batch,
+                        options.iter, False)
+    compiled, out2 = run(options.n_steps, options.hidden, options.batch,
+                         options.iter, True)
+    print("LSTM of %d steps, hidden size %d, batch size %d" % (
+        options.n_steps, options.hidden, options.batch))
+    print("default scan  %.5fs per call, %.2fus per step" % (
+        default, default / options.n_steps * 1e6))
+    print("compiled loop %.5fs per call, %.2fus per step" % (
+        compiled, compiled / options.n_steps * 1e6))
+    print("speed up %.2fx" % (default / compiled))
+    print("same results: %s" % numpy.allclose(out1, out2))
@@ -64,6 +64,7 @@ from theano.compat import OrderedDict
 from theano.scan_module import scan_op
 from theano.scan_module import scan_utils
 from theano.scan_module.scan_utils import safe_new, traverse
+from theano.scan_module.scan_checkpoints import scan_checkpoints
 
 # Logging function for sending warning or info
 _logger = logging.getLogger('theano.scan_module.scan')
@@ -80,7 +81,8 @@ def scan(fn,
          name=None,
          profile=False,
          allow_gc=None,
-         strict=False):
+         strict=False,
+         checkpoint_every=None):
     """
     This function constructs and applies a Scan op to the provided
     arguments.
@@ -319,6 +321,15 @@ def scan(fn,
         If true, all the shared variables used in ``fn`` must be provided as a
         part of ``non_sequences`` or ``sequences``.
 
+    checkpoint_every
+        If not None, the gradient of ``scan`` only stores the states every
+        ``checkpoint_every`` steps and recomputes the steps in between
+        during the backward pass (see `scan_checkpoints`). Larger values
+        store fewer states but recompute longer segments at once; about
+        the square root of the number of steps uses the least memory.
+        Only the sequences with the taps [0], the outputs with the taps
+        [-1] or without taps and the non sequences are supported.
+
     Returns
     -------
     tuple
@@ -333,6 +344,23 @@ def scan(fn,
         are validated to be consistent.
 
     """
+    if checkpoint_every is not None:
+        if truncate_gradient != -1:
+            raise ValueError("checkpoint_every can't be used with"
+                             " truncate_gradient")
+        return scan_checkpoints(fn,
+                                sequences=sequences,
+                                outputs_info=outputs_info,
+                                non_sequences=non_sequences,
+                                n_steps=n_steps,
+                                save_every_N=checkpoint_every,
+                                go_backwards=go_backwards,
+                                mode=mode,
+                                name=name,
+                                profile=profile,
+                                allow_gc=allow_gc,
+                                strict=strict)
+
     # General observation : this code is executed only once, at creation
     # of the computational graph, so we don't yet need to be smart about
     # anything (to speed things up)
@@ -0,0 +1,203 @@
+"""
+Scan with a checkpointed gradient.
+
+`scan_checkpoints` computes the same outputs as `scan`, but the steps are
+grouped in segments of `save_every_N` steps: an outer scan loops over the
+segments and an inner scan loops over the steps of one segment. The
+gradient of the outer scan only stores the states at the start of each
+segment, and the gradient of the inner scan recomputes the states of one
+segment at a time during the backward pass. The states kept for the
+gradient go from `n_steps` to about `n_steps / save_every_N + save_every_N`,
+for the cost of computing the forward steps a second time.
+
+"""
+from __future__ import print_function
+
+from six.moves import xrange
+
+import theano
+from theano import gof
+from theano import tensor
+from theano.tensor import opt
+from theano.updates import OrderedUpdates
+from theano.scan_module import scan_utils
+
+
+def _wrap_into_list(x):
+    if x is None:
+        return []
+    elif not isinstance(x, (list, tuple)):
+        return [x]
+    else:
+        return list(x)
+
+
+def _sequence_input(seq):
+    if isinstance(seq, dict):
+        if list(seq.get('taps', None) or [0]) != [0]:
+            raise ValueError("scan_checkpoints only supports sequences with"
+                             " the taps [0]", seq)
+        seq = seq['input']
+    return tensor.as_tensor_variable(seq)
+
+
+def _initial_state(info):
+    if isinstance(info, dict):
+        if info.get('initial', None) is None:
+            return None
+        if list(info.get('taps', None) or [-1]) != [-1]:
+            raise ValueError("scan_checkpoints only supports outputs with"
+                             " the taps [-1]", info)
+        info = info['initial']
+    if info is None:
+        return None
+    return tensor.as_tensor_variable(info)
+
+
+def _join_segments(out, n_steps):
+    # out has the shape (n_segments, save_every_N) + shape of one step.
+    shape = ([out.shape[0] * out.shape[1]] +
+             [out.shape[i] for i in xrange(2, out.ndim)])
+    return out.reshape(shape, ndim=out.ndim - 1)[:n_steps]
+
+
+def scan_checkpoints(fn,
+                     sequences=None,
+                     outputs_info=None,
+                     non_sequences=None,
+                     n_steps=None,
+                     save_every_N=10,
+                     go_backwards=False,
+                     mode=None,
+                     name=None,
+                     profile=False,
+                     allow_gc=None,
+                     strict=False):
+    """
+    Scan whose gradient stores the states only every `save_every_N` steps.
+
+    The arguments and the outputs are the same as the ones of `scan`. The
+    gradient recomputes the states of a segment of `save_every_N` steps from
+    the state stored at its start, so a smaller `save_every_N` keeps more
+    states in memory and a larger one keeps longer segments. Using about
+    the square root of the number of steps minimises the memory.
+
+    Parameters
+    ----------
+    save_every_N
+        The number of steps of a segment. The last segment is padded when
+        the number of steps is not a multiple of `save_every_N`; the states
+        are not updated during the padding.
+
+    Notes
+    -----
+    Only the sequences with the taps [0], the outputs with the taps [-1] or
+    without taps and the non sequences are supported. `fn` can't return
+    updates or a stopping condition, and `truncate_gradient` is not
+    available.
+
+    """
+    save_every_N = int(save_every_N)
+    if save_every_N < 1:
+        raise ValueError("save_every_N must be at least 1, got %d" %
+                         save_every_N)
+    if name is None:
+        name = 'scan_checkpoints_fn'
+    seqs = [_sequence_input(s) for s in _wrap_into_list(sequences)]
+    init_states = [_initial_state(o) for o in _wrap_into_list(outputs_info)]
+    non_seqs = [x if isinstance(x, gof.Variable)
+                else tensor.as_tensor_variable(x)
+                for x in _wrap_into_list(non_sequences)]
+    is_state = [s is not None for s in init_states]
+    states = [s for s in init_states if s is not None]
+
+    if go_backwards:
+        seqs = [s[::-1] for s in seqs]
+    if n_steps is None:
+        if not seqs:
+            raise ValueError("No information about the number of steps"
+                             " provided. Either provide a value for the"
+                             " n_steps argument or provide a sequence")
+        n_steps = seqs[0].shape[0]
+        for s in seqs[1:]:
+            n_steps = tensor.minimum(n_steps, s.shape[0])
+    else:
+        n_steps = tensor.as_tensor_variable(n_steps)
+    n_steps = tensor.cast(n_steps, 'int64')
+    try:
+        padded = (opt.get_scalar_constant_value(n_steps) %
+                  save_every_N != 0)
+    except tensor.basic.NotScalarConstantError:
+        padded = True
+
+    n_segments = (n_steps + save_every_N - 1) // save_every_N
+    length = n_segments * save_every_N
+    if padded:
+        # The padding repeats the last step so that the discarded steps
+        # don't compute anything unusual.
+        idx = tensor.minimum(tensor.arange(length), n_steps - 1)
+        seqs = [s[idx] for s in seqs]
+        mask = tensor.lt(tensor.arange(length), n_steps)
+        seqs.append(mask)
+    else:
+        seqs = [s[:length] for s in seqs]
+    segments = [s.reshape([n_segments, save_every_N] +
+                          [s.shape[i] for i in xrange(1, s.ndim)],
+                          ndim=s.ndim + 1)
+                for s in seqs]
+    n_seqs = len(segments) - int(padded)
+
+    def inner_step(*args):
+        args = list(args)
+        if padded:
+            m = args.pop(n_seqs)
+        cond, outs, updates = scan_utils.get_updates_and_outputs(fn(*args))
+        if cond is not None or updates:
+            raise ValueError("scan_checkpoints doesn't support functions"
+                             " that return updates or a stopping condition")
+        if len(outs) != len(is_state):
+            raise ValueError("fn returned %d outputs but %d were given in"
+                             " outputs_info" % (len(outs), len(is_state)))
+        if padded:
+            prev = iter(args[n_seqs:])
+            outs = [tensor.switch(m, o, next(prev)) if s else o
+                    for o, s in zip(outs, is_state)]
+        return outs
+
+    def outer_step(*args):
+        segment = list(args[:len(segments)])
+        prev = list(args[len(segments):len(segments) + len(states)])
+        others = list(args[len(segments) + len(states):])
+        prev_iter = iter(prev)
+        inner_info = [next(prev_iter) if s else None for s in is_state]
+        outs, updates = theano.scan(inner_step,
+                                    sequences=segment,
+                                    outputs_info=inner_info,
+                                    non_sequences=others,
+                                    n_steps=save_every_N,
+                                    mode=mode,
+                                    name=name + '_inner',
+                                    profile=profile,
+                                    allow_gc=allow_gc,
+                                    strict=strict)
+        outs = _wrap_into_list(outs)
+        last = [o[-1] for o, s in zip(outs, is_state) if s]
+        return last + outs
+
+    outer_outs, updates = theano.scan(outer_step,
+                                      sequences=segments,
+                                      outputs_info=(states +
+                                                    [None] * len(is_state)),
+                                      non_sequences=non_seqs,
+                                      n_steps=n_segments,
+                                      mode=mode,
+                                      name=name + '_outer',
+                                      profile=profile,
+                                      allow_gc=allow_gc,
+                                      strict=strict)
+    outer_outs = _wrap_into_list(outer_outs)
+    rval = [_join_segments(o, n_steps)
+            for o in outer_outs[len(states):]]
+    if len(rval) == 1:
+        return rval[0], OrderedUpdates(updates)
+    return rval, OrderedUpdates(updates)
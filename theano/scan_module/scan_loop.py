@@ -0,0 +1,242 @@
+"""
+This module runs all the steps of a Scan in the C loop of the CVM
+(config.scan.compiled_loop).
+
+The default implementation of Scan (scan_perform.pyx, or Scan.execute)
+calls the inner function once per step and, at each step, puts the slices
+of the sequences and the previous states in its input storage, then copies
+its outputs in the output buffers. For short steps this bookkeeping costs
+more than the computation itself.
+
+Here, the bookkeeping is moved into the graph: the inner graph is cloned
+into a *loop graph* whose inputs are the step counter ``i``, the whole
+sequences, the whole output buffers and the non-sequences. The slices are
+taken with Subtensor and the outputs are stored in the buffers with an
+inplace IncSubtensor (set_subtensor). The step counter and the buffers are
+inputs with an update, so the CVM of lazylinker_c can run all the steps
+without going back to Python, by calling it with ``n_calls=n_steps``.
+When the scan has nit_sot outputs, the first step is computed by the inner
+function, as it gives the shape of their buffers, and the loop computes the
+other steps.
+
+Only the scans without mit_mot, shared outputs or condition, whose
+sequences and outputs are tensors, can run this way (see
+`can_compile_loop`). The other scans use the default implementation.
+
+"""
+from __future__ import print_function
+
+__docformat__ = 'restructedtext en'
+
+import time
+
+import numpy
+from six.moves import xrange
+
+from theano import gof, tensor
+from theano.compat import izip
+from theano.compile.io import In
+from theano.compile.function_module import orig_function
+from theano.compile import profiling
+from theano.scan_module import scan_utils
+
+
+def can_compile_loop(op):
+    """
+    Return True if the steps of the Scan `op` can run in the C loop of the
+    CVM.
+
+    """
+    if (op.info.get('gpu') or op.info.get('gpua') or op.as_while or
+            op.n_mit_mot or op.n_shared_outs):
+        return False
+    n_seq_and_taps = op.n_seqs + sum(len(taps) for taps in op.tap_array)
+    n_outs = op.n_mit_sot + op.n_sit_sot + op.n_nit_sot
+    return all(isinstance(var.type, tensor.TensorType)
+               for var in (op.inputs[:n_seq_and_taps] +
+                           op.outputs[:n_outs]))
+
+
+def _like(var, inner):
+    # The slices of the outer variables can have a different broadcastable
+    # pattern than the inner variables they replace.
+    if var.broadcastable != inner.broadcastable:
+        var = tensor.patternbroadcast(var, inner.broadcastable)
+    return var
+
+
+class ScanLoop(object):
+    """
+    Run the steps of a Scan node in the C loop of the CVM.
+
+    Parameters
+    ----------
+    op
+        The Scan op. `can_compile_loop(op)` must be True.
+    node
+        The Apply node of `op`.
+
+    Notes
+    -----
+    If the loop function doesn't use the CVM (e.g. when lazylinker_c isn't
+    available, or the mode of the scan uses another linker), `usable` is
+    False and the caller must use the default implementation.
+
+    """
+
+    def __init__(self, op, node):
+        self.op = op
+        n_seqs = op.n_seqs
+        n_outs = op.n_mit_sot + op.n_sit_sot
+        n_nit_sot = op.n_nit_sot
+
+        i = tensor.lscalar('i')
+        seqs = [var.type() for var in op.outer_seqs(node.inputs)]
+        bufs = [var.type() for var in node.outputs[:n_outs + n_nit_sot]]
+        non_seqs = [var.type() for var in
+                    node.inputs[op.nit_sot_arg_offset + n_nit_sot:]]
+
+        givens = []
+        for seq, inner in izip(seqs, op.inputs[:n_seqs]):
+            givens.append((inner, _like(seq[i], inner)))
+        inner_taps = iter(op.inputs[n_seqs:])
+        for idx in xrange(n_outs):
+            store = bufs[idx].shape[0]
+            for tap in op.tap_array[idx]:
+                inner = next(inner_taps)
+                pos = (i - op.mintaps[idx] + tap) % store
+                givens.append((inner, _like(bufs[idx][pos], inner)))
+        for var, inner in izip(non_seqs, inner_taps):
+            givens.append((inner, var))
+        inner_outs = scan_utils.clone(op.outputs[:n_outs + n_nit_sot],
+                                      replace=givens)
+
+        updates = [(i, i + 1)]
+        for idx, (buf, out) in enumerate(izip(bufs, inner_outs)):
+            pos = (i - op.mintaps[idx]) % buf.shape[0]
+            updates.append((buf, tensor.set_subtensor(buf[pos], out)))
+
+        # The outputs are the buffers, which must be updated inplace.
+        mode = op.mode_instance.excluding('add_no_output_from_inplace')
+        inputs = ([In(var, update=update, mutable=True)
+                   for var, update in updates] +
+                  [In(var, borrow=True) for var in seqs + non_seqs])
+        # The nodes of the loop graph, with the slicing of the sequences
+        # and buffers, have their own profile: the profile of the inner
+        # function only has the nodes of the inner graph. It is printed at
+        # exit only if the profile of the inner function is.
+        profile = None
+        inner_profile = getattr(op.fn.maker, 'profile', None)
+        if inner_profile:
+            profile = profiling.ProfileStats(
+                message='%s_loop' % op.name,
+                atexit_print=any(p is inner_profile
+                                 for p in profiling._atexit_print_list))
+        self.fn = orig_function(inputs, [], mode=mode,
+                                name='%s_loop' % op.name,
+                                profile=profile,
+                                on_unused_input='ignore')
+        self.usable = isinstance(self.fn.fn, getattr(gof.vm, 'CVM', ()))
+
+    def __call__(self, node, args, outs):
+        op = self.op
+        t0_call = time.time()
+        n_steps = args[0]
+        n_seqs = op.n_seqs
+        n_outs = op.n_mit_sot + op.n_sit_sot
+        n_nit_sot = op.n_nit_sot
+        seqs = args[1:1 + n_seqs]
+        nit_sot_steps = args[op.nit_sot_arg_offset:
+                             op.nit_sot_arg_offset + n_nit_sot]
+        non_seqs = args[op.nit_sot_arg_offset + n_nit_sot:]
+        if (n_steps <= 0 or any(seq.shape[0] < n_steps for seq in seqs) or
+                any(steps <= 0 for steps in nit_sot_steps)):
+            # Let the default implementation deal with the special cases
+            # and raise the errors.
+            return op.execute(node, args, outs)
+
+        destroy_map = getattr(op, 'destroy_map', {})
+        bufs = []
+        for idx in xrange(n_outs):
+            if idx in destroy_map:
+                bufs.append(args[op.seqs_arg_offset + idx])
+            else:
+                bufs.append(args[op.seqs_arg_offset + idx].copy())
+        start = 0
+        t_first = 0
+        if n_nit_sot:
+            # The shapes of the nit_sot outputs are those of the first
+            # step, which is computed by the inner function.
+            t0_first = time.time()
+            first = op.fn(*self._first_step_inputs(seqs, bufs, non_seqs))
+            t_first = time.time() - t0_first
+            for idx, buf in enumerate(bufs):
+                buf[-op.mintaps[idx] % buf.shape[0]] = first[idx]
+            for idx, steps in enumerate(nit_sot_steps, n_outs):
+                val = numpy.asarray(first[idx])
+                bufs.append(node.outputs[idx].type.value_zeros(
+                    (steps,) + val.shape))
+                bufs[idx][0] = val
+            start = 1
+
+        storage = [container.storage for container in self.fn.input_storage]
+        values = ([numpy.asarray(start, dtype='int64')] + bufs + list(seqs) +
+                  list(non_seqs))
+        for s, value in izip(storage, values):
+            s[0] = value
+
+        fn = self.fn.fn
+        t0_fn = time.time()
+        try:
+            fn(n_calls=int(n_steps) - start)
+        except Exception:
+            if hasattr(fn, 'position_of_error'):
+                gof.link.raise_with_op(fn.nodes[fn.position_of_error],
+                                       fn.thunks[fn.position_of_error])
+            raise
+        finally:
+            t_fn = time.time() - t0_fn
+            bufs = [s[0] for s in storage[1:1 + len(bufs)]]
+            for s in storage:
+                s[0] = None
+
+        # Put the oldest stored steps first, as the default implementation.
+        for idx, buf in enumerate(bufs):
+            store = buf.shape[0]
+            mintap = op.mintaps[idx]
+            pos = (n_steps - mintap) % store
+            if store < n_steps - mintap and pos != 0:
+                buf = numpy.concatenate([buf[pos:], buf[:pos]])
+            elif store > n_steps - mintap:
+                buf[n_steps - mintap:] = 0
+            outs[idx][0] = buf
+
+        t_call = time.time() - t0_call
+        profile = getattr(op.fn.maker, 'profile', None)
+        if profile:
+            profile.callcount += 1
+            profile.nbsteps += n_steps
+            profile.call_time += t_call
+            # The call of the inner function for the first step already
+            # added its time to vm_call_time.
+            profile.vm_call_time += t_fn
+        loop_profile = self.fn.profile
+        if loop_profile:
+            loop_profile.fct_callcount += 1
+            loop_profile.fct_call_time += t_fn
+            loop_profile.vm_call_time += t_fn
+            if hasattr(fn, 'update_profile'):
+                fn.update_profile(loop_profile)
+        op.t_call = t_call
+        op.t_fn = t_fn + t_first
+
+    def _first_step_inputs(self, seqs, bufs, non_seqs):
+        # The inputs of the inner function for the first step, in the
+        # order of op.inputs.
+        op = self.op
+        inputs = [seq[0] for seq in seqs]
+        for idx, buf in enumerate(bufs):
+            store = buf.shape[0]
+            for tap in op.tap_array[idx]:
+                inputs.append(buf[(tap - op.mintaps[idx]) % store])
+        return inputs + list(non_seqs)
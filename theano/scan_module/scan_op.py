@@ -59,6 +59,7 @@ __contact__ = "Razvan Pascanu <r.pascanu@gmail>"
 import itertools
 import logging
 import time
+import weakref
 
 import numpy
 from six import iteritems
@@ -77,14 +78,15 @@ from theano.gradient import grad_undefined, DisconnectedType, NullType
 from six import string_types
 from theano.compile.profiling import ScanProfileStats
 
-from theano.scan_module import scan_utils
+from theano.scan_module import scan_loop, scan_parallel, scan_utils
 from theano.scan_module.scan_utils import safe_new, forced_replace
 
 # Logging function for sending warning or info
 _logger = logging.getLogger('theano.scan_module.scan_op')
 
 
-from theano.configparser import AddConfigVar, BoolParam
+from theano.configparser import (AddConfigVar, BoolParam, IntParam,
+                                 get_config_md5)
 
 AddConfigVar('scan.allow_gc',
              "Allow/disallow gc inside of Scan (default: False)",
@@ -95,6 +97,66 @@ AddConfigVar('scan.allow_output_prealloc',
              "(default: True)",
              BoolParam(True))
 
+AddConfigVar('scan.compiled_loop',
+             "Run all the steps of a scan in the C loop of the CVM, with the "
+             "slicing of the inputs and the storage of the outputs done by "
+             "the compiled graph, instead of calling the inner function "
+             "once per step. Only the scans without mit_mot, shared outputs "
+             "and condition can run this way (default: False)",
+             BoolParam(False))
+
+AddConfigVar('scan.n_threads',
+             "Number of threads used to run a scan that only maps a function "
+             "over its sequences (one chunk of steps per thread), or whose "
+             "outputs form independent recurrent groups (one group per "
+             "thread). The threads only run at the same time while the "
+             "computations release the GIL, which the C code of Theano and "
+             "the C VM don't do. 1 disables it (default: 1)",
+             IntParam(1, lambda i: i > 0))
+
+AddConfigVar('scan.unroll_max_steps',
+             "The scans with a constant number of steps smaller or equal to "
+             "this value are replaced by their steps, which lets the "
+             "optimizations work across the steps. 0 disables it "
+             "(default: 0)",
+             IntParam(0, lambda i: i >= 0))
+
+AddConfigVar('scan.unroll_factor',
+             "The other scans with a constant number of steps that is a "
+             "multiple of this value are replaced by a scan that computes "
+             "that many steps at each of its steps. 1 disables it "
+             "(default: 1)",
+             IntParam(1, lambda i: i >= 1))
+
+AddConfigVar('scan.share_inner_function',
+             "Compile the inner function once for all the scans that compute "
+             "the same thing with the same mode, and give each of them a "
+             "copy of it, instead of optimizing the same inner graph again "
+             "for each scan (default: False)",
+             BoolParam(False))
+
+# _hash_inner_graph -> list of (weak reference to a Scan op, hash of the
+# Theano flags when its inner function was compiled). The inner functions
+# of these ops are copied by the equal Scan ops that need theirs (see
+# Scan.compile_inner_function).
+_inner_functions = {}
+
+
+def _forget_inner_function(key):
+    """
+    Return a weakref callback that removes a dead Scan op from
+    _inner_functions[key], and the key once its list is empty.
+
+    """
+    def callback(ref):
+        entries = _inner_functions.get(key)
+        if entries is None:
+            return
+        entries[:] = [(r, p) for r, p in entries if r is not ref]
+        if not entries:
+            del _inner_functions[key]
+    return callback
+
 
 class Scan(PureOp):
     """
@@ -222,20 +284,32 @@ class Scan(PureOp):
                                    self.n_shared_outs)
         self.n_outs = self.n_mit_mot + self.n_mit_sot + self.n_sit_sot
         self.n_tap_outs = self.n_mit_mot + self.n_mit_sot
-        if self.info['gpu'] or self.info['gpua']:
-            self._hash_inner_graph = self.info['gpu_hash']
-        else:
-            tmp_in, tmp_out = scan_utils.reconstruct_graph(self.inputs,
-                                                           self.outputs)
-            local_fgraph = gof.FunctionGraph(tmp_in, tmp_out, clone=False)
-            self._cmodule_key = gof.CLinker().cmodule_key_(local_fgraph, [])
-            self._hash_inner_graph = hash(self._cmodule_key)
+        if not (self.info['gpu'] or self.info['gpua']):
+            # Like the FunctionGraph of the inner function, refuse the
+            # variables that aren't inputs of the inner graph, for example
+            # the shared variables of a strict scan.
+            inputs = set(self.inputs)
+            for var in gof.graph.inputs(self.outputs):
+                if var not in inputs and not isinstance(var, gof.Constant):
+                    raise gof.fg.MissingInputError("Undeclared input", var)
+        self._hash_inner_graph = self.hash_inner_graph()
 
         # Compute mappings between outer inputs, outer outputs, inner
         # inputs and inner outputs to determine with variables are associated
         # with the same states.
         self.var_mappings = self.get_oinp_iinp_iout_oout_mappings()
 
+    def hash_inner_graph(self):
+        """
+        Return a hash of the inner graph, consistent with the comparison of
+        the inner graphs done by __eq__.
+
+        """
+        if self.info['gpu'] or self.info['gpua']:
+            return self.info['gpu_hash']
+        return hash(tuple(scan_utils.hash_computations(self.outputs,
+                                                       self.inputs)))
+
     def validate_inner_graph(self):
         """
         Perform some elementary validations on the inner graph to ensure
@@ -319,6 +393,9 @@ class Scan(PureOp):
             # Generate the mappings between inner and outer inputs and outputs
             # if they haven't already been generated.
             self.var_mappings = self.get_oinp_iinp_iout_oout_mappings()
+        # The hash of the inner graph depends on the identity of some
+        # variables, so it is computed again for the unpickled graph.
+        self._hash_inner_graph = self.hash_inner_graph()
 
         # Ensure that the graph associated with the inner function is valid.
         self.validate_inner_graph()
@@ -770,12 +847,9 @@ class Scan(PureOp):
         # make_thunk can be called many times on the same op
         # we do not want to recompile the inner fct every time.
         if not getattr(self, 'fn', None):
-            self.fn = function(wrapped_inputs,
-                               wrapped_outputs,
-                               mode=self.mode_instance,
-                               name=self.name,
-                               profile=profile,
-                               on_unused_input='ignore')
+            self.fn = self.compile_inner_function(wrapped_inputs,
+                                                  wrapped_outputs,
+                                                  profile)
 
         try:
             cython_mintaps = numpy.asarray(self.mintaps, dtype='int32')
@@ -845,15 +919,48 @@ class Scan(PureOp):
                         self, node)
         except (ImportError, theano.gof.cmodule.MissingGXX):
             p = self.execute
+
+        if (theano.config.scan.compiled_loop and
+                scan_loop.can_compile_loop(self)):
+            loop = scan_loop.ScanLoop(self, node)
+            if loop.usable:
+                p = loop
+
+        if (theano.config.scan.n_threads > 1 and
+                self.info.get('parallel', True) and
+                scan_parallel.can_run_in_parallel(self)):
+            parallel = scan_parallel.ScanParallel(
+                self, node, p, theano.config.scan.n_threads)
+            if parallel.usable:
+                p = parallel
         # default arguments are stored in the closure of `rval`
 
         # Big ugly hack since we can't get the real value of allow_gc
         # for the englobing function.
         allow_gc = config.allow_gc and not self.allow_gc
+        # The scans of the inner function, whose memory is live during
+        # the call of this one.
+        inner_scans = [nd.op for nd in self.fn.maker.fgraph.apply_nodes
+                       if isinstance(nd.op, Scan)]
+        self.peak_bytes = 0
 
         def rval(p=p, i=node_input_storage, o=node_output_storage, n=node,
                  allow_gc=allow_gc):
+            profile = getattr(self.fn.maker, 'profile', None)
+            if profile:
+                for op in inner_scans:
+                    op.peak_bytes = 0
             r = p(n, [x[0] for x in i], o)
+            if profile:
+                out_bytes = sum(getattr(x[0], 'nbytes', 0) for x in o)
+                profile.output_memory = max(profile.output_memory, out_bytes)
+                # The inputs and outputs of the node, and the largest
+                # storage of the inner scans during one step.
+                nbytes = (out_bytes +
+                          sum(getattr(x[0], 'nbytes', 0) for x in i) +
+                          max([op.peak_bytes for op in inner_scans] + [0]))
+                self.peak_bytes = max(self.peak_bytes, nbytes)
+                profile.peak_memory = max(profile.peak_memory, nbytes)
             for o in node.outputs:
                 compute_map[o][0] = True
             if allow_gc:
@@ -865,6 +972,62 @@ class Scan(PureOp):
         rval.lazy = False
         return rval
 
+    def compile_inner_function(self, wrapped_inputs, wrapped_outputs,
+                               profile):
+        """
+        Compile the inner function of the op.
+
+        If config.scan.share_inner_function is True and the inner function
+        of an equal Scan op (same inner graph, mode, allow_gc and Theano
+        flags) has already been compiled, that function is copied instead,
+        which skips the optimization of the inner graph.
+
+        The inner functions that contain Scan nodes are not shared: their
+        copies would share the inner functions of those nested ops.
+
+        """
+        if not config.scan.share_inner_function:
+            return function(wrapped_inputs,
+                            wrapped_outputs,
+                            mode=self.mode_instance,
+                            name=self.name,
+                            profile=profile,
+                            on_unused_input='ignore')
+
+        # The flags that change the compiled function, like
+        # scan.allow_output_prealloc or the optimizer flags.
+        config_md5 = get_config_md5()
+        entries = _inner_functions.setdefault(self._hash_inner_graph, [])
+        # Forget the ops that don't exist anymore
+        entries[:] = [(ref, md5) for ref, md5 in entries
+                      if ref() is not None]
+        for ref, md5 in entries:
+            other = ref()
+            if (md5 == config_md5 and
+                    other is not None and
+                    other == self and
+                    other.mode == self.mode and
+                    other.allow_gc == self.allow_gc and
+                    getattr(other, 'fn', None)):
+                return other.fn.copy(name=self.name, profile=profile)
+
+        fn = function(wrapped_inputs,
+                      wrapped_outputs,
+                      mode=self.mode_instance,
+                      name=self.name,
+                      profile=profile,
+                      on_unused_input='ignore')
+        if any(isinstance(node.op, Scan)
+               for node in fn.maker.fgraph.apply_nodes):
+            if not entries:
+                del _inner_functions[self._hash_inner_graph]
+            return fn
+        entries.append((weakref.ref(self,
+                                    _forget_inner_function(
+                                        self._hash_inner_graph)),
+                        config_md5))
+        return fn
+
     def inner_seqs(self, list_inputs):
         # Given the list of inner inputs this function grabs those
         # corresponding to sequences
@@ -4,7 +4,10 @@ The Optimization provided in this file:
 
 local opt: remove_constants_and_unused_inputs_scan,
            constant_folding_for_scan2,
-           scan_merge_inouts
+           scan_merge_inouts,
+           scan_vectorize_map,
+           scan_batched_dot,
+           scan_unroll
            They are wrapped in in2out to create global opt.
 global opt: ScanInplaceOptimizer,
             PushOutNonSeqScan,
@@ -19,7 +22,9 @@ optdb: scan_eqopt1 (.1), scan_eqopt2(1.6), scan_inplace(75)
 scan_eqopt1 -> scan_seqopt1
 scan_seqopt1 -> in2out(remove_constants_and_unused_inputs_scan)(1),
                 PushOutNonSeqScan(2),
-                PushOutSeqScan(3), PushOutDot1(4)
+                PushOutSeqScan(3), PushOutDot1(4),
+                PushOutScanOutput(5), in2out(scan_batched_dot)(5.5),
+                in2out(scan_vectorize_map)(6), in2out(scan_unroll)(7)
 scan_eqopt2 -> They are all global optimizer. (in2out convert local to global).
                This is important, as the order is important and all global
                optimizer run before local optimizer in the order they where
@@ -68,7 +73,7 @@ import theano
 from theano import tensor
 from theano.tensor import opt, get_scalar_constant_value
 from theano import gof
-from theano.compat import OrderedDict
+from theano.compat import OrderedDict, izip
 from six import integer_types, iteritems
 from six.moves import xrange
 from theano.gof.opt import Optimizer
@@ -76,11 +81,13 @@ from theano.gof.opt import pre_constant_merge, pre_greedy_local_optimizer
 from theano.gof import toolbox, DestroyHandler, InconsistencyError
 from theano.compile import optdb
 from theano.compile.function_module import deep_copy_op
+from theano.compile.ops import Shape, Shape_i
 
 from theano.scan_module import scan_op
 from theano.scan_module import scan_utils
 from theano.scan_module.scan_utils import equal_computations, find_up, \
         scan_args
+from theano.tensor.vectorize import vectorize, NotVectorizable
 
 
 # Logging function for sending warning or info
@@ -208,6 +215,291 @@ def remove_constants_and_unused_inputs_scan(node):
         return False
 
 
+def _map_only_scan_args(node):
+    """
+    Return the scan_args of a scan that only maps a function over its
+    sequences (no recurrence, shared outputs or condition), or None.
+
+    """
+    if not isinstance(node.op, scan_op.Scan):
+        return None
+    op = node.op
+    info = op.info
+    if (op.n_mit_mot or op.n_mit_sot or op.n_sit_sot or op.n_shared_outs or
+            info['as_while'] or info.get('gpu') or info.get('gpua') or
+            op.n_seqs == 0 or op.n_nit_sot == 0):
+        return None
+    return scan_args(node.inputs, node.outputs, op.inputs, op.outputs, info)
+
+
+def _like_scan_outputs(node, new_outs):
+    """
+    Give to the replacements of the outputs of a scan the dtype and the
+    broadcastable pattern of those outputs.
+
+    """
+    rval = []
+    for out, new_out in izip(node.outputs, new_outs):
+        if new_out.dtype != out.dtype:
+            new_out = tensor.cast(new_out, out.dtype)
+        if new_out.broadcastable != out.broadcastable:
+            new_out = tensor.patternbroadcast(new_out, out.broadcastable)
+        rval.append(new_out)
+    return rval
+
+
+@gof.local_optimizer([scan_op.Scan])
+def scan_batched_dot(node):
+    """
+    Replace a scan that only computes the dot products of matching
+    elements of two sequences by a BatchedDot.
+
+    """
+    args = _map_only_scan_args(node)
+    if args is None or len(args.inner_out_nit_sot) != 1:
+        return False
+    out = args.inner_out_nit_sot[0]
+    if (out.owner is None or
+            not isinstance(out.owner.op, tensor.basic.Dot) or
+            not all(inp in args.inner_in_seqs for inp in out.owner.inputs)):
+        return False
+    n_steps = args.n_steps
+    # The sequences can be longer than the number of steps.
+    x, y = [args.outer_in_seqs[args.inner_in_seqs.index(inp)][:n_steps]
+            for inp in out.owner.inputs]
+    return _like_scan_outputs(node, [tensor.batched_dot(x, y)])
+
+
+@gof.local_optimizer([scan_op.Scan])
+def scan_vectorize_map(node):
+    """
+    Replace a scan that only maps a function over its sequences by the
+    batched version of that function (see theano.tensor.vectorize).
+
+    The scan is kept if a node of its inner graph has no batched version.
+
+    """
+    args = _map_only_scan_args(node)
+    if args is None:
+        return False
+    n_steps = args.n_steps
+    # The sequences can be longer than the number of steps.
+    outer_seqs = [seq[:n_steps] for seq in args.outer_in_seqs]
+    givens = OrderedDict(izip(args.inner_in_non_seqs,
+                              args.outer_in_non_seqs))
+    inner_outs = scan_utils.clone(args.inner_out_nit_sot, replace=givens)
+    try:
+        new_outs = vectorize(inner_outs,
+                             OrderedDict(izip(args.inner_in_seqs,
+                                              outer_seqs)),
+                             fallback=False)
+    except NotVectorizable:
+        return False
+    return _like_scan_outputs(node, new_outs)
+
+
+def _unrolled_steps(op, n_steps, seq_slices, init_states, non_seqs):
+    """
+    Apply the inner graph of the Scan `op` `n_steps` times.
+
+    Parameters
+    ----------
+    n_steps
+        The number of steps.
+    seq_slices
+        For each sequence, the list of its slices, one per step.
+    init_states
+        For each mit_sot and sit_sot output, the list of the -mintap
+        states before the first step, the oldest first.
+    non_seqs
+        The non-sequences.
+
+    Returns
+    -------
+    The list of the states of each mit_sot and sit_sot output (the initial
+    ones followed by the one of each step) and the list of the outputs of
+    each step for each nit_sot output.
+
+    """
+    n_seqs = op.n_seqs
+    n_outs = op.n_mit_sot + op.n_sit_sot
+    states = [list(init) for init in init_states]
+    nit_sot = [[] for idx in xrange(op.n_nit_sot)]
+
+    def as_inner(var, inner):
+        if var.broadcastable != inner.broadcastable:
+            var = tensor.patternbroadcast(var, inner.broadcastable)
+        return var
+
+    for t in xrange(n_steps):
+        givens = []
+        for inner, slices in izip(op.inputs[:n_seqs], seq_slices):
+            givens.append((inner, as_inner(slices[t], inner)))
+        inner_taps = iter(op.inputs[n_seqs:])
+        for idx in xrange(n_outs):
+            # The state of step t is states[idx][t - mintap]
+            for tap in op.tap_array[idx]:
+                inner = next(inner_taps)
+                state = states[idx][t - op.mintaps[idx] + tap]
+                givens.append((inner, as_inner(state, inner)))
+        for inner, var in izip(inner_taps, non_seqs):
+            givens.append((inner, var))
+        outs = scan_utils.clone(op.outputs[:n_outs + op.n_nit_sot],
+                                replace=givens)
+        for idx in xrange(n_outs):
+            states[idx].append(outs[idx])
+        for idx in xrange(op.n_nit_sot):
+            nit_sot[idx].append(outs[n_outs + idx])
+    return states, nit_sot
+
+
+def _stack(variables):
+    return tensor.unbroadcast(tensor.stack(*variables), 0)
+
+
+def _buffer_length(node, buf):
+    shape_feature = getattr(getattr(node, 'fgraph', None), 'shape_feature',
+                            None)
+    if shape_feature is not None and buf in shape_feature.shape_of:
+        return shape_feature.shape_of[buf][0]
+    return buf.shape[0]
+
+
+def _fit_to_store(full, length, store):
+    """
+    Return the output of a scan computed from `full`, the `length` values
+    of the whole output (initial states included), given the length of the
+    buffer of the scan: the last values are kept and, if the buffer is
+    longer, it ends with zeros (see Scan.execute).
+
+    """
+    try:
+        if get_scalar_constant_value(store) == length:
+            return full
+    except tensor.NotScalarConstantError:
+        pass
+    n_keep = tensor.minimum(store, length)
+    out = tensor.zeros([store] + [full.shape[i] for i in xrange(1, full.ndim)],
+                       dtype=full.dtype)
+    return tensor.set_subtensor(out[:n_keep], full[length - n_keep:])
+
+
+@gof.local_optimizer([scan_op.Scan])
+def scan_unroll(node):
+    """
+    Unroll the scans with a constant number of steps.
+
+    If the number of steps is at most config.scan.unroll_max_steps, the
+    scan is replaced by its steps. Otherwise, if it is a multiple of
+    config.scan.unroll_factor, the scan is replaced by a scan that computes
+    that many steps at each of its steps. In both cases, the steps are
+    chained in one graph, so the optimizations (fusion, gemm, ...) can work
+    across them.
+
+    Only the scans without mit_mot, shared outputs or condition are
+    unrolled.
+
+    """
+    if not isinstance(node.op, scan_op.Scan):
+        return False
+    op = node.op
+    max_steps = theano.config.scan.unroll_max_steps
+    factor = theano.config.scan.unroll_factor
+    if ((max_steps == 0 and factor == 1) or op.info.get('unrolled') or
+            op.info.get('gpu') or op.info.get('gpua') or op.as_while or
+            op.n_mit_mot or op.n_shared_outs):
+        return False
+    try:
+        n_steps = int(get_scalar_constant_value(node.inputs[0]))
+    except tensor.NotScalarConstantError:
+        return False
+    if n_steps <= 0:
+        return False
+    if n_steps <= max_steps:
+        k = n_steps
+    elif factor > 1 and n_steps % factor == 0:
+        k = factor
+    else:
+        return False
+
+    n_outs = op.n_mit_sot + op.n_sit_sot
+    n_nit_sot = op.n_nit_sot
+    seqs = [seq[:n_steps] for seq in op.outer_seqs(node.inputs)]
+    bufs = node.inputs[op.seqs_arg_offset:op.seqs_arg_offset + n_outs]
+    nit_sot_steps = node.inputs[op.nit_sot_arg_offset:
+                                op.nit_sot_arg_offset + n_nit_sot]
+    non_seqs = node.inputs[op.nit_sot_arg_offset + n_nit_sot:]
+    n_init = [-op.mintaps[idx] for idx in xrange(n_outs)]
+
+    if k == n_steps:
+        states, nit_sot = _unrolled_steps(
+            op, n_steps,
+            [[seq[t] for t in xrange(n_steps)] for seq in seqs],
+            [[buf[t] for t in xrange(n_init[idx])]
+             for idx, buf in enumerate(bufs)],
+            non_seqs)
+        full_states = [_stack(s) for s in states]
+        full_nit_sot = [_stack(o) for o in nit_sot]
+    else:
+        n_blocks = n_steps // k
+
+        def block_step(*args):
+            block_seqs = args[:len(seqs)]
+            block_states = args[len(seqs):len(seqs) + n_outs]
+            states, nit_sot = _unrolled_steps(
+                op, k,
+                [[seq[t] for t in xrange(k)] for seq in block_seqs],
+                [[state[t] for t in xrange(n_init[idx])]
+                 for idx, state in enumerate(block_states)],
+                non_seqs)
+            # The last states are the ones needed by the next block
+            return ([_stack(s[-n:]) for s, n in izip(states, n_init)] +
+                    [_stack(s[n:]) for s, n in izip(states, n_init)] +
+                    [_stack(o) for o in nit_sot])
+
+        block_seqs = [seq.reshape([n_blocks, k] +
+                                  [seq.shape[i] for i in xrange(1, seq.ndim)])
+                      for seq in seqs]
+        init = [tensor.unbroadcast(buf[:n], 0)
+                for buf, n in izip(bufs, n_init)]
+        outs, updates = theano.scan(
+            block_step, sequences=block_seqs,
+            outputs_info=init + [None] * (n_outs + n_nit_sot),
+            n_steps=n_blocks, mode=op.mode, name=op.name,
+            profile=op.profile, allow_gc=op.allow_gc)
+        if updates:
+            return False
+        if not isinstance(outs, (list, tuple)):
+            outs = [outs]
+        # The nit_sot outputs are the outputs of the new scan, if any.
+        block_node = outs[-1].owner
+        if isinstance(getattr(block_node, 'op', None), scan_op.Scan):
+            # Mark it so that it isn't unrolled again. The info is part of
+            # the identity of the op, so build a new one.
+            info = OrderedDict(block_node.op.info)
+            info['unrolled'] = True
+            block_op = scan_op.Scan(block_node.op.inputs,
+                                    block_node.op.outputs, info)
+            block_outs = block_op(*block_node.inputs,
+                                  **dict(return_list=True))
+            outs = scan_utils.clone(
+                outs, replace=list(izip(block_node.outputs, block_outs)))
+
+        def flatten_blocks(x):
+            return x.reshape([n_steps] +
+                             [x.shape[i] for i in xrange(2, x.ndim)])
+        full_states = [tensor.join(0, buf[:n], flatten_blocks(o))
+                       for buf, n, o in izip(bufs, n_init,
+                                             outs[n_outs:2 * n_outs])]
+        full_nit_sot = [flatten_blocks(o) for o in outs[2 * n_outs:]]
+
+    rval = [_fit_to_store(full, n_steps + n, _buffer_length(node, buf))
+            for full, n, buf in izip(full_states, n_init, bufs)]
+    rval += [_fit_to_store(full, n_steps, steps)
+             for full, steps in izip(full_nit_sot, nit_sot_steps)]
+    return _like_scan_outputs(node, rval)
+
+
 # This is a global opt for historical reason
 # It should be possible to change it to a local opt.
 class PushOutNonSeqScan(gof.Optimizer):
@@ -1097,6 +1389,15 @@ class ScanSaveMem(gof.Optimizer):
             else:
                 return tensor.as_tensor_variable(x)
 
+        def preallocable(i):
+            # The mit_sot and sit_sot outputs are written directly in their
+            # buffer when config.scan.allow_output_prealloc is set (and the
+            # buffer has more than one entry). The new state must then not
+            # take the place of the oldest tap in the circular buffer.
+            return (theano.config.scan.allow_output_prealloc and
+                    op.n_mit_mot <= i < op.n_mit_mot + op.n_mit_sot +
+                    op.n_sit_sot)
+
         if hasattr(fgraph, 'shape_feature'):
             shape_of = node.fgraph.shape_feature.shape_of
         else:
@@ -1149,6 +1450,12 @@ class ScanSaveMem(gof.Optimizer):
 
         # Keeps track of the original slices that each client represent
         slices = [None for o in node.outputs]
+        # The Subtensor clients of each output, in the order of `slices`, and
+        # its clients that only use its shape. Those don't need the values
+        # of the output: the length is known without running the scan and
+        # the other dimensions are those of any step.
+        sub_clients = [[] for o in node.outputs]
+        shape_clients = [[] for o in node.outputs]
 
         # A list for each output indicating how many intermediate values
         # should be stored. If negative it means none of the intermediate
@@ -1179,6 +1486,12 @@ class ScanSaveMem(gof.Optimizer):
                     global_nsteps = None
                     slices[i] = None
                     break
+                # 2.1.1 shape of the output, unless its length depends on
+                # the condition of the loop
+                #=> output needs at most one step
+                elif (i >= op.n_mit_mot and not op.as_while and
+                      isinstance(cl.op, (Shape, Shape_i))):
+                    shape_clients[i].append(cl)
                 # 2.2 non-subtensor nodes
                 #=> output needs all its intermediate values
                 elif not isinstance(cl.op, tensor.Subtensor):
@@ -1188,6 +1501,7 @@ class ScanSaveMem(gof.Optimizer):
                 # 2.3 subtensor nodes
                 #=> output might need to store just a subset of its values
                 else:
+                    sub_clients[i].append(cl)
                     # 2.3.1 extract idx list of subtensor
                     this_slice = tensor.get_idx_list(cl.inputs,
                                                      cl.op.idx_list)
@@ -1293,6 +1607,17 @@ class ScanSaveMem(gof.Optimizer):
                 if type(cl) == str:
                     store_steps[i] = 0
                     break
+                elif cl in shape_clients[i]:
+                    # Only the length (which is not stored), or the shape
+                    # of one step
+                    if store_steps[i] == 0 or (
+                            isinstance(cl.op, Shape_i) and cl.op.i == 0):
+                        continue
+                    pval = max(1, init_l[i] + int(preallocable(i)))
+                    if store_steps[i] != -1:
+                        pval = select_max(pval, store_steps[i])
+                    store_steps[i] = pval
+                    flag_store = True
                 elif not isinstance(cl.op, tensor.Subtensor):
                     store_steps[i] = 0
                     break
@@ -1308,7 +1633,9 @@ class ScanSaveMem(gof.Optimizer):
                         store_steps[i] = 0
                         break
 
-                    if i > op.n_mit_mot:
+                    # The length comes from the inputs: the old outputs must
+                    # not appear in the new slices.
+                    if i >= op.n_mit_mot:
                         length = node.inputs[0] + init_l[i]
                     else:
                         try:
@@ -1336,17 +1663,7 @@ class ScanSaveMem(gof.Optimizer):
                         # for mitsots and sitsots (because mitmots are not
                         # currently supported by the mechanism) and only if
                         # the pre-allocation mechanism is activated.
-                        prealloc_outs = \
-                                theano.config.scan.allow_output_prealloc
-
-                        first_mitsot_idx = node.op.n_mit_mot
-                        last_sitsot_idx = (node.op.n_mit_mot +
-                                           node.op.n_mit_sot +
-                                           node.op.n_sit_sot - 1)
-                        preallocable_output = (i >= first_mitsot_idx and
-                                               i <= last_sitsot_idx)
-
-                        if (prealloc_outs and preallocable_output):
+                        if preallocable(i):
                             pval = select_max(nw_steps - start + init_l[i],
                                               init_l[i] + 1)
                         else:
@@ -1398,7 +1715,12 @@ class ScanSaveMem(gof.Optimizer):
                 if not(type(_val) is int and _val <= 0 and i not in required):
 
                     if idx + op.n_mit_mot in required:
+                        # Only the inner function uses this state: keep its
+                        # taps, plus one slot if the new state is written
+                        # in the buffer (see preallocable).
                         val = 1
+                        if init_l[i] > 1 and preallocable(i):
+                            val = init_l[i] + 1
                     else:
                         val = _val
                     # If the memory for this output has been pre-allocated
@@ -1442,19 +1764,22 @@ class ScanSaveMem(gof.Optimizer):
                         nw_inputs[offset + idx] = nw_input
                         replaced_outs.append(op.n_mit_mot + idx)
                         odx = op.n_mit_mot + idx
-                        old_outputs += [(odx, [x[0].outputs[0] for x in
-                                        node.outputs[odx].clients])]
+                        old_outputs += [(odx, [x.outputs[0] for x in
+                                               sub_clients[odx]])]
                     # If there is no memory pre-allocated for this output
                     elif idx < op.n_mit_sot + op.n_sit_sot + op.n_nit_sot:
 
                         pos = (op.n_mit_mot + idx + op.n_seqs +
                                1 + op.n_shared_outs)
                         if nw_inputs[pos] == node.inputs[0]:
-                            nw_inputs[pos] = val
+                            # val is an int for the outputs only used
+                            # through their shape
+                            nw_inputs[pos] = tensor.cast(
+                                val, node.inputs[0].dtype)
                         odx = op.n_mit_mot + idx
                         replaced_outs.append(odx)
-                        old_outputs += [(odx, [x[0].outputs[0] for x in
-                                        node.outputs[odx].clients])]
+                        old_outputs += [(odx, [x.outputs[0] for x in
+                                               sub_clients[odx]])]
             # 3.4. Recompute inputs for everything else based on the new
             # number of steps
             if global_nsteps is not None:
@@ -1523,7 +1848,7 @@ class ScanSaveMem(gof.Optimizer):
             # the number of intermediate steps stored
             for idx, sl in enumerate(slices):
                 if global_nsteps and sl is not None and store_steps[idx] == 0:
-                    for hdx, cl in enumerate(node.outputs[idx].clients):
+                    for hdx, cl in enumerate(sub_clients[idx]):
                         cnf_slice, old_slices = sl[hdx]
                         # Sanitize the nw_slice by converting ints back into
                         # constants :) I only need to do this for the first
@@ -1550,7 +1875,7 @@ class ScanSaveMem(gof.Optimizer):
                         if new_o.ndim > 0:
                             new_o = new_o[::cnf_slice[1]]
                         replaced_outs.append(idx)
-                        old_new += [(cl[0].outputs[0], new_o)]
+                        old_new += [(cl.outputs[0], new_o)]
             # 3.8. Get replace pairs for those outputs that change
             # the number of stored intermediate steps
             for pos, old_outs in old_outputs:
@@ -1589,7 +1914,31 @@ class ScanSaveMem(gof.Optimizer):
                             new_o = new_o[::cnf_slice[1]]
                         old_new += [(old, new_o)]
 
-            # 3.9. Get replace pairs for all other nodes
+            # 3.9. Get replace pairs for the shape clients. The length of the
+            # old output is the length of its buffer, given as input.
+            for idx, clients in enumerate(shape_clients):
+                if not clients:
+                    continue
+                if idx < op.n_mit_mot + op.n_mit_sot + op.n_sit_sot:
+                    length = node.inputs[1 + op.n_seqs + idx].shape[0]
+                else:
+                    length = node.inputs[1 + op.n_seqs + op.n_shared_outs +
+                                         idx]
+                length = tensor.cast(length, 'int64')
+                for cl in clients:
+                    if isinstance(cl.op, Shape_i) and cl.op.i == 0:
+                        new_o = length
+                    else:
+                        new_out = new_outs[compress_map[idx]]
+                        if isinstance(cl.op, Shape_i):
+                            new_o = Shape_i(cl.op.i)(new_out)
+                        else:
+                            new_o = tensor.stack(
+                                length, *[Shape_i(k)(new_out)
+                                          for k in xrange(1, new_out.ndim)])
+                    old_new += [(cl.outputs[0], new_o)]
+
+            # 3.10. Get replace pairs for all other nodes
             if flag_store or global_nsteps is not None:
                 for idx, o in enumerate(node.outputs):
                     if not (idx in replaced_outs) and \
@@ -1838,6 +2187,26 @@ class ScanMerge(gof.Optimizer):
                                                   rep.op.inputs)
         return same_cond and (nsteps == rep_nsteps) and can_add
 
+    def set_key(self, node):
+        """
+        Return a key such that the nodes for which `belongs_to_set` can be
+        True have the same key, computed from the number of steps, the
+        value of truncate_gradient and the hash of the condition (if any).
+
+        """
+        nsteps = node.inputs[0]
+        try:
+            nsteps = int(get_scalar_constant_value(nsteps))
+        except tensor.NotScalarConstantError:
+            pass
+        if node.op.as_while:
+            cond_hash = scan_utils.hash_computations([node.op.outputs[-1]],
+                                                     node.op.inputs)[0]
+        else:
+            cond_hash = None
+        return (node.op.as_while, nsteps, node.op.truncate_gradient,
+                cond_hash)
+
     def apply(self, fgraph):
         # Collect all scan nodes ordered according to toposort
         scan_nodes = [nd for nd in fgraph.toposort()
@@ -1845,11 +2214,15 @@ class ScanMerge(gof.Optimizer):
 
         # All sets of possibly mergeable nodes
         all_sets = []
+        # Key returned by set_key -> positions in all_sets of the sets with
+        # that key. Only these sets are compared with a node.
+        sets_by_key = {}
 
         for nd in scan_nodes:
             belongs_to_set_idx = -1
-            for pos, subset in enumerate(all_sets):
-                if self.belongs_to_set(nd, subset):
+            key = self.set_key(nd)
+            for pos in sets_by_key.get(key, []):
+                if self.belongs_to_set(nd, all_sets[pos]):
                     belongs_to_set_idx = pos
                     # It is possible that nd belongs to more than one subset.
                     # For instance, if we have 3 Scan nodes X, Y and Z, if Z
@@ -1859,6 +2232,7 @@ class ScanMerge(gof.Optimizer):
                     break
 
             if belongs_to_set_idx == -1:
+                sets_by_key.setdefault(key, []).append(len(all_sets))
                 all_sets.append([nd])
             else:
                 all_sets[belongs_to_set_idx].append(nd)
@@ -1993,6 +2367,13 @@ def scan_merge_inouts(node):
             else:
                 seen[(oms, sl)] = ims
 
+    # The inner outputs are only compared with equal_computations when
+    # they have the same hash. The variables of left hash like the
+    # corresponding ones of right, which they are considered equal to.
+    memo = {}
+    for l, r in zip(left, right):
+        memo[l] = memo.setdefault(r, hash(r))
+
     def map_out(outer_i, inner_o, outer_o, seen):
         # Return the outer input corresponding to an
         # (outer input, inner output) pair. If we see that pair for the first
@@ -2001,14 +2382,16 @@ def scan_merge_inouts(node):
         # Note that we need to check that the outer input match as well,
         # because they could have different sizes, and the corresponding
         # outer outputs cannot be merged in that case.
-        for s_outer_i, s_inner_o, s_outer_o in seen:
+        h = scan_utils.hash_computations([inner_o], memo=memo)[0]
+        bucket = seen.setdefault(h, [])
+        for s_outer_i, s_inner_o, s_outer_o in bucket:
             if (equal_computations([inner_o], [s_inner_o], left, right)
                     and outer_i == s_outer_i):
                 return s_outer_o
-        seen.append((outer_i, inner_o, outer_o))
+        bucket.append((outer_i, inner_o, outer_o))
         return outer_o
 
-    seen = []
+    seen = {}
 
     assert len(na.outer_in_nit_sot) == len(na.inner_out_nit_sot)
     assert len(na.inner_out_nit_sot) == len(na.outer_out_nit_sot)
@@ -2018,7 +2401,7 @@ def scan_merge_inouts(node):
                                              na.inner_out_nit_sot,
                                              na.outer_out_nit_sot)]
 
-    seen = []
+    seen = {}
     assert len(na.outer_in_sit_sot) == len(na.inner_out_sit_sot)
     assert len(na.inner_out_sit_sot) == len(na.outer_out_sit_sot)
     na.outer_out_sit_sot = [
@@ -2027,7 +2410,7 @@ def scan_merge_inouts(node):
                                              na.inner_out_sit_sot,
                                              na.outer_out_sit_sot)]
 
-    seen = []
+    seen = {}
     assert len(na.outer_in_mit_sot) == len(na.inner_out_mit_sot)
     assert len(na.inner_out_mit_sot) == len(na.outer_out_mit_sot)
     na.outer_out_mit_sot = [
@@ -2036,7 +2419,7 @@ def scan_merge_inouts(node):
                                              na.inner_out_mit_sot,
                                              na.outer_out_mit_sot)]
 
-    seen = []
+    seen = {}
     new_outer_out_mit_mot = []
     assert len(na.outer_in_mit_mot) == len(na.inner_out_mit_mot)
     assert len(na.inner_out_mit_mot) == len(na.outer_out_mit_mot)
@@ -2045,14 +2428,16 @@ def scan_merge_inouts(node):
                                                     na.inner_out_mit_mot,
                                                     na.outer_out_mit_mot,
                                                     na.mit_mot_out_slices):
-        for s_outer_imm, s_inner_omm, s_outer_omm, sosl in seen:
+        h = hash(tuple(scan_utils.hash_computations(inner_omm, memo=memo)))
+        bucket = seen.setdefault(h, [])
+        for s_outer_imm, s_inner_omm, s_outer_omm, sosl in bucket:
             if (osl == sosl
                     and equal_computations(inner_omm, s_inner_omm, left, right)
                     and outer_imm == s_outer_imm):
                 new_outer_out_mit_mot.append(s_outer_omm)
                 break
         else:
-            seen.append((outer_imm, inner_omm, outer_omm, osl))
+            bucket.append((outer_imm, inner_omm, outer_omm, osl))
             new_outer_out_mit_mot.append(outer_omm)
     na.outer_out_mit_mot = new_outer_out_mit_mot
 
@@ -2303,6 +2688,28 @@ scan_seqopt1.register('scanOp_pushout_output',
                       'scan')
 
 
+scan_seqopt1.register('scan_batched_dot',
+                      opt.in2out(scan_batched_dot, ignore_newtrees=True),
+                      5.5,
+                      'fast_run',
+                      'scan')
+
+
+# Not enabled by default: include it with the tag 'scan_vectorize'.
+scan_seqopt1.register('scan_vectorize_map',
+                      opt.in2out(scan_vectorize_map, ignore_newtrees=True),
+                      6,
+                      'scan_vectorize')
+
+
+scan_seqopt1.register('scan_unroll',
+                      opt.in2out(scan_unroll, ignore_newtrees=True),
+                      7,
+                      'fast_run',
+                      'scan_unrolling',
+                      'scan')
+
+
 scan_eqopt2.register('constant_folding_for_scan2',
                       opt.in2out(tensor.opt.constant_folding,
                                  ignore_newtrees=True),
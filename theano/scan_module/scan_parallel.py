@@ -0,0 +1,297 @@
+"""
+This module runs the steps of a Scan on several threads
+(config.scan.n_threads).
+
+Two kinds of scans can use the threads:
+
+* The scans that only map a function over their sequences (no recurrent
+  state, shared outputs or condition). The steps are split into one chunk
+  of consecutive steps per thread, and each thread calls its own copy of
+  the inner function.
+
+* The scans whose recurrent outputs form several independent groups: the
+  outputs of a group only depend on the states of that group (and on the
+  sequences and non-sequences). The dependencies are found on the inner
+  graph parsed by `scan_utils.scan_args`, and each group is computed by its
+  own Scan op on a thread.
+
+The threads only run at the same time while the computations release the
+GIL: numpy does it for most of its operations on large arrays, and the C
+code of the BLAS ops (Gemm, Dot22, BatchedDot22, CGemv, CGer) does it
+around its BLAS calls. The rest of the C thunks and the C VM keep it, as
+they use Python objects all along, so only the matrix products of the
+steps overlap. No speedup has been measured yet, so this is disabled by
+default. The other scans use the default implementation.
+
+"""
+from __future__ import print_function
+
+__docformat__ = 'restructedtext en'
+
+import copy
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+
+import numpy
+from six import iteritems
+from six.moves import xrange
+
+from theano import gof
+from theano.compat import izip, OrderedDict
+from theano.scan_module import scan_utils
+
+# n_threads -> ThreadPool, created when first needed and shared by all the
+# scans.
+_pools = {}
+# `_local.in_pool` is True in the threads of the pools. A scan called from
+# them (in the inner graph of another scan) doesn't wait for the pool.
+_local = threading.local()
+
+
+def _get_pool(n_threads):
+    if n_threads not in _pools:
+        _pools[n_threads] = ThreadPool(n_threads)
+    return _pools[n_threads]
+
+
+def can_run_in_parallel(op):
+    """
+    Return True if the steps or the outputs of the Scan `op` may be computed
+    on several threads (see `ScanParallel`).
+
+    """
+    if (op.info.get('gpu') or op.info.get('gpua') or op.as_while or
+            op.n_mit_mot or op.n_shared_outs):
+        return False
+    return op.n_mit_sot + op.n_sit_sot + op.n_nit_sot > 0
+
+
+def independent_groups(args):
+    """
+    Split the outputs of a scan in groups that don't depend on each other.
+
+    Parameters
+    ----------
+    args
+        The `scan_utils.scan_args` of a scan without mit_mot or shared
+        outputs.
+
+    Returns
+    -------
+    list of lists
+        The indices of the outputs of each group, in the order of the
+        mit_sot, sit_sot and nit_sot outputs. An output joins the groups of
+        the states it reads.
+
+    """
+    states = ([list(taps) for taps in args.inner_in_mit_sot] +
+              [[var] for var in args.inner_in_sit_sot])
+    state_of = {}
+    for idx, taps in enumerate(states):
+        for var in taps:
+            state_of[var] = idx
+    inner_outs = (args.inner_out_mit_sot + args.inner_out_sit_sot +
+                  args.inner_out_nit_sot)
+
+    # Union-find over the outputs, the states being the first outputs.
+    parent = list(range(len(inner_outs)))
+
+    def find(idx):
+        while parent[idx] != idx:
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+    for idx, out in enumerate(inner_outs):
+        for var in gof.graph.inputs([out]):
+            if var in state_of:
+                parent[find(state_of[var])] = find(idx)
+
+    groups = {}
+    for idx in xrange(len(inner_outs)):
+        groups.setdefault(find(idx), []).append(idx)
+    return sorted(groups.values())
+
+
+def _select(args, group):
+    # Return a copy of the scan_args `args` that only computes the outputs
+    # of `group`.
+    n_mit_sot = len(args.outer_in_mit_sot)
+    n_states = n_mit_sot + len(args.outer_in_sit_sot)
+    mit_sot = [idx for idx in group if idx < n_mit_sot]
+    sit_sot = [idx - n_mit_sot for idx in group
+               if n_mit_sot <= idx < n_states]
+    nit_sot = [idx - n_states for idx in group if idx >= n_states]
+    new = copy.copy(args)
+    # copy.copy only copies the lists and the dict of `args`. The dicts in
+    # other_info (destroy_map) are the ones of the op of the whole scan.
+    new.other_info = OrderedDict(
+        (k, copy.deepcopy(v) if isinstance(v, dict) else v)
+        for k, v in iteritems(args.other_info))
+    for attr, indices in [('mit_sot', mit_sot), ('sit_sot', sit_sot)]:
+        for prefix in ['outer_in_', 'inner_in_', 'outer_out_', 'inner_out_']:
+            old = getattr(args, prefix + attr)
+            setattr(new, prefix + attr, [old[idx] for idx in indices])
+    new.mit_sot_in_slices = [args.mit_sot_in_slices[idx] for idx in mit_sot]
+    for attr in ['outer_in_nit_sot', 'outer_out_nit_sot',
+                 'inner_out_nit_sot']:
+        old = getattr(args, attr)
+        setattr(new, attr, [old[idx] for idx in nit_sot])
+    # The outputs of the group are new buffers: the inputs of the whole
+    # scan are not destroyed.
+    new.other_info['destroy_map'] = OrderedDict()
+    # The group already runs on a thread of the pool.
+    new.other_info['parallel'] = False
+    return new
+
+
+class ScanParallel(object):
+    """
+    Run the steps of a Scan node, or its independent groups of outputs, on
+    `n_threads` threads.
+
+    Parameters
+    ----------
+    op
+        The Scan op. `can_run_in_parallel(op)` must be True.
+    node
+        The Apply node of `op`.
+    default
+        The default implementation, called as ``default(node, args,
+        outs)`` for the calls that can't use the threads.
+    n_threads
+        The number of threads.
+
+    Notes
+    -----
+    `usable` is False when the scan neither maps a function over its
+    sequences nor has independent groups of outputs.
+
+    """
+
+    def __init__(self, op, node, default, n_threads):
+        self.op = op
+        self.default = default
+        self.n_threads = n_threads
+        self.is_map = op.n_mit_sot + op.n_sit_sot == 0
+        self.fns = []
+        self.groups = []
+        if self.is_map:
+            # Each thread needs its own storage.
+            self.fns = [op.fn] + [op.fn.copy() for i in
+                                  xrange(n_threads - 1)]
+        else:
+            args = scan_utils.scan_args(node.inputs, node.outputs,
+                                        op.inputs, op.outputs, op.info)
+            groups = independent_groups(args)
+            if len(groups) > 1:
+                self.groups = [self._make_group(node, args, group)
+                               for group in groups]
+        self.usable = self.is_map or bool(self.groups)
+
+    def _make_group(self, node, args, group):
+        # Import here to avoid a circular import with scan_op.
+        from theano.scan_module.scan_op import Scan
+        new = _select(args, group)
+        sub_op = Scan(new.inner_inputs, new.inner_outputs, new.info)
+        sub_node = sub_op(*new.outer_inputs, return_list=True)[0].owner
+        storage_map = dict((var, [None])
+                           for var in sub_node.inputs + sub_node.outputs)
+        compute_map = dict((var, [False])
+                           for var in sub_node.inputs + sub_node.outputs)
+        thunk = sub_op.make_thunk(sub_node, storage_map, compute_map, [])
+        # Outer inputs of the group: the step count, the sequences, the
+        # initial states and nit_sot sizes of the group, the non sequences.
+        outer_state_start = 1 + self.op.n_seqs
+        inputs = ([0] + list(xrange(1, outer_state_start)) +
+                  [outer_state_start + idx for idx in group] +
+                  list(xrange(self.op.nit_sot_arg_offset + self.op.n_nit_sot,
+                              len(node.inputs))))
+        assert len(inputs) == len(sub_node.inputs)
+        return (thunk, [storage_map[var] for var in sub_node.inputs],
+                [storage_map[var] for var in sub_node.outputs], inputs, group)
+
+    def __call__(self, node, args, outs):
+        if getattr(_local, 'in_pool', False):
+            return self.default(node, args, outs)
+        if self.is_map:
+            return self._run_map(node, args, outs)
+        return self._run_groups(node, args, outs)
+
+    def _run_groups(self, node, args, outs):
+        t0_call = time.time()
+
+        def run(group):
+            _local.in_pool = True
+            thunk, input_storage, output_storage, inputs, indices = group
+            for storage, idx in izip(input_storage, inputs):
+                storage[0] = args[idx]
+            for storage, idx in izip(output_storage, indices):
+                storage[0] = outs[idx][0]
+            thunk()
+            for storage, idx in izip(output_storage, indices):
+                outs[idx][0] = storage[0]
+            for storage in input_storage:
+                storage[0] = None
+
+        _get_pool(self.n_threads).map(run, self.groups)
+        self._update_profile(args[0], time.time() - t0_call)
+
+    def _run_map(self, node, args, outs):
+        op = self.op
+        t0_call = time.time()
+        n_steps = args[0]
+        seqs = args[1:1 + op.n_seqs]
+        nit_sot_steps = args[op.nit_sot_arg_offset:
+                             op.nit_sot_arg_offset + op.n_nit_sot]
+        non_seqs = list(args[op.nit_sot_arg_offset + op.n_nit_sot:])
+        if (n_steps < 2 * self.n_threads or
+                any(seq.shape[0] < n_steps for seq in seqs) or
+                any(steps != n_steps for steps in nit_sot_steps)):
+            # Too few steps to be worth it, or the special cases of the
+            # default implementation (errors, ScanSaveMem buffers).
+            return self.default(node, args, outs)
+
+        def step_inputs(i):
+            rval = []
+            for seq in seqs:
+                if seq.ndim == 1:
+                    rval.append(seq[i:i + 1].reshape(()))
+                else:
+                    rval.append(seq[i])
+            return rval + non_seqs
+
+        # The first step gives the shapes of the outputs.
+        first = self.fns[0](*step_inputs(0))
+        bufs = []
+        for idx, val in enumerate(first):
+            shape = (n_steps,) + val.shape
+            buf = outs[idx][0]
+            if (buf is None or buf.shape != shape or
+                    buf.dtype != node.outputs[idx].dtype):
+                buf = numpy.empty(shape, dtype=node.outputs[idx].dtype)
+            buf[0] = val
+            bufs.append(buf)
+
+        bounds = numpy.linspace(1, n_steps, self.n_threads + 1).astype(int)
+
+        def run(chunk):
+            _local.in_pool = True
+            fn, start, stop = chunk
+            for i in xrange(start, stop):
+                for buf, val in izip(bufs, fn(*step_inputs(i))):
+                    buf[i] = val
+
+        _get_pool(self.n_threads).map(
+            run, list(izip(self.fns, bounds[:-1], bounds[1:])))
+        for idx, buf in enumerate(bufs):
+            outs[idx][0] = buf
+        self._update_profile(n_steps, time.time() - t0_call)
+
+    def _update_profile(self, n_steps, t_call):
+        profile = getattr(self.op.fn.maker, 'profile', None)
+        if profile:
+            profile.callcount += 1
+            profile.nbsteps += n_steps
+            profile.call_time += t_call
@@ -549,6 +549,76 @@ def equal_computations(xs, ys, in_xs=None, in_ys=None):
     return True
 
 
+def hash_computations(xs, in_xs=None, memo=None):
+    """Return a hash of the computation of each variable of `xs`.
+
+    This is the hash counterpart of `equal_computations`: if
+    ``equal_computations(xs, ys, in_xs, in_ys)`` is True, then
+    ``hash_computations(xs, in_xs)`` and ``hash_computations(ys, in_ys)``
+    are equal. The converse doesn't hold, so two computations with the
+    same hash still have to be compared with `equal_computations`, but
+    grouping them by hash first avoids comparing every pair of graphs.
+
+    The hash of a variable is computed from the Op of its owner, its
+    index in the outputs of the owner and the hashes of the inputs of the
+    owner. The variables of `in_xs` are hashed by position and type,
+    the constants by value and the other inputs of the graph by identity.
+
+    Parameters
+    ----------
+    xs
+        List of variables.
+    in_xs
+        Inputs of the graph that are hashed by position.
+    memo
+        Optional dict variable -> hash, updated with the hashes computed.
+        It can be shared between calls with the same `in_xs` to hash the
+        subgraphs only once, and filled beforehand to make some variables
+        hash like other ones.
+
+    """
+    if memo is None:
+        memo = {}
+    if in_xs is not None:
+        for idx, x in enumerate(in_xs):
+            if x not in memo:
+                memo[x] = hash(('input', idx, x.type))
+
+    def leaf_hash(var):
+        if isinstance(var, gof.Constant):
+            try:
+                return hash(('constant', var.signature()))
+            except TypeError:
+                return hash(('constant', var.type))
+        return hash(var)
+
+    rval = []
+    for x in xs:
+        # Depth first exploration, with an explicit stack since the inner
+        # graphs can be deeper than the recursion limit.
+        stack = [x]
+        while stack:
+            var = stack[-1]
+            if var in memo:
+                stack.pop()
+                continue
+            node = var.owner
+            if node is None:
+                memo[var] = leaf_hash(var)
+                stack.pop()
+                continue
+            missing = [i for i in node.inputs if i not in memo]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            node_hash = hash((node.op, tuple(memo[i] for i in node.inputs)))
+            for idx, out in enumerate(node.outputs):
+                memo[out] = hash((node_hash, idx))
+        rval.append(memo[x])
+    return rval
+
+
 def infer_shape(outs, inputs, input_shapes):
     """
     Compute the shape of the outputs given the shape of the inputs of a theano
@@ -754,6 +824,8 @@ def compress_outs(op, not_required, inputs):
     info['as_while'] = op.info['as_while']
     info['profile'] = op.info['profile']
     info['allow_gc'] = op.info['allow_gc']
+    if 'unrolled' in op.info:
+        info['unrolled'] = op.info['unrolled']
 
     op_inputs = op.inputs[:op.n_seqs]
     op_outputs = []
@@ -1025,7 +1097,8 @@ class scan_args(object):
 
         self.other_info = OrderedDict()
         for k in ('truncate_gradient', 'name', 'mode', 'destroy_map',
-                  'gpu', 'gpua', 'as_while', 'profile', 'allow_gc'):
+                  'gpu', 'gpua', 'as_while', 'profile', 'allow_gc',
+                  'unrolled'):
             if k in info:
                 self.other_info[k] = info[k]
 
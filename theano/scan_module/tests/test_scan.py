@@ -1,6 +1,7 @@
 from __future__ import print_function
 import os
 import shutil
+import gc
 import sys
 from tempfile import mkdtemp
 import time
@@ -22,6 +23,7 @@ from theano import tensor
 from theano.compile.pfunc import rebuild_collect_shared
 from theano.tests import unittest_tools as utt
 import theano.scalar.sharedvar
+from theano.scan_module import scan_op, scan_utils
 from theano.scan_module.scan_op import Scan
 from theano.compat import PY3, OrderedDict
 
@@ -2396,6 +2398,73 @@ class T_Scan(unittest.TestCase):
         utt.assert_allclose(tx4, v_u[-1] + 4.)
         utt.assert_allclose(tx5, v_u[-1] + 5.)
 
+    def test_save_mem_peak_bytes(self):
+        # The bytes stored by the outputs of the scan for common RNN
+        # patterns, where only the last steps are needed.
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        h0 = tensor.vector('h0')
+        m0 = tensor.matrix('m0')
+        x_val = rng.uniform(size=(20, 4)).astype(floatX)
+        w_val = rng.uniform(size=(4, 4)).astype(floatX)
+        h0_val = rng.uniform(size=(4,)).astype(floatX)
+        m0_val = rng.uniform(size=(2, 4)).astype(floatX)
+        row = x_val[0].nbytes
+
+        def peak_bytes(step, outputs_info, outputs):
+            profile = theano.compile.profiling.ScanProfileStats(
+                atexit_print=False)
+            outs, _ = theano.scan(step, sequences=[x],
+                                  outputs_info=outputs_info,
+                                  non_sequences=[w], profile=profile)
+            f = theano.function([x, w, h0, m0], outputs(outs),
+                                on_unused_input='ignore')
+            f(x_val, w_val, h0_val, m0_val)
+            return profile.output_memory
+
+        if theano.config.mode in ['FAST_COMPILE', 'DebugMode', 'DEBUG_MODE']:
+            raise SkipTest('ScanSaveMem does not run in this mode')
+
+        def rnn(x_t, h_tm1, w):
+            return tensor.tanh(tensor.dot(h_tm1, w) + x_t)
+
+        def lstm_like(x_t, h_tm1, c_tm1, w):
+            c_t = c_tm1 + tensor.tanh(tensor.dot(h_tm1, w) + x_t)
+            return tensor.tanh(c_t), c_t
+
+        def second_order(x_t, m_tm2, m_tm1, w):
+            return tensor.tanh(tensor.dot(m_tm1, w) + x_t) - m_tm2
+
+        def with_output(x_t, h_tm1, w):
+            h_t = rnn(x_t, h_tm1, w)
+            return h_t, tensor.dot(w, h_t)
+
+        # The whole history is needed
+        assert peak_bytes(rnn, [h0], lambda h: h.sum()) >= 20 * row
+        # Last step, with the taps and one slot for the new state
+        assert peak_bytes(rnn, [h0], lambda h: h[-1]) <= 2 * row
+        assert peak_bytes(rnn, [h0],
+                          lambda h: [h[-1], h.shape[0]]) <= 2 * row
+        # Several subtensor clients
+        assert peak_bytes(rnn, [h0],
+                          lambda h: [h[-1], h[-3]]) <= 4 * row
+        # A state only used inside the scan
+        assert peak_bytes(lstm_like, [h0, h0],
+                          lambda hc: hc[0][-1]) <= 4 * row
+        # Two taps
+        assert peak_bytes(second_order,
+                          [dict(initial=m0, taps=[-2, -1])],
+                          lambda m: m[-1]) <= 3 * row
+        # An output that is not recurrent, used through its shape
+        assert peak_bytes(with_output, [h0, None],
+                          lambda hy: [hy[0][-1], hy[1].shape]) <= 3 * row
+        # Only the shape of one step, which stores a single step
+        assert peak_bytes(lambda x_t, h_tm1, w: [rnn(x_t, h_tm1, w), x_t * 2],
+                          [h0, None],
+                          lambda hy: [hy[0][-1], hy[1].shape[1]]) <= 3 * row
+
     def test_use_scan_direct_output(self):
         # This test looks for a crash that happened when directly using the
         # recurrent output of a scan node instead of taking the result
@@ -2745,6 +2814,109 @@ class T_Scan(unittest.TestCase):
         assert scan1.owner.op == scan2.owner.op
         assert hash(scan1.owner.op) == hash(scan2.owner.op)
 
+    def test_hash_computations(self):
+        x = theano.tensor.vector()
+        y = theano.tensor.vector()
+        w = theano.tensor.vector()
+        out_x = tensor.exp(x) * 2 + w
+        out_y = tensor.exp(y) * 2 + w
+        h = scan_utils.hash_computations
+        assert scan_utils.equal_computations([out_x], [out_y], [x], [y])
+        assert h([out_x], [x]) == h([out_y], [y])
+        assert h([out_x], [x]) != h([tensor.exp(x) * 3 + w], [x])
+        assert h([out_x], [x]) != h([tensor.exp(x) * 2 + y], [x])
+        # The inputs are hashed by position
+        assert h([x + w], [x, w]) != h([w + x], [x, w])
+        # A deep graph doesn't exceed the recursion limit
+        deep = x
+        for i in xrange(5000):
+            deep = deep + 1
+        h([deep], [x])
+
+    def test_share_inner_function(self):
+        orig = theano.config.scan.share_inner_function
+        theano.config.scan.share_inner_function = True
+        try:
+            self._test_share_inner_function()
+        finally:
+            theano.config.scan.share_inner_function = orig
+
+    def _test_share_inner_function(self):
+        x = theano.tensor.vector()
+        y = theano.tensor.vector()
+        # A recurrence, so the optimizations can't remove the scans
+        sx, _ = theano.scan(lambda _x, acc: acc + tensor.exp(_x), x,
+                            outputs_info=[tensor.zeros_like(x[0])])
+        sy, _ = theano.scan(lambda _y, acc: acc + tensor.exp(_y), y,
+                            outputs_info=[tensor.zeros_like(y[0])])
+        # The CVM isn't tracked by the garbage collector, so the functions
+        # use the Python VM to be freed at the end.
+        mode = theano.compile.Mode(
+            linker='vm', optimizer=theano.compile.get_default_mode().optimizer)
+        f = theano.function([x], sx, mode=mode)
+        g = theano.function([y], sy, mode=mode)
+        ops = [nd.op for fn in [f, g] for nd in fn.maker.fgraph.toposort()
+               if isinstance(nd.op, Scan)]
+        assert len(ops) == 2
+        assert ops[0] == ops[1] and ops[0] is not ops[1]
+        assert ops[0].fn is not ops[1].fn
+        # Only the first inner function was compiled
+        entries = scan_op._inner_functions[ops[0]._hash_inner_graph]
+        assert len([ref for ref, config_md5 in entries
+                    if ref() in ops]) == 1
+        v = numpy.arange(4).astype(theano.config.floatX)
+        utt.assert_allclose(f(v), numpy.cumsum(numpy.exp(v)))
+        utt.assert_allclose(g(v * 2), numpy.cumsum(numpy.exp(v * 2)))
+        # The entries of the ops that don't exist anymore are removed
+        key = ops[0]._hash_inner_graph
+        del f, g, ops, sx, sy
+        gc.collect()
+        assert key not in scan_op._inner_functions
+
+    def test_share_inner_function_checkpoints(self):
+        # The checkpointed scans going forward and backward have equal
+        # scans inside. Their gradients must not change when those are
+        # shared.
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        h0 = tensor.vector('h0')
+
+        def step(x_t, h_tm1, w):
+            h_t = tensor.tanh(tensor.dot(h_tm1, w) + x_t)
+            return h_t, h_t.sum()
+
+        x_val = rng.uniform(size=(10, 3)).astype(floatX)
+        w_val = rng.uniform(size=(3, 3)).astype(floatX)
+        h0_val = rng.uniform(size=(3,)).astype(floatX)
+
+        orig = theano.config.scan.share_inner_function
+        results = {}
+        # Keep the functions, so that their inner functions can be shared.
+        fns = []
+        try:
+            for share in [False, True]:
+                theano.config.scan.share_inner_function = share
+                for checkpoint_every in [3, 5]:
+                    for go_backwards in [False, True]:
+                        (h, s), _ = theano.scan(
+                            step, sequences=[x], outputs_info=[h0, None],
+                            non_sequences=[w], go_backwards=go_backwards,
+                            checkpoint_every=checkpoint_every)
+                        cost = h[-1].sum() + (s ** 2).sum()
+                        grads = tensor.grad(cost, [x, w, h0])
+                        fns.append(theano.function([x, w, h0],
+                                                   [h, s] + grads))
+                        results[share, checkpoint_every, go_backwards] = \
+                            fns[-1](x_val, w_val, h0_val)
+        finally:
+            theano.config.scan.share_inner_function = orig
+        for (share, checkpoint_every, go_backwards), r in results.items():
+            for r1, r2 in zip(results[False, checkpoint_every,
+                                      go_backwards], r):
+                utt.assert_allclose(r1, r2)
+
     def test_same(self):
         # This test is checking a bug discovered by Arnaud and it is based
         # on his code
@@ -4378,6 +4550,314 @@ class T_Scan(unittest.TestCase):
         else:
             assert detect_large_outputs.large_count == 3
 
+    def test_compiled_loop(self):
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        m0 = tensor.matrix('m0')
+        s0 = tensor.vector('s0')
+
+        def step(x_t, m_tm2, m_tm1, s_tm1, w):
+            m_t = tensor.tanh(tensor.dot(m_tm1, w) + x_t) - m_tm2
+            s_t = s_tm1 + m_t.sum()
+            return m_t, s_t, x_t.sum()
+
+        (m, s, n), _ = theano.scan(
+            step, sequences=[x],
+            outputs_info=[dict(initial=m0, taps=[-2, -1]), s0, None],
+            non_sequences=[w])
+        x_val = rng.uniform(size=(7, 3)).astype(floatX)
+        w_val = rng.uniform(size=(3, 3)).astype(floatX)
+        m0_val = rng.uniform(size=(2, 3)).astype(floatX)
+        s0_val = rng.uniform(size=(1,)).astype(floatX)
+
+        # With the last step only, ScanSaveMem makes circular buffers
+        for outputs in [[m, s, n], [m[-1], s[-1], n[-1]]]:
+            results = []
+            orig = theano.config.scan.compiled_loop
+            for compiled_loop in [False, True]:
+                theano.config.scan.compiled_loop = compiled_loop
+                try:
+                    f = theano.function([x, w, m0, s0], outputs)
+                finally:
+                    theano.config.scan.compiled_loop = orig
+                loops = [t for t in getattr(f.fn, 'thunks', [])
+                         if isinstance(getattr(t, 'perform', None),
+                                       theano.scan_module.scan_loop.ScanLoop)]
+                if not compiled_loop:
+                    assert not loops
+                elif isinstance(f.fn, getattr(theano.gof.vm, 'CVM', ())):
+                    # The inner graph uses the same linker as the outer one
+                    assert loops
+                results.append(f(x_val, w_val, m0_val, s0_val))
+                # Calling again must give the same results
+                for r1, r2 in zip(results[-1],
+                                  f(x_val, w_val, m0_val, s0_val)):
+                    utt.assert_allclose(r1, r2)
+            for r1, r2 in zip(*results):
+                utt.assert_allclose(r1, r2)
+
+    def test_compiled_loop_profile(self):
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        h0 = tensor.vector('h0')
+        profile = theano.compile.profiling.ScanProfileStats(
+            atexit_print=False)
+        (h, n), _ = theano.scan(
+            lambda x_t, h_tm1, w: [tensor.tanh(tensor.dot(h_tm1, w) + x_t),
+                                   x_t.sum()],
+            sequences=[x], outputs_info=[h0, None], non_sequences=[w],
+            profile=profile)
+        orig = theano.config.scan.compiled_loop
+        theano.config.scan.compiled_loop = True
+        try:
+            f = theano.function([x, w, h0], [h, n])
+        finally:
+            theano.config.scan.compiled_loop = orig
+        loops = [t.perform for t in getattr(f.fn, 'thunks', [])
+                 if isinstance(getattr(t, 'perform', None),
+                               theano.scan_module.scan_loop.ScanLoop)]
+        if not loops:
+            raise SkipTest('The scan does not use the C loop of the CVM')
+        floatX = theano.config.floatX
+        x_val = numpy.ones((5, 3), dtype=floatX)
+        w_val = numpy.eye(3, dtype=floatX)
+        h0_val = numpy.zeros(3, dtype=floatX)
+        utt.assert_allclose(f(x_val, w_val, h0_val)[1], [3.] * 5)
+        loop, = loops
+        # The inplace optimization copies the info, profile included
+        profile = loop.op.fn.maker.profile
+        assert profile.nbsteps == 5
+        # The profile of the inner function only has the nodes of the inner
+        # graph, the loop graph has its own.
+        inner_nodes = set(loop.op.fn.maker.fgraph.apply_nodes)
+        assert all(node in inner_nodes for node in profile.apply_time)
+        assert any(isinstance(node.op, tensor.IncSubtensor)
+                   for node in loop.fn.profile.apply_time)
+
+    def test_unroll(self):
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        m0 = tensor.matrix('m0')
+        s0 = tensor.vector('s0')
+
+        def step(x_t, m_tm2, m_tm1, s_tm1, w):
+            m_t = tensor.tanh(tensor.dot(m_tm1, w) + x_t) - m_tm2
+            s_t = s_tm1 + m_t.sum()
+            return m_t, s_t, x_t.sum()
+
+        (m, s, n), _ = theano.scan(
+            step, sequences=[x],
+            outputs_info=[dict(initial=m0, taps=[-2, -1]), s0, None],
+            non_sequences=[w], n_steps=6)
+        x_val = rng.uniform(size=(7, 3)).astype(floatX)
+        w_val = rng.uniform(size=(3, 3)).astype(floatX)
+        m0_val = rng.uniform(size=(2, 3)).astype(floatX)
+        s0_val = rng.uniform(size=(1,)).astype(floatX)
+
+        def scan_steps(f):
+            return [int(tensor.get_scalar_constant_value(node.inputs[0]))
+                    for node in f.maker.fgraph.toposort()
+                    if isinstance(node.op, Scan)]
+
+        for outputs in [[m, s, n], [m[-1], s[-1], n[-1]]]:
+            f = theano.function([x, w, m0, s0], outputs)
+            expected = f(x_val, w_val, m0_val, s0_val)
+            # Full unrolling, partial unrolling by 2 and 3 steps
+            for max_steps, factor, n_scan_steps in [(6, 1, []), (4, 2, [3]),
+                                                    (0, 3, [2])]:
+                orig = (theano.config.scan.unroll_max_steps,
+                        theano.config.scan.unroll_factor)
+                theano.config.scan.unroll_max_steps = max_steps
+                theano.config.scan.unroll_factor = factor
+                try:
+                    f = theano.function([x, w, m0, s0], outputs)
+                finally:
+                    (theano.config.scan.unroll_max_steps,
+                     theano.config.scan.unroll_factor) = orig
+                if theano.config.mode != 'FAST_COMPILE':
+                    assert scan_steps(f) == n_scan_steps
+                    assert all(node.op.info['unrolled']
+                               for node in f.maker.fgraph.toposort()
+                               if isinstance(node.op, Scan))
+                for r1, r2 in zip(expected, f(x_val, w_val, m0_val, s0_val)):
+                    utt.assert_allclose(r1, r2)
+
+    def test_checkpoint_every(self):
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        h0 = tensor.vector('h0')
+
+        def step(x_t, h_tm1, w):
+            h_t = tensor.tanh(tensor.dot(h_tm1, w) + x_t)
+            return h_t, h_t.sum()
+
+        x_val = rng.uniform(size=(10, 3)).astype(floatX)
+        w_val = rng.uniform(size=(3, 3)).astype(floatX)
+        h0_val = rng.uniform(size=(3,)).astype(floatX)
+
+        results = []
+        # 10 steps are not a multiple of 3, so the last segment is padded
+        for checkpoint_every in [None, 3, 5]:
+            for go_backwards in [False, True]:
+                (h, s), _ = theano.scan(step, sequences=[x],
+                                        outputs_info=[h0, None],
+                                        non_sequences=[w],
+                                        go_backwards=go_backwards,
+                                        checkpoint_every=checkpoint_every)
+                cost = h[-1].sum() + (s ** 2).sum()
+                grads = tensor.grad(cost, [x, w, h0])
+                f = theano.function([x, w, h0], [h, s] + grads)
+                results.append(f(x_val, w_val, h0_val))
+        for i, r in enumerate(results[2:]):
+            for r1, r2 in zip(results[i % 2], r):
+                utt.assert_allclose(r1, r2)
+
+        self.assertRaises(ValueError, theano.scan, step, sequences=[x],
+                          outputs_info=[h0, None], non_sequences=[w],
+                          truncate_gradient=2, checkpoint_every=3)
+
+    def test_n_threads(self):
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        h0 = tensor.vector('h0')
+        s0 = tensor.vector('s0')
+
+        # A map, and a scan with two independent recurrences. They have a
+        # different number of steps, so they are not merged.
+        m, _ = theano.map(lambda x_t, w: tensor.tanh(tensor.dot(x_t, w)),
+                          sequences=[x[1:]], non_sequences=[w])
+        (h, s, n), _ = theano.scan(
+            lambda x_t, h_tm1, s_tm1, w: [tensor.tanh(tensor.dot(h_tm1, w)),
+                                          s_tm1 + x_t.sum(),
+                                          x_t.max()],
+            sequences=[x], outputs_info=[h0, s0, None], non_sequences=[w])
+        x_val = rng.uniform(size=(9, 3)).astype(floatX)
+        w_val = rng.uniform(size=(3, 3)).astype(floatX)
+        h0_val = rng.uniform(size=(3,)).astype(floatX)
+        s0_val = rng.uniform(size=(1,)).astype(floatX)
+
+        results = []
+        orig = theano.config.scan.n_threads
+        for n_threads in [1, 3]:
+            theano.config.scan.n_threads = n_threads
+            try:
+                f = theano.function([x, w, h0, s0], [m, h, s, n])
+            finally:
+                theano.config.scan.n_threads = orig
+            parallel = [t for t in getattr(f.fn, 'thunks', [])
+                        if isinstance(getattr(t, 'perform', None),
+                                      theano.scan_module.scan_parallel.
+                                      ScanParallel)]
+            if n_threads == 1:
+                assert not parallel
+            elif isinstance(f.fn, getattr(theano.gof.vm, 'CVM', ())):
+                # The map and the scan with two groups
+                assert len(parallel) == 2
+            results.append(f(x_val, w_val, h0_val, s0_val))
+            # Calling again must give the same results
+            for r1, r2 in zip(results[-1], f(x_val, w_val, h0_val, s0_val)):
+                utt.assert_allclose(r1, r2)
+        for r1, r2 in zip(*results):
+            utt.assert_allclose(r1, r2)
+
+    def test_independent_groups(self):
+        x = tensor.matrix('x')
+        h0 = tensor.vector('h0')
+        s0 = tensor.vector('s0')
+        outs, _ = theano.scan(
+            lambda x_t, h_tm1, s_tm1: [h_tm1 * 2, s_tm1 + x_t.sum(),
+                                       h_tm1.sum() + x_t.sum()],
+            sequences=[x], outputs_info=[h0, s0, None])
+        node, = set(var.owner for var in theano.gof.graph.ancestors(outs)
+                    if var.owner and isinstance(var.owner.op, Scan))
+        args = theano.scan_module.scan_utils.scan_args(
+            node.inputs, node.outputs, node.op.inputs, node.op.outputs,
+            node.op.info)
+        groups = theano.scan_module.scan_parallel.independent_groups(args)
+        # The nit_sot reads h, not s.
+        assert groups == [[0, 2], [1]]
+        # The scan_args of a group don't share their info with the others
+        info = dict(node.op.info)
+        new = theano.scan_module.scan_parallel._select(args, groups[1])
+        assert new.info['parallel'] is False
+        assert 'parallel' not in args.other_info
+        assert node.op.info == info
+
+    def test_profile_peak_memory(self):
+        x = tensor.vector('x')
+        profile = theano.compile.profiling.ScanProfileStats(
+            atexit_print=False)
+        h, _ = theano.scan(lambda x_t, h_tm1: h_tm1 + x_t, sequences=[x],
+                           outputs_info=[tensor.constant(0., dtype=x.dtype)],
+                           profile=profile)
+        f = theano.function([x], h)
+        x_val = numpy.ones(5, dtype=x.dtype)
+        f(x_val)
+        # The output stores at least the 5 steps
+        assert profile.output_memory >= x_val.nbytes
+        # The input is live during the call as well
+        assert profile.peak_memory >= profile.output_memory + x_val.nbytes
+
+    def test_checkpoint_every_memory(self):
+        rng = numpy.random.RandomState(utt.fetch_seed())
+        floatX = theano.config.floatX
+        x = tensor.matrix('x')
+        w = tensor.matrix('w')
+        h0 = tensor.vector('h0')
+        n_steps, k = 64, 8
+        x_val = rng.uniform(size=(n_steps, 16)).astype(floatX)
+        w_val = rng.uniform(size=(16, 16)).astype(floatX) / 16
+        h0_val = rng.uniform(size=(16,)).astype(floatX)
+        row = h0_val.nbytes
+        # Keep the storage of the intermediate results after the call
+        mode = theano.compile.Mode(linker='vm_nogc')
+
+        stored = []
+        for checkpoint_every in [None, k]:
+            h, _ = theano.scan(
+                lambda x_t, h_tm1, w: tensor.tanh(tensor.dot(h_tm1, w) + x_t),
+                sequences=[x], outputs_info=[h0], non_sequences=[w],
+                checkpoint_every=checkpoint_every)
+            f = theano.function([x, w, h0], tensor.grad(h[-1].sum(), w),
+                                mode=mode)
+            f(x_val, w_val, h0_val)
+            grad_node, = [node for node in f.maker.fgraph.apply_nodes
+                          if isinstance(node.op, Scan) and
+                          node.op.name.startswith('grad_of')]
+            # The outputs of the forward scans the gradient reads the
+            # values of
+            states = set()
+            todo = list(grad_node.inputs)
+            while todo:
+                var = todo.pop()
+                if var.owner is None or isinstance(
+                        var.owner.op, (tensor.Shape, tensor.opt.Shape_i)):
+                    continue
+                if isinstance(var.owner.op, Scan):
+                    states.add(var)
+                else:
+                    todo.extend(var.owner.inputs)
+            stored.append(sum(f.fn.storage_map[var][0].nbytes
+                              for var in states) // row)
+            # The gradient recomputes the segments of k steps, so it only
+            # stores k more states at a time
+            for node in grad_node.op.fn.maker.fgraph.apply_nodes:
+                if (isinstance(node.op, Scan) and
+                        not node.op.name.startswith('grad_of')):
+                    assert tensor.get_scalar_constant_value(
+                        node.inputs[0]) == k
+
+        assert stored[0] == n_steps + 1
+        assert stored[1] == n_steps // k + 1
+
 
 class ScanGpuTests:
     """ This class defines a number of tests for Scan on GPU as well as a few
@@ -45,3 +45,5 @@ from theano.tensor.extra_ops import (DiffOp, bincount, squeeze,
 
 # SpecifyShape is defined in theano.compile, but should be available in tensor
 from theano.compile import SpecifyShape, specify_shape
+
+from theano.tensor.vectorize import vectorize
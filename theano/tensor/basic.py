@@ -3299,7 +3299,11 @@ def transpose(x, axes=None):
 def batched_dot(x, y):
     """
     This function computes the dot product between the two tensors, by
-    iterating over the first dimension using scan.
+    iterating over the first dimension.
+
+    When both tensors have 2 or 3 dimensions, the BatchedDot op is used
+    (which is replaced by a loop over BLAS gemm calls when possible, see
+    tensor.blas). Otherwise the products are computed by a scan.
 
     Parameters
     ----------
@@ -3326,6 +3330,9 @@ def batched_dot(x, y):
     >>> result = batched_dot(first, second)
 
     """
+    x, y = as_tensor_variable(x), as_tensor_variable(y)
+    if x.ndim in (2, 3) and y.ndim in (2, 3):
+        return _batched_dot(x, y)
     result, updates = theano.scan(
         fn=lambda x_mat, y_mat:
         theano.tensor.dot(x_mat, y_mat),
@@ -5269,6 +5276,120 @@ def dot(a, b):
         return _dot(a, b)
 
 
+class BatchedDot(Op):
+    """
+    Computes the dot products of the matrices or vectors stacked along the
+    first axis of two tensors: ``z[i] = dot(x[i], y[i])``.
+
+    Both inputs must have 2 or 3 dimensions, the first one being the batch
+    axis.
+
+    Notes
+    -----
+    This op is optimized to BatchedDot22, which calls BLAS gemm on each
+    element of the batch (see tensor.blas).
+
+    """
+    __props__ = ()
+
+    def make_node(self, *inputs):
+        inputs = list(map(as_tensor_variable, inputs))
+
+        if len(inputs) != 2:
+            raise TypeError(
+                'theano.tensor.BatchedDot: 2 arguments required, %d given ' %
+                len(inputs))
+        for i, input in enumerate(inputs):
+            if input.ndim not in (2, 3):
+                raise TypeError(
+                    'theano.tensor.BatchedDot: input %d (0-indexed) must have '
+                    'ndim of 2 or 3, %d given. Consider calling '
+                    'theano.tensor.batched_dot instead.' % (i, input.ndim))
+
+        bx, by = [input.type.broadcastable for input in inputs]
+        bz = (bx[0] and by[0],) + bx[1:-1] + by[2:]
+        i_dtypes = [input.type.dtype for input in inputs]
+        outputs = [tensor(scal.upcast(*i_dtypes), bz)]
+        return Apply(self, inputs, outputs)
+
+    def perform(self, node, inp, out):
+        x, y = inp
+        z, = out
+        if x.shape[0] != y.shape[0]:
+            raise ValueError(
+                'theano.tensor.BatchedDot: the batch sizes of the inputs '
+                'differ', x.shape, y.shape)
+        shape = x.shape[:1] + x.shape[1:-1] + y.shape[2:]
+        rval = numpy.empty(shape, dtype=node.outputs[0].dtype)
+        for i in xrange(x.shape[0]):
+            rval[i] = numpy.dot(x[i], y[i])
+        z[0] = rval
+
+    def grad(self, inp, grads):
+        x, y = inp
+        gz, = grads
+
+        # Work on 3d tensors: vectors become matrices with one row (x) or
+        # one column (y), and the matching axes of gz are added.
+        x3 = x if x.ndim == 3 else x.dimshuffle(0, 'x', 1)
+        y3 = y if y.ndim == 3 else y.dimshuffle(0, 1, 'x')
+        gz_order = [0]
+        for inp in (x, y):
+            if inp.ndim == 3:
+                gz_order.append(len([o for o in gz_order if o != 'x']))
+            else:
+                gz_order.append('x')
+        gz3 = gz.dimshuffle(*gz_order)
+
+        xgrad = self(gz3, y3.dimshuffle(0, 2, 1))
+        ygrad = self(x3.dimshuffle(0, 2, 1), gz3)
+        if x.ndim == 2:
+            xgrad = xgrad.dimshuffle(0, 2)
+        if y.ndim == 2:
+            ygrad = ygrad.dimshuffle(0, 1)
+
+        # See Dot.grad
+        if xgrad.broadcastable != x.broadcastable:
+            xgrad = patternbroadcast(xgrad, x.broadcastable)
+        if ygrad.broadcastable != y.broadcastable:
+            ygrad = patternbroadcast(ygrad, y.broadcastable)
+
+        rval = xgrad, ygrad
+
+        for elem in rval:
+            assert elem.dtype.find('float') != -1
+
+        return rval
+
+    def R_op(self, inputs, eval_points):
+        # Same as Dot.R_op, without the test value checks
+        assert len(inputs) == 2
+        assert len(eval_points) == 2
+        if eval_points[0] is None and eval_points[1] is None:
+            return [None]
+
+        if eval_points[0]:
+            t1 = self(eval_points[0], inputs[1])
+        if eval_points[1]:
+            t2 = self(inputs[0], eval_points[1])
+
+        if eval_points[0] and eval_points[1]:
+            return [t1 + t2]
+        elif eval_points[0]:
+            return [t1]
+        else:
+            return [t2]
+
+    def infer_shape(self, node, shapes):
+        xshp, yshp = shapes
+        return [xshp[:1] + xshp[1:-1] + yshp[2:]]
+
+    def __str__(self):
+        return "batched_dot"
+
+_batched_dot = BatchedDot()
+
+
 #########################
 # Linalg : TensorDot
 #########################
@@ -836,6 +836,10 @@ class GemmRelated(Op):
                 int Nz0 = Nz[0], Nz1 = Nz[1], Nx1 = Nx[1];
                 //std::cerr << (unit/256) MOD 16 << (unit / 16) MOD 16 << unit MOD 16<< '\\n';
                 //double t0 = time_time();
+                // The BLAS call only uses the data of the arrays, so the
+                // other threads can run meanwhile.
+                int bad_unit = 0;
+                Py_BEGIN_ALLOW_THREADS
                 switch(unit)
                 {
                     case 0x000: sgemm_(&N, &N, &Nz1, &Nz0, &Nx1, &a, y, &sy_0, x, &sx_0, &b, z, &sz_0); break;
@@ -846,8 +850,13 @@ class GemmRelated(Op):
                     case 0x101: sgemm_(&N, &T, &Nz0, &Nz1, &Nx1, &a, x, &sx_1, y, &sy_0, &b, z, &sz_1); break;
                     case 0x011: sgemm_(&T, &N, &Nz0, &Nz1, &Nx1, &a, x, &sx_0, y, &sy_1, &b, z, &sz_1); break;
                     case 0x111: sgemm_(&N, &N, &Nz0, &Nz1, &Nx1, &a, x, &sx_1, y, &sy_1, &b, z, &sz_1); break;
-                    default: PyErr_SetString(PyExc_ValueError, "some matrix has no unit stride"); %(fail)s;
+                    default: bad_unit = 1;
                 };
+                Py_END_ALLOW_THREADS
+                if (bad_unit)
+                {
+                    PyErr_SetString(PyExc_ValueError, "some matrix has no unit stride"); %(fail)s;
+                }
                 //fprintf(stderr, "Calling sgemm %%i %%i %%i %%i took %%f\\n", unit, Nz1, Nz0, Nx1, time_time() - t0);
         """
 
@@ -875,6 +884,8 @@ class GemmRelated(Op):
                 //sx_0, sx_1,
                 //sz_0, sz_1
                 //);
+                int bad_unit = 0;
+                Py_BEGIN_ALLOW_THREADS
                 switch(unit)
                 {
                     case 0x000: dgemm_(&N, &N, &Nz1, &Nz0, &Nx1, &a, y,
@@ -893,10 +904,15 @@ class GemmRelated(Op):
                                        &sx_0, y, &sy_1, &b, z, &sz_1); break;
                     case 0x111: dgemm_(&N, &N, &Nz0, &Nz1, &Nx1, &a, x,
                                        &sx_1, y, &sy_1, &b, z, &sz_1); break;
-                    default: PyErr_SetString(PyExc_ValueError,
-                                             "some matrix has no unit stride");
-                             %(fail)s;
+                    default: bad_unit = 1;
                 };
+                Py_END_ALLOW_THREADS
+                if (bad_unit)
+                {
+                    PyErr_SetString(PyExc_ValueError,
+                                    "some matrix has no unit stride");
+                    %(fail)s;
+                }
                 //fprintf(stderr, "Calling dgemm %%i %%i %%i %%i took %%f\\n",
                 //        unit, Nz1, Nz0, Nx1, time_time()- t0);
         """
@@ -929,7 +945,7 @@ class GemmRelated(Op):
             self.end_switch_typenum), '')
 
     def build_gemm_version(self):
-        return (13, blas_header_version())
+        return (14, blas_header_version())
 
 
 class Gemm(GemmRelated):
@@ -1783,6 +1799,235 @@ def local_dot_to_dot22(node):
                  x, y, x.type, y.type)
 
 
+class BatchedDot22(GemmRelated):
+    """Compute the matrix-matrix products of two stacks of matrices.
+
+    This is a specialization of the more general BatchedDot(). The C code
+    calls gemm on each element of the batch, using the strides of the
+    inputs when each matrix has a unit stride on one of its dimensions.
+
+    """
+
+    def make_node(self, x, y):
+        dtypes = ('float32', 'float64')
+        if x.type.ndim != 3 or x.type.dtype not in dtypes:
+            raise TypeError(x)
+        if y.type.ndim != 3 or y.type.dtype not in dtypes:
+            raise TypeError(y)
+        if y.type.dtype != x.type.dtype:
+            raise TypeError('dtype mismatch to BatchedDot22')
+        bz = (x.type.broadcastable[0] and y.type.broadcastable[0],
+              x.type.broadcastable[1], y.type.broadcastable[2])
+        outputs = [T.tensor(x.type.dtype, bz)]
+        return Apply(self, [x, y], outputs)
+
+    def perform(self, node, inp, out):
+        x, y = inp
+        z, = out
+        if x.shape[0] != y.shape[0]:
+            raise ValueError('BatchedDot22: the batch sizes of the inputs'
+                             ' differ', x.shape, y.shape)
+        rval = numpy.empty((x.shape[0], x.shape[1], y.shape[2]),
+                           dtype=x.dtype)
+        for i in xrange(x.shape[0]):
+            rval[i] = numpy.dot(x[i], y[i])
+        z[0] = rval
+
+    def infer_shape(self, node, shapes):
+        xshp, yshp = shapes
+        return [(xshp[0], xshp[1], yshp[2])]
+
+    def __str__(self):
+        return self.__class__.__name__
+
+    def c_support_code(self):
+        layout = """
+        /* Find how to pass to gemm the (rows x cols) C matrix with the
+         * given strides (in bytes): either as the Fortran matrix
+         * (cols x rows) (trans 'N'), or as the transpose of the Fortran
+         * matrix (rows x cols) (trans 'T'). Return 0 if the matrix has no
+         * unit stride and must be copied.
+         */
+        static int batched_dot_layout(npy_intp rows, npy_intp cols,
+                                      npy_intp srows, npy_intp scols,
+                                      int type_size, char* trans, int* ld)
+        {
+            if (((cols <= 1) || (scols == type_size))
+                && ((rows <= 1) || ((srows > 0) && !(srows MOD type_size)
+                                    && (srows / type_size >= cols))))
+            {
+                *trans = 'N';
+                *ld = (rows > 1) ? srows / type_size : ((cols > 1) ? cols : 1);
+                return 1;
+            }
+            if (((rows <= 1) || (srows == type_size))
+                && ((cols <= 1) || ((scols > 0) && !(scols MOD type_size)
+                                    && (scols / type_size >= rows))))
+            {
+                *trans = 'T';
+                *ld = (cols > 1) ? scols / type_size : ((rows > 1) ? rows : 1);
+                return 1;
+            }
+            return 0;
+        }
+        """
+        return super(BatchedDot22, self).c_support_code() + layout
+
+    def c_code(self, node, name, inp, out, sub):
+        x, y = inp
+        z, = out
+        fail = sub['fail']
+        dtype = node.inputs[0].type.dtype
+        if dtype not in ('float32', 'float64') or len(self.c_libraries()) <= 0:
+            raise utils.MethodNotDefined('%s.c_code'
+                                         % self.__class__.__name__)
+        ctype = {'float32': 'float', 'float64': 'double'}[dtype]
+        gemm = {'float32': 'sgemm_', 'float64': 'dgemm_'}[dtype]
+        return """
+        int type_size = PyArray_DESCR(%(x)s)->elsize;
+        npy_intp B, M, K, N;
+        PyArrayObject* x_copy = NULL;
+        PyArrayObject* y_copy = NULL;
+        char trans_x, trans_y;
+        int ld_x, ld_y;
+
+        if (PyArray_NDIM(%(x)s) != 3 || PyArray_NDIM(%(y)s) != 3)
+        {
+            PyErr_Format(PyExc_NotImplementedError,
+                         "BatchedDot22: rank(x) and rank(y) must be 3, got"
+                         " %%d and %%d.",
+                         PyArray_NDIM(%(x)s), PyArray_NDIM(%(y)s));
+            %(fail)s;
+        }
+        B = PyArray_DIMS(%(x)s)[0];
+        M = PyArray_DIMS(%(x)s)[1];
+        K = PyArray_DIMS(%(x)s)[2];
+        N = PyArray_DIMS(%(y)s)[2];
+        if (PyArray_DIMS(%(y)s)[0] != B || PyArray_DIMS(%(y)s)[1] != K)
+        {
+            PyErr_Format(PyExc_ValueError,
+                "Shape mismatch: x has shape (%%ld, %%ld, %%ld) but y has"
+                " shape (%%ld, %%ld, %%ld)",
+                (long int)B, (long int)M, (long int)K,
+                (long int)PyArray_DIMS(%(y)s)[0],
+                (long int)PyArray_DIMS(%(y)s)[1], (long int)N);
+            %(fail)s;
+        }
+
+        if ((NULL == %(z)s)
+            || (PyArray_DIMS(%(z)s)[0] != B)
+            || (PyArray_DIMS(%(z)s)[1] != M)
+            || (PyArray_DIMS(%(z)s)[2] != N)
+            || !PyArray_IS_C_CONTIGUOUS(%(z)s))
+        {
+            npy_intp dims[3] = {B, M, N};
+            Py_XDECREF(%(z)s);
+            %(z)s = (PyArrayObject*)PyArray_SimpleNew(3, dims,
+                                                      PyArray_TYPE(%(x)s));
+            if (!%(z)s)
+            {
+                PyErr_SetString(PyExc_MemoryError,
+                                "failed to alloc BatchedDot22 output");
+                %(fail)s;
+            }
+        }
+
+        if (B > 0 && M > 0 && N > 0 && K == 0)
+        {
+            memset(PyArray_DATA(%(z)s), 0, PyArray_NBYTES(%(z)s));
+        }
+        else if (B > 0 && M > 0 && N > 0)
+        {
+            if (!batched_dot_layout(M, K, PyArray_STRIDES(%(x)s)[1],
+                                    PyArray_STRIDES(%(x)s)[2], type_size,
+                                    &trans_x, &ld_x))
+            {
+                x_copy = PyArray_GETCONTIGUOUS(%(x)s);
+                if (!x_copy)
+                    %(fail)s;
+                batched_dot_layout(M, K, PyArray_STRIDES(x_copy)[1],
+                                   PyArray_STRIDES(x_copy)[2], type_size,
+                                   &trans_x, &ld_x);
+            }
+            if (!batched_dot_layout(K, N, PyArray_STRIDES(%(y)s)[1],
+                                    PyArray_STRIDES(%(y)s)[2], type_size,
+                                    &trans_y, &ld_y))
+            {
+                y_copy = PyArray_GETCONTIGUOUS(%(y)s);
+                if (!y_copy)
+                {
+                    Py_XDECREF(x_copy);
+                    %(fail)s;
+                }
+                batched_dot_layout(K, N, PyArray_STRIDES(y_copy)[1],
+                                   PyArray_STRIDES(y_copy)[2], type_size,
+                                   &trans_y, &ld_y);
+            }
+            {
+                PyArrayObject* xx = x_copy ? x_copy : %(x)s;
+                PyArrayObject* yy = y_copy ? y_copy : %(y)s;
+                char* x_data = PyArray_BYTES(xx);
+                char* y_data = PyArray_BYTES(yy);
+                char* z_data = PyArray_BYTES(%(z)s);
+                npy_intp x_step = PyArray_STRIDES(xx)[0];
+                npy_intp y_step = PyArray_STRIDES(yy)[0];
+                npy_intp z_step = PyArray_STRIDES(%(z)s)[0];
+                int iM = M, iN = N, iK = K, ld_z = N;
+                %(ctype)s one = 1.0;
+                %(ctype)s zero = 0.0;
+
+                /* z[b] = x[b] . y[b] is computed as the Fortran product
+                 * z[b].T = y[b].T . x[b].T */
+                Py_BEGIN_ALLOW_THREADS
+                for (npy_intp b = 0; b < B; ++b)
+                {
+                    %(gemm)s(&trans_y, &trans_x, &iN, &iM, &iK, &one,
+                             (%(ctype)s*)(y_data + b * y_step), &ld_y,
+                             (%(ctype)s*)(x_data + b * x_step), &ld_x,
+                             &zero, (%(ctype)s*)(z_data + b * z_step), &ld_z);
+                }
+                Py_END_ALLOW_THREADS
+            }
+            Py_XDECREF(x_copy);
+            Py_XDECREF(y_copy);
+        }
+        """ % locals()
+
+    def c_code_cache_version(self):
+        gv = self.build_gemm_version()
+        if gv:
+            return (1,) + gv
+        else:
+            return gv
+
+_batched_dot22 = BatchedDot22()
+
+
+@local_optimizer([T.BatchedDot])
+def local_batched_dot_to_batched_dot22(node):
+    if not isinstance(node.op, T.BatchedDot):
+        return
+
+    x, y = node.inputs
+    if (y.type.dtype != x.type.dtype or
+            y.type.dtype not in ['float32', 'float64']):
+        _logger.info('Not optimizing batched_dot with inputs %s %s %s %s',
+                     x, y, x.type, y.type)
+        return
+
+    x3 = x if x.ndim == 3 else x.dimshuffle(0, 'x', 1)
+    y3 = y if y.ndim == 3 else y.dimshuffle(0, 1, 'x')
+    z = _batched_dot22(x3, y3)
+    order = [0]
+    if x.ndim == 3:
+        order.append(1)
+    if y.ndim == 3:
+        order.append(2)
+    if len(order) == 3:
+        return [z]
+    return [z.dimshuffle(*order)]
+
+
 @local_optimizer([gemm_no_inplace], inplace=True)
 def local_inplace_gemm(node):
     if node.op == gemm_no_inplace:
@@ -1898,6 +2143,9 @@ optdb.register('BlasOpt', blas_optdb, 1.7, 'fast_run', 'fast_compile')
 blas_optdb.register('local_dot_to_dot22',
                     in2out(local_dot_to_dot22),
                     0, 'fast_run', 'fast_compile')
+blas_optdb.register('local_batched_dot_to_batched_dot22',
+                    in2out(local_batched_dot_to_batched_dot22),
+                    1, 'fast_run', 'fast_compile')
 blas_optdb.register('gemm_optimizer',
                     GemmOptimizer(),
                     10, 'fast_run')
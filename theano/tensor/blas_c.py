@@ -255,18 +255,22 @@ def ger_c_code(A, a, x, y, Z, destructive, fail):
                 {
                     //fprintf(stderr, "A\\n");
                     float alpha = ((dtype_%(a)s*)PyArray_DATA(%(a)s))[0];
+                    Py_BEGIN_ALLOW_THREADS
                     sger_(&Nz0, &Nz1, &alpha,
                         (float*)x_data, &Sx,
                         (float*)y_data, &Sy,
                         (float*)(PyArray_DATA(%(Z)s)), &Sz1);
+                    Py_END_ALLOW_THREADS
                 }
                 else if (PyArray_DESCR(%(Z)s)->type_num == NPY_DOUBLE)
                 {
                     double alpha = ((dtype_%(a)s*)PyArray_DATA(%(a)s))[0];
+                    Py_BEGIN_ALLOW_THREADS
                     dger_(&Nz0, &Nz1, &alpha,
                         (double*)x_data, &Sx,
                         (double*)y_data, &Sy,
                         (double*)(PyArray_DATA(%(Z)s)), &Sz1);
+                    Py_END_ALLOW_THREADS
 
 
                 }
@@ -281,18 +285,22 @@ def ger_c_code(A, a, x, y, Z, destructive, fail):
                 if (PyArray_DESCR(%(Z)s)->type_num == NPY_FLOAT)
                 {
                     float alpha = ((dtype_%(a)s*)(PyArray_DATA(%(a)s)))[0];
+                    Py_BEGIN_ALLOW_THREADS
                     sger_(&Nz1, &Nz0, &alpha,
                         (float*)y_data, &Sy,
                         (float*)x_data, &Sx,
                         (float*)(PyArray_DATA(%(Z)s)), &Sz0);
+                    Py_END_ALLOW_THREADS
                 }
                 else if (PyArray_DESCR(%(Z)s)->type_num == NPY_DOUBLE)
                 {
                     double alpha = ((dtype_%(a)s*)PyArray_DATA(%(a)s))[0];
+                    Py_BEGIN_ALLOW_THREADS
                     dger_(&Nz1, &Nz0, &alpha,
                         (double*)y_data, &Sy,
                         (double*)x_data, &Sx,
                         (double*)(PyArray_DATA(%(Z)s)), &Sz0);
+                    Py_END_ALLOW_THREADS
                 }
                 else
                 {
@@ -324,7 +332,7 @@ class CGer(BaseBLAS, Ger):
         return code
 
     def c_code_cache_version(self):
-        return (9, blas_header_version())
+        return (10, blas_header_version())
 cger_inplace = CGer(True)
 cger_no_inplace = CGer(False)
 
@@ -574,22 +582,26 @@ def gemv_c_code(aa, xx, yy, zz, alpha, beta, destructive, fail,
                 {
                     //fprintf(stderr, "A\\n");
                     float alpha = ((dtype_%(alpha)s*)PyArray_DATA(%(alpha)s))[0];
+                    Py_BEGIN_ALLOW_THREADS
                     sgemv_(&NOTRANS, &Nx0, &Nx1,
                         &alpha,
                         (float*)(PyArray_DATA(%(xx)s)), &Sx1,
                         (float*)yy_data, &Sy,
                         &fbeta,
                         (float*)zz_data, &Sz);
+                    Py_END_ALLOW_THREADS
                 }
                 else if (PyArray_DESCR(%(xx)s)->type_num == NPY_DOUBLE)
                 {
                     double alpha = ((dtype_%(alpha)s*)PyArray_DATA(%(alpha)s))[0];
+                    Py_BEGIN_ALLOW_THREADS
                     dgemv_(&NOTRANS, &Nx0, &Nx1,
                         &alpha,
                         (double*)(PyArray_DATA(%(xx)s)), &Sx1,
                         (double*)yy_data, &Sy,
                         &dbeta,
                         (double*)zz_data, &Sz);
+                    Py_END_ALLOW_THREADS
                 }
                 else
                 {
@@ -609,18 +621,22 @@ def gemv_c_code(aa, xx, yy, zz, alpha, beta, destructive, fail,
                     // so Sx1 == 1 is required for safety.
                     if (Nx0 == 1 && Sx1 == 1)
                     {
+                        Py_BEGIN_ALLOW_THREADS
                         zz_data[0] = fbeta*zz_data[0] + alpha*sdot_(&Nx1,
                             (float*)(PyArray_DATA(%(xx)s)), &Sx1,
                             (float*)yy_data, &Sy);
+                        Py_END_ALLOW_THREADS
                     }
                     else
                     {
+                        Py_BEGIN_ALLOW_THREADS
                         sgemv_(&TRANS, &Nx1, &Nx0,
                             &alpha,
                             (float*)(PyArray_DATA(%(xx)s)), &Sx0,
                             (float*)yy_data, &Sy,
                             &fbeta,
                             (float*)zz_data, &Sz);
+                        Py_END_ALLOW_THREADS
                     }
                 }
                 else if (PyArray_DESCR(%(xx)s)->type_num == NPY_DOUBLE)
@@ -632,18 +648,22 @@ def gemv_c_code(aa, xx, yy, zz, alpha, beta, destructive, fail,
                     // so Sx1 == 1 is required for safety.
                     if (Nx0 == 1 && Sx1 == 1)
                     {
+                        Py_BEGIN_ALLOW_THREADS
                         zz_data[0] = dbeta*zz_data[0] + alpha*ddot_(&Nx1,
                               (double*)(PyArray_DATA(%(xx)s)), &Sx1,
                               (double*)yy_data, &Sy);
+                        Py_END_ALLOW_THREADS
                     }
                     else
                     {
+                        Py_BEGIN_ALLOW_THREADS
                         dgemv_(&TRANS, &Nx1, &Nx0,
                             &alpha,
                             (double*)(PyArray_DATA(%(xx)s)), &Sx0,
                             (double*)yy_data, &Sy,
                             &dbeta,
                             (double*)zz_data, &Sz);
+                        Py_END_ALLOW_THREADS
                     }
                 }
                 else
@@ -695,7 +715,7 @@ class CGemv(BaseBLAS, Gemv):
         return code
 
     def c_code_cache_version(self):
-        return (11, blas_header_version())
+        return (12, blas_header_version())
 cgemv_inplace = CGemv(inplace=True)
 cgemv_no_inplace = CGemv(inplace=False)
 
@@ -1044,8 +1044,8 @@ class Elemwise(OpenMPOp):
             Py_XINCREF(%(oname)s);
             """ % locals()
             # We alias the scalar variables
-            defines += "#define %(oname)s_i %(iname)s_i" % locals()
-            undefs += "#undef %(oname)s_i" % locals()
+            defines += "#define %(oname)s_i %(iname)s_i\n" % locals()
+            undefs += "#undef %(oname)s_i\n" % locals()
 
         # Note: here, olv_index is either the index of the last output
         # which is allocated, OR, if there are any aliased outputs,
@@ -1209,7 +1209,7 @@ class Elemwise(OpenMPOp):
         return support_code
 
     def c_code_cache_version_apply(self, node):
-        version = [12]  # the version corresponding to the c code in this Op
+        version = [16]  # the version corresponding to the c code in this Op
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
@@ -1249,7 +1249,7 @@ class Elemwise(OpenMPOp):
 #   CAReduce   #
 ################
 
-class CAReduce(Op):
+class CAReduce(OpenMPOp):
     """
     CAReduce = Commutative Associative Reduce
     Reduces a scalar operation along the specified axis(es).
@@ -1268,6 +1268,11 @@ class CAReduce(Op):
         - The dimension along which we want to reduce
         - List of dimensions that we want to reduce
         - If None, all dimensions are reduced
+    openmp
+        If True, the C code shares the outer loop between threads. When
+        everything is reduced, each thread has its own accumulator, so
+        the order of the floating point operations depends on the number
+        of threads. Defaults to config.openmp.
 
     Examples
     --------
@@ -1291,7 +1296,7 @@ class CAReduce(Op):
 
     """
 
-    def __init__(self, scalar_op, axis=None):
+    def __init__(self, scalar_op, axis=None, openmp=None):
         if scalar_op.nin not in [-1, 2] or scalar_op.nout != 1:
             raise NotImplementedError((
                 "CAReduce only supports binary functions with a single "
@@ -1313,6 +1318,7 @@ class CAReduce(Op):
             self.axis = tuple(self.axis)
 
         self.set_ufunc(scalar_op)
+        OpenMPOp.__init__(self, openmp=openmp)
 
     def set_ufunc(self, scalar_op):
         # This is probably a speed up of the implementation
@@ -1378,7 +1384,7 @@ class CAReduce(Op):
         return d
 
     def __setstate__(self, d):
-        self.__dict__.update(d)
+        super(CAReduce, self).__setstate__(d)
         self.set_ufunc(self.scalar_op)
 
     def __eq__(self, other):
@@ -1605,6 +1611,23 @@ for(int i=0;i<PyArray_NDIM(%(iname)s);i++){
             ["%s_i" % aname, "%s_i" % inames[0]],
             ["%s_i" % aname],
             sub)
+        pairwise = (getattr(self, 'pairwise', False) and
+                    node.inputs[0].type.ndim > 0)
+        if pairwise:
+            pw_init, task1_code, pw_finish = cgen.make_pairwise_sum(
+                aname, "%s_i" % inames[0], adtype, identity)
+            task0_decl += pw_init
+        # Used by the threads to add their partial result, when
+        # everything is reduced in parallel.
+        combine = self.scalar_op.c_code(
+            Apply(self.scalar_op,
+                  [get_scalar_type(dtype=output.type.dtype).make_variable()
+                   for _ in xrange(2)],
+                  [get_scalar_type(dtype=output.type.dtype).make_variable()]),
+            None,
+            ["%s_i" % aname, "%s_thread" % aname],
+            ["%s_i" % aname],
+            sub)
         code1 = """
         {
             %(task1_decl)s
@@ -1622,9 +1645,16 @@ for(int i=0;i<PyArray_NDIM(%(iname)s);i++){
                             [("", code1), ""])
         else:
             all_code = [task0_decl + code1]
+        if pairwise:
+            # Add the partial sums once the reduction loops are done
+            if nnested:
+                all_code[nnested - 1] = ("", pw_finish)
+            else:
+                all_code[-1] = pw_finish
         loop = cgen.make_loop_careduce(
             [order, list(range(nnested)) + ['x'] * len(axis)],
-            [idtype, adtype], all_code, sub)
+            [idtype, adtype], all_code, sub,
+            openmp=self.openmp, combine=combine)
 
         end = ""
         if adtype != odtype:
@@ -1641,10 +1671,10 @@ for(int i=0;i<PyArray_NDIM(%(iname)s);i++){
 
     def c_headers(self):
         # Sometimes, Elemwise's c_code is returned, so we need its headers
-        return ['<vector>', '<algorithm>']
+        return ['<vector>', '<algorithm>'] + OpenMPOp.c_headers(self)
 
     def c_code_cache_version_apply(self, node):
-        version = (6,)  # the version corresponding to the c code in this Op
+        version = [9]  # the version corresponding to the c code in this Op
 
         # now we insert versions for the ops on which we depend...
         scalar_node = Apply(
@@ -1656,6 +1686,7 @@ for(int i=0;i<PyArray_NDIM(%(iname)s);i++){
         version.append(self.scalar_op.c_code_cache_version_apply(scalar_node))
         for i in node.inputs + node.outputs:
             version.append(get_scalar_type(dtype=i.type.dtype).c_code_cache_version())
+        version.append(('openmp', self.openmp))
         if all(version):
             return tuple(version)
         else:
@@ -1928,14 +1959,43 @@ class Sum(CAReduceDtype):
         or the input dtype if its precision is higher:
         - for int dtypes, we use at least int64;
         - for uint dtypes, we use at least uint64;
-        - for float dtypes, we use at least float64;
-        - for complex dtypes, we use at least complex128.
+        - for float dtypes, we use at least float64 (float32 if pairwise);
+        - for complex dtypes, we use at least complex128 (complex64 if
+        pairwise).
+
+    pairwise
+        If True, the C code adds the values by blocks, then adds the
+        blocks pairwise, so the rounding error grows with the logarithm
+        of the number of values instead of linearly. If None (default),
+        we use config.tensor.pairwise_sum.
 
     """
 
-    def __init__(self, axis=None, dtype=None, acc_dtype=None):
+    def __init__(self, axis=None, dtype=None, acc_dtype=None, pairwise=None):
         CAReduceDtype.__init__(self, scalar.add, axis=axis,
                                dtype=dtype, acc_dtype=acc_dtype)
+        if pairwise is None:
+            pairwise = config.tensor.pairwise_sum
+        self.pairwise = pairwise
+
+    def __eq__(self, other):
+        return (CAReduceDtype.__eq__(self, other) and
+                self.pairwise == other.pairwise)
+
+    def __hash__(self):
+        return CAReduceDtype.__hash__(self) ^ hash(self.pairwise)
+
+    def __setstate__(self, d):
+        super(Sum, self).__setstate__(d)
+        if not hasattr(self, "pairwise"):
+            self.pairwise = False
+
+    def _acc_dtype(self, idtype):
+        if (self.pairwise and self.acc_dtype is None and
+                idtype in ['float32', 'complex64']):
+            # The pairwise summation is precise enough without upcast
+            return idtype
+        return CAReduceDtype._acc_dtype(self, idtype)
 
     def grad(self, inp, grads):
         x, = inp
@@ -2175,3 +2235,333 @@ class ProdWithoutZeros(CAReduceDtype):
             "If `a` is guarenteed to contains no zeros, use "
             "`product(a, no_zeros_in_input=True)`.")
         return [a_grad]
+
+
+######################
+#   ElemwiseReduce   #
+######################
+
+class ElemwiseReduce(OpenMPOp):
+    """
+    Reduce the result of an elementwise operation without storing it.
+
+    ElemwiseReduce(careduce, scalar_op)(*inputs) computes the same thing
+    as careduce(Elemwise(scalar_op)(*inputs)), but its C code evaluates
+    scalar_op inside the reduction loop. The intermediate tensor is never
+    allocated and the inputs are read only once, which is what makes
+    sum(x ** 2), max(abs(x)) or sum(exp(x - m)) memory bound on x alone.
+    It is introduced by the local_elemwise_careduce_fusion optimization.
+
+    Parameters
+    ----------
+    careduce
+        The CAReduce instance applied to the elementwise result.
+    scalar_op
+        A scalar op with a single output (usually a Composite).
+    openmp
+        If True, the C code shares the outer loop between threads, as for
+        CAReduce. Defaults to the value of careduce.
+
+    """
+
+    def __init__(self, careduce, scalar_op, openmp=None):
+        if scalar_op.nout != 1:
+            raise NotImplementedError(
+                "ElemwiseReduce only supports scalar ops with a single "
+                "output.")
+        self.careduce = careduce
+        self.scalar_op = scalar_op
+        self.elemwise = Elemwise(scalar_op)
+        if openmp is None:
+            openmp = careduce.openmp
+        OpenMPOp.__init__(self, openmp=openmp)
+
+    def __eq__(self, other):
+        return (type(self) == type(other) and
+                self.careduce == other.careduce and
+                self.scalar_op == other.scalar_op)
+
+    def __hash__(self):
+        return hash(type(self)) ^ hash(self.careduce) ^ hash(self.scalar_op)
+
+    def __str__(self):
+        return "%s{%s}" % (self.careduce, self.scalar_op)
+
+    def _inner_nodes(self, inputs):
+        elem_node = self.elemwise.make_node(*inputs)
+        red_node = self.careduce.make_node(elem_node.outputs[0])
+        if red_node.inputs[0] is not elem_node.outputs[0]:
+            raise TypeError(
+                "%s can not be applied directly on the output of %s" %
+                (self.careduce, self.elemwise))
+        return elem_node, red_node
+
+    def make_node(self, *inputs):
+        inputs = list(map(as_tensor_variable, inputs))
+        elem_node, red_node = self._inner_nodes(inputs)
+        # Elemwise.make_node may have added broadcastable dimensions
+        return Apply(self, elem_node.inputs,
+                     [red_node.outputs[0].type()])
+
+    def perform(self, node, inputs, output_storage):
+        elem_node, red_node = self._inner_nodes(node.inputs)
+        elem_storage = [[None]]
+        self.elemwise.perform(elem_node, inputs, elem_storage)
+        red_node.op.perform(red_node, [elem_storage[0][0]], output_storage)
+
+    def infer_shape(self, node, shapes):
+        elem_node, red_node = self._inner_nodes(node.inputs)
+        elem_shapes = self.elemwise.infer_shape(elem_node, shapes)
+        return red_node.op.infer_shape(red_node, elem_shapes)
+
+    def _c_all(self, node, name, inames, onames, sub):
+        elem_node, red_node = self._inner_nodes(node.inputs)
+        careduce = red_node.op
+        inter = elem_node.outputs[0]
+        output = node.outputs[0]
+        oname, = onames
+
+        idtypes = [input.type.dtype_specs()[1] for input in node.inputs]
+        edtype = inter.type.dtype_specs()[1]
+        odtype = output.type.dtype_specs()[1]
+
+        if getattr(careduce, 'acc_dtype', None) is not None:
+            if careduce.acc_dtype == 'float16':
+                raise theano.gof.utils.MethodNotDefined("no c_code for float16")
+            acc_type = TensorType(broadcastable=output.broadcastable,
+                                  dtype=careduce.acc_dtype)
+            adtype = acc_type.dtype_specs()[1]
+        else:
+            adtype = odtype
+
+        axis = careduce.axis
+        if axis is None:
+            axis = list(range(inter.type.ndim))
+        if inter.type.ndim == 0 or len(axis) == 0:
+            # Nothing is reduced: there is no loop to share.
+            raise theano.gof.utils.MethodNotDefined(
+                "ElemwiseReduce needs at least one reduced dimension")
+
+        order1 = [i for i in xrange(inter.type.ndim) if i not in axis]
+        order = order1 + list(axis)
+        nnested = len(order1)
+        # Broadcasted dimensions of the inputs are not looped over
+        orders = [[(input.type.broadcastable[i] and 'x') or i
+                   for i in order]
+                  for input in node.inputs]
+        out_order = list(range(nnested)) + ['x'] * len(axis)
+
+        sub = dict(sub)
+        for i, iname in enumerate(inames):
+            sub['lv%i' % i] = iname
+        i = len(inames)
+
+        decl = ""
+        if adtype != odtype:
+            # Create an accumulator variable different from the output
+            aname = "acc"
+            decl = acc_type.c_declare(aname, sub)
+            decl += acc_type.c_init(aname, sub)
+        else:
+            # the output is the accumulator variable
+            aname = oname
+
+        decl += cgen.make_declare(orders, idtypes, sub)
+        checks = cgen.make_checks(orders, idtypes, sub)
+
+        alloc = ""
+        sub['lv%i' % i] = oname
+        sub['olv'] = oname
+
+        # Allocate output buffer
+        alloc += cgen.make_declare([out_order], [odtype],
+                                   dict(sub, lv0=oname))
+        alloc += cgen.make_alloc([o[:nnested] for o in orders], odtype, sub)
+        alloc += cgen.make_checks([out_order], [odtype],
+                                  dict(sub, lv0=oname))
+
+        if adtype != odtype:
+            # Allocate accumulation buffer
+            sub['lv%i' % i] = aname
+            sub['olv'] = aname
+
+            alloc += cgen.make_declare([out_order], [adtype],
+                                       dict(sub, lv0=aname))
+            alloc += cgen.make_alloc([o[:nnested] for o in orders],
+                                     adtype, sub)
+            alloc += cgen.make_checks([out_order], [adtype],
+                                      dict(sub, lv0=aname))
+
+        reduce_op = careduce.scalar_op
+        if hasattr(reduce_op, 'identity'):
+            identity = reduce_op.identity
+        elif reduce_op in [scalar.maximum, scalar.minimum]:
+            if reduce_op == scalar.maximum:
+                scal_name = 'maximum'
+                if inter.type.dtype in ["float32", "float64"]:
+                    identity = "-__builtin_inf()"
+                elif inter.type.dtype.startswith("uint"):
+                    identity = "0"
+                else:
+                    identity = "NPY_MIN_" + str(inter.type.dtype).upper()
+            else:
+                scal_name = 'minimum'
+                if inter.type.dtype in ["float32", "float64"]:
+                    identity = "__builtin_inf()"
+                else:
+                    identity = "NPY_MAX_" + str(inter.type.dtype).upper()
+            fail = sub["fail"]
+            for d in axis:
+                # The size of a reduced dimension is given by any input
+                # that is not broadcasted on it.
+                for iname, input in izip(inames, node.inputs):
+                    if not input.type.broadcastable[d]:
+                        alloc += """
+if (PyArray_DIMS(%(iname)s)[%(d)s] == 0) {
+    PyErr_Format(PyExc_ValueError,
+         "Input of ElemwiseReduce{%(scal_name)s} has zero-size on axis %%d",
+         %(d)s);
+    %(fail)s;
+}
+                        """ % locals()
+                        break
+        else:
+            raise TypeError(
+                "The CAReduce.scalar_op must have an identity field.")
+
+        task0_decl = ("%(dtype)s& %(name)s_i = *%(name)s_iter;\n"
+                      "%(name)s_i = %(identity)s;"
+                      % dict(dtype=adtype, name=aname, identity=identity))
+
+        task1_decl = "".join("%(dtype)s& %(name)s_i = *%(name)s_iter;\n"
+                             % dict(dtype=idtype, name=iname)
+                             for idtype, iname in izip(idtypes, inames))
+        task1_decl += "%s %s_e;\n" % (edtype, aname)
+
+        elem_code = self.scalar_op.c_code(
+            Apply(self.scalar_op,
+                  [get_scalar_type(dtype=input.type.dtype).make_variable()
+                   for input in node.inputs],
+                  [get_scalar_type(dtype=inter.type.dtype).make_variable()]),
+            name + '_scalar_',
+            ["%s_i" % iname for iname in inames],
+            ["%s_e" % aname],
+            sub)
+        reduce_code = reduce_op.c_code(
+            Apply(reduce_op,
+                  [get_scalar_type(dtype=inter.type.dtype).make_variable()
+                   for _ in xrange(2)],
+                  [get_scalar_type(dtype=output.type.dtype).make_variable()]),
+            None,
+            ["%s_i" % aname, "%s_e" % aname],
+            ["%s_i" % aname],
+            sub)
+        pairwise = getattr(careduce, 'pairwise', False)
+        if pairwise:
+            pw_init, reduce_code, pw_finish = cgen.make_pairwise_sum(
+                aname, "%s_e" % aname, adtype, identity)
+            task0_decl += pw_init
+        combine = reduce_op.c_code(
+            Apply(reduce_op,
+                  [get_scalar_type(dtype=output.type.dtype).make_variable()
+                   for _ in xrange(2)],
+                  [get_scalar_type(dtype=output.type.dtype).make_variable()]),
+            None,
+            ["%s_i" % aname, "%s_thread" % aname],
+            ["%s_i" % aname],
+            sub)
+        code1 = """
+        {
+            %(task1_decl)s
+            %(elem_code)s
+            %(reduce_code)s
+        }
+        """ % locals()
+
+        if len(axis) == 1:
+            all_code = [("", "")] * nnested + [(task0_decl, code1), ""]
+        else:
+            all_code = ([("", "")] * nnested +
+                        [(task0_decl, "")] +
+                        [("", "")] * (len(axis) - 2) +
+                        [("", code1), ""])
+        if pairwise:
+            # Add the partial sums once the reduction loops are done
+            if nnested:
+                all_code[nnested - 1] = ("", pw_finish)
+            else:
+                all_code[-1] = pw_finish
+        loop = cgen.make_loop_careduce(
+            orders + [out_order], idtypes + [adtype], all_code, sub,
+            openmp=self.openmp, combine=combine)
+
+        end = ""
+        if adtype != odtype:
+            end = """
+            PyArray_CopyInto(%(oname)s, %(aname)s);
+            """ % dict(oname=oname, aname=aname)
+            end += acc_type.c_cleanup(aname, sub)
+
+        return decl, checks, alloc, loop, end
+
+    def c_code(self, node, name, inames, onames, sub):
+        if (any(i.dtype == 'float16' for i in node.inputs) or
+                any(o.dtype == 'float16' for o in node.outputs) or
+                getattr(self.scalar_op, 'inner_float16', False)):
+            # Disable C code for float16 vars
+            super(ElemwiseReduce, self).c_code(node, name, inames, onames,
+                                               sub)
+        code = "\n".join(self._c_all(node, name, inames, onames, sub))
+        return code
+
+    def c_headers(self):
+        return ['<vector>', '<algorithm>'] + OpenMPOp.c_headers(self)
+
+    def c_compile_args(self):
+        # Don't let the compiler contract scalar_op and the accumulation
+        # into a fused multiply-add: the result would no longer be the
+        # one of the unfused Elemwise and CAReduce.
+        return ['-ffp-contract=off'] + OpenMPOp.c_compile_args(self)
+
+    def c_support_code(self):
+        rval = []
+        for s_op in (self.scalar_op, self.careduce.scalar_op):
+            try:
+                rval.append(s_op.c_support_code().strip())
+            except gof.utils.MethodNotDefined:
+                pass
+        # remove duplicate code blocks
+        return "\n".join(sorted(set(rval)))
+
+    def c_support_code_apply(self, node, nodename):
+        return self.scalar_op.c_support_code_apply(node,
+                                                   nodename + '_scalar_')
+
+    def c_code_cache_version_apply(self, node):
+        version = [5]  # the version corresponding to the c code in this Op
+
+        # now we insert versions for the ops on which we depend...
+        elem_node, red_node = self._inner_nodes(node.inputs)
+        inter = elem_node.outputs[0]
+        scalar_node = Apply(
+            self.scalar_op,
+            [get_scalar_type(dtype=input.type.dtype).make_variable()
+             for input in node.inputs],
+            [get_scalar_type(dtype=inter.type.dtype).make_variable()])
+        version.append(self.scalar_op.c_code_cache_version_apply(
+            scalar_node))
+        reduce_op = red_node.op.scalar_op
+        reduce_node = Apply(
+            reduce_op,
+            [get_scalar_type(dtype=inter.type.dtype).make_variable()
+             for _ in xrange(2)],
+            [get_scalar_type(dtype=node.outputs[0].type.dtype).make_variable()])
+        version.append(reduce_op.c_code_cache_version_apply(reduce_node))
+        for i in node.inputs + [inter] + node.outputs:
+            version.append(
+                get_scalar_type(dtype=i.type.dtype).c_code_cache_version())
+        version.append(('openmp', self.openmp))
+        if all(version):
+            return tuple(version)
+        else:
+            return ()
@@ -177,6 +177,30 @@ def make_alloc(loop_orders, dtype, sub, fortran='0'):
     """ % dict(locals(), **sub)
 
 
+def loop_size(indices, sub):
+    """
+    Return a C expression for the number of iterations of a loop.
+
+    indices holds the entry of each variable's loop order for that loop.
+
+    """
+    suitable_n = "1"
+    for j, index in enumerate(indices):
+        if index != 'x':
+            suitable_n = "%s_n%s" % (sub['lv%i' % j], index)
+    return suitable_n
+
+
+def total_size(loop_orders, sub):
+    """
+    Return a C expression for the number of iterations of the inner-most
+    loop, over all the nested loops.
+
+    """
+    return ' * '.join("(npy_intp)%s" % loop_size(indices, sub)
+                      for indices in zip(*loop_orders)) or "1"
+
+
 def make_loop(loop_orders, dtypes, loop_tasks, sub, openmp=None):
     """
     Make a nested loop over several arrays and associate specific code
@@ -205,16 +229,17 @@ def make_loop(loop_orders, dtypes, loop_tasks, sub, openmp=None):
     def loop_over(preloop, code, indices, i):
         iterv = 'ITER_%i' % i
         update = ""
-        suitable_n = "1"
+        suitable_n = loop_size(indices, sub)
         for j, index in enumerate(indices):
             var = sub['lv%i' % j]
             dtype = dtypes[j]
             update += "%(dtype)s &%(var)s_i = * ( %(var)s_iter + %(iterv)s * %(var)s_jump%(index)s_%(i)s );\n" % locals()
-            if index != 'x':
-                suitable_n = "%(var)s_n%(index)s" % locals()
-        if openmp:
+        # Only the outer loop is parallel, if there is enough work in
+        # all the loops together.
+        if openmp and i == 0:
+            total = total_size(loop_orders, sub)
             openmp_elemwise_minsize = theano.config.openmp_elemwise_minsize
-            forloop = """#pragma omp parallel for if( %(suitable_n)s >=%(openmp_elemwise_minsize)s)\n""" % locals()
+            forloop = """#pragma omp parallel for if( %(total)s >=%(openmp_elemwise_minsize)s)\n""" % locals()
         else:
             forloop = ""
         forloop += """for (int %(iterv)s = 0; %(iterv)s<%(suitable_n)s; %(iterv)s++)""" % locals()
@@ -406,8 +431,12 @@ def make_reordered_loop(init_loop_orders, olv_index, dtypes, inner_task, sub,
             update = pointer_update
         if i == 0:
             if openmp:
+                # Parallelize the outer loop if there is enough work in
+                # all the loops together, not only in the outer one.
+                all_totals = ' * '.join('(npy_intp)TOTAL_%i' % j
+                                        for j in xrange(nnested))
                 openmp_elemwise_minsize = theano.config.openmp_elemwise_minsize
-                forloop += """#pragma omp parallel for if( %(total)s >=%(openmp_elemwise_minsize)s)\n""" % locals()
+                forloop += """#pragma omp parallel for if( %(all_totals)s >=%(openmp_elemwise_minsize)s)\n""" % locals()
         forloop += "for(int %(iterv)s = 0; %(iterv)s<%(total)s; %(iterv)s++)" % locals()
 
         loop = """
@@ -463,7 +492,71 @@ def make_reordered_loop(init_loop_orders, olv_index, dtypes, inner_task, sub,
 ################
 
 
-def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
+def make_pairwise_sum(acc, x, dtype, identity, block_size=128):
+    """
+    Return the code of a blocked pairwise sum of x into `<acc>_i`.
+
+    The values are first added into a block sum. Every `block_size`
+    values, the block sum is pushed on a stack of partial sums, where
+    two partial sums of the same number of blocks are added together,
+    as in a binary counter. The rounding error then grows with the
+    logarithm of the number of values instead of linearly.
+
+    Parameters
+    ----------
+    acc : str
+        Name of the accumulator variable.
+    x : str
+        C expression of the value to add.
+    dtype : str
+        C type of the accumulator.
+    identity
+        The value of an empty sum.
+    block_size : int
+        Number of values added naively in a block.
+
+    Returns
+    -------
+    tuple of str
+        The code to declare the state before the reduction loops, the code
+        to add x, and the code that adds the state into `<acc>_i` after
+        the reduction loops.
+
+    """
+    init = """
+    %(dtype)s %(acc)s_block = %(identity)s;
+    int %(acc)s_block_n = 0;
+    %(dtype)s %(acc)s_partial[64];
+    int %(acc)s_nlevel = 0;
+    npy_intp %(acc)s_nblock = 0;
+    """ % locals()
+    add = """
+    %(acc)s_block = %(acc)s_block + %(x)s;
+    if (++%(acc)s_block_n == %(block_size)s) {
+        %(acc)s_partial[%(acc)s_nlevel++] = %(acc)s_block;
+        ++%(acc)s_nblock;
+        for (npy_intp k = %(acc)s_nblock; !(k & 1); k >>= 1) {
+            --%(acc)s_nlevel;
+            %(acc)s_partial[%(acc)s_nlevel - 1] = (
+                %(acc)s_partial[%(acc)s_nlevel - 1] +
+                %(acc)s_partial[%(acc)s_nlevel]);
+        }
+        %(acc)s_block = %(identity)s;
+        %(acc)s_block_n = 0;
+    }
+    """ % locals()
+    finish = """
+    while (%(acc)s_nlevel > 0) {
+        --%(acc)s_nlevel;
+        %(acc)s_block = %(acc)s_block + %(acc)s_partial[%(acc)s_nlevel];
+    }
+    %(acc)s_i = %(acc)s_i + %(acc)s_block;
+    """ % locals()
+    return init, add, finish
+
+
+def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub, openmp=None,
+                       combine=None):
     """
     Make a nested loop over several arrays and associate specific code
     to each level of nesting.
@@ -486,18 +579,28 @@ def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
     sub: dictionary
         Maps 'lv#' to a suitable variable name.
         The 'lvi' variable corresponds to the ith element of loop_orders.
+    openmp : bool
+        If True, the outer loop is shared between threads when the total
+        number of iterations is at least config.openmp_elemwise_minsize.
+        The last variable of loop_orders is the accumulator. If it isn't
+        broadcasted in the outer loop, each iteration writes to its own
+        elements. Otherwise each thread reduces into a private
+        `<acc>_thread` scalar, then `combine` is run for each thread in
+        order, after the parallel loop.
+    combine : str
+        Code that reduces `<acc>_thread` into `<acc>_i`. Without it, a
+        reduction over the outer loop isn't parallelized. In that case, the
+        last loop task is run by each thread, before `combine`.
 
     """
 
     def loop_over(preloop, code, indices, i):
         iterv = 'ITER_%i' % i
         update = ""
-        suitable_n = "1"
+        suitable_n = loop_size(indices, sub)
         for j, index in enumerate(indices):
             var = sub['lv%i' % j]
             update += "%(var)s_iter += %(var)s_jump%(index)s_%(i)s;\n" % locals()
-            if index != 'x':
-                suitable_n = "%(var)s_n%(index)s" % locals()
         return """
         %(preloop)s
         for (int %(iterv)s = %(suitable_n)s; %(iterv)s; %(iterv)s--) {
@@ -506,6 +609,79 @@ def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
         }
         """ % locals()
 
+    def parallel_loop_over(preloop, pre_task, code, indices, end):
+        # Each thread has its own pointers. They are set from the
+        # iteration index, instead of being moved from one iteration to
+        # the next.
+        suitable_n = loop_size(indices, sub)
+        total = total_size(loop_orders, sub)
+        openmp_elemwise_minsize = theano.config.openmp_elemwise_minsize
+        acc = sub['lv%i' % (len(loop_orders) - 1)]
+        acc_dtype = dtypes[-1]
+        private = ""
+        reset = ""
+        for j, (index, dtype) in enumerate(zip(indices, dtypes)):
+            var = sub['lv%i' % j]
+            if var == acc and private_acc:
+                private += ("%(dtype)s %(var)s_thread;\n"
+                            "%(dtype)s* %(var)s_iter = &%(var)s_thread;\n"
+                            % locals())
+            else:
+                private += ("%(dtype)s* %(var)s_iter = (%(dtype)s*)(PyArray_DATA(%(var)s));\n"
+                            % locals())
+            if index != 'x':
+                reset += ("%(var)s_iter = (%(dtype)s*)(PyArray_DATA(%(var)s)) + ITER_0 * %(var)s_stride%(index)s;\n"
+                          % locals())
+        shared_init = ""
+        finish = ""
+        combine_all = ""
+        if private_acc:
+            # The shared accumulator starts at the identity too
+            shared_init = """
+            {
+                %(pre_task)s
+            }
+            %(acc_dtype)s* %(acc)s_iter_shared = %(acc)s_iter;
+            std::vector<%(acc_dtype)s> %(acc)s_partials(omp_get_max_threads());
+            int %(acc)s_nb_threads = 1;
+            """ % locals()
+            finish = """
+            %(end)s
+            %(acc)s_partials[omp_get_thread_num()] = %(acc)s_thread;
+            #pragma omp master
+            %(acc)s_nb_threads = omp_get_num_threads();
+            """ % locals()
+            # The partial results are combined in the order of the threads,
+            # which each reduced a contiguous block of the outer loop, so
+            # the result doesn't depend on which thread finishes first.
+            combine_all = """
+            for (int THREAD = 0; THREAD < %(acc)s_nb_threads; THREAD++) {
+                %(acc_dtype)s& %(acc)s_i = *%(acc)s_iter_shared;
+                %(acc_dtype)s %(acc)s_thread = %(acc)s_partials[THREAD];
+                %(combine)s
+            }
+            """ % dict(acc=acc, acc_dtype=acc_dtype, combine=combine)
+        return """
+        %(preloop)s
+        %(shared_init)s
+        #pragma omp parallel if( %(total)s >=%(openmp_elemwise_minsize)s)
+        {
+            %(private)s
+            %(pre_task)s
+            #pragma omp for schedule(static)
+            for (npy_intp ITER_0 = 0; ITER_0 < %(suitable_n)s; ITER_0++) {
+                %(reset)s
+                %(code)s
+            }
+            %(finish)s
+        }
+        %(combine_all)s
+        """ % locals()
+
+    private_acc = bool(loop_orders[-1]) and loop_orders[-1][0] == 'x'
+    if private_acc and combine is None:
+        openmp = False
+
     preloops = {}
     for i, (loop_order, dtype) in enumerate(zip(loop_orders, dtypes)):
         for j, index in enumerate(loop_order):
@@ -522,7 +698,13 @@ def make_loop_careduce(loop_orders, dtypes, loop_tasks, sub):
     else:
         s = ""
         for i, (pre_task, task), indices in reversed(list(zip(xrange(len(loop_tasks) - 1), loop_tasks, list(zip(*loop_orders))))):
-            s = loop_over(preloops.get(i, "") + pre_task, s + task, indices, i)
+            if i == 0 and openmp:
+                s = parallel_loop_over(preloops.get(i, ""), pre_task,
+                                       s + task, indices, loop_tasks[-1])
+            else:
+                s = loop_over(preloops.get(i, "") + pre_task, s + task,
+                              indices, i)
 
-    s += loop_tasks[-1]
+    if not (openmp and private_acc):
+        s += loop_tasks[-1]
     return "{%s}" % s
@@ -27,7 +27,8 @@ from theano.gof import Variable, Constant
 from theano.gof.utils import MethodNotDefined
 from theano.gradient import DisconnectedType
 from theano.configparser import config
-from theano.tensor.elemwise import Elemwise, DimShuffle
+from theano.tensor.elemwise import (Elemwise, DimShuffle, CAReduce,
+                                    ElemwiseReduce)
 from theano.tensor.subtensor import (get_idx_list, get_canonical_form_slice,
                                      Subtensor, IncSubtensor, make_constant,
                                      AdvancedIncSubtensor1,
@@ -6115,6 +6116,58 @@ class FusionOptimizer(Optimizer):
         print(blanc, " time_toposort", prof[7], file=stream)
 
 
+@gof.local_optimizer([CAReduce])
+def local_elemwise_careduce_fusion(node):
+    """CAReduce(Elemwise(scalar_op)(*inputs)) -> ElemwiseReduce(*inputs)
+
+    The elementwise result is computed inside the reduction loop instead
+    of being written to memory and read back. This runs after the
+    elemwise fusion, so scalar_op is usually a whole Composite: for
+    example sum(exp(x - m)) only reads x and m once.
+
+    """
+    if type(node.op) not in (CAReduce, T.elemwise.Sum, T.elemwise.Prod):
+        return False
+    if not isinstance(node.outputs[0].type, T.TensorType):
+        return False
+    reduce_op = node.op.scalar_op
+    if (not hasattr(reduce_op, 'identity') and
+            reduce_op not in [scalar.maximum, scalar.minimum]):
+        return False
+    inp = node.inputs[0]
+    if (not inp.owner or type(inp.owner.op) is not Elemwise or
+            inp.owner.op.inplace_pattern or
+            len(inp.owner.outputs) != 1 or
+            # The intermediate result is needed elsewhere
+            len(inp.clients) != 1 or
+            inp.ndim == 0 or
+            (node.op.axis is not None and len(node.op.axis) == 0)):
+        return False
+    e_node = inp.owner
+    if any(v.dtype == 'float16' for v in e_node.inputs + node.outputs):
+        return False
+    try:
+        s_inputs = [scalar.get_scalar_type(i.dtype).make_variable()
+                    for i in e_node.inputs]
+        s_out = e_node.op.scalar_op(*s_inputs, return_list=True)
+        e_node.op.scalar_op.c_code(s_out[0].owner,
+                                   "test_presence_of_c_code",
+                                   ["x" for x in e_node.inputs],
+                                   ["z" for z in e_node.outputs],
+                                   {})
+    except (MethodNotDefined, NotImplementedError):
+        return False
+    try:
+        new_out = ElemwiseReduce(node.op, e_node.op.scalar_op)(
+            *e_node.inputs)
+    except (TypeError, NotImplementedError):
+        return False
+    if new_out.type != node.outputs[0].type:
+        return False
+    copy_stack_trace(node.outputs[0], new_out)
+    return [new_out]
+
+
 def local_add_mul_fusion(node):
     """Fuse consecutive add or mul in one such node with more inputs.
 
@@ -6150,6 +6203,9 @@ if config.tensor.local_elemwise_fusion:
     fuse_seqopt.register('composite_elemwise_fusion',
                          FusionOptimizer(local_elemwise_fusion),
                          1, 'fast_run', 'fusion')
+    fuse_seqopt.register('local_elemwise_careduce_fusion',
+                         in2out(local_elemwise_careduce_fusion),
+                         2, 'fast_run', 'fusion')
     compile.optdb.register('elemwise_fusion',
                            fuse_seqopt, 49,
                            'fast_run', 'fusion', 'local_elemwise_fusion',
@@ -6166,8 +6222,8 @@ else:
 # # Remove consider_constant #
 # ############################
 
-# Although the ops ConsiderConstant, ZeroGrad and DisconnectedGrad
-# just returns the input, it should be removed from the graph to
+# Although the ops ConsiderConstant, ZeroGrad, DisconnectedGrad and
+# Checkpoint just returns the input, it should be removed from the graph to
 # make sure all possible optimizations can be applied.
 register_canonicalize(gof.OpRemove(theano.gradient.consider_constant_),
                       'fast_compile', 'fast_run',
@@ -6180,6 +6236,9 @@ register_canonicalize(gof.OpRemove(theano.gradient.disconnected_grad_),
                       'fast_compile', 'fast_run',
                       name='remove_disconnected_grad')
 
+register_canonicalize(gof.OpRemove(theano.gradient.checkpoint_),
+                      'fast_compile', 'fast_run', name='remove_checkpoint')
+
 
 @register_canonicalize
 @gof.local_optimizer([theano.gradient.GradClip])
@@ -41,7 +41,8 @@ from theano.tensor import (_shared, wvector, bvector, autocast_float_as,
         get_scalar_constant_value, ivector, reshape, scalar_from_tensor, scal,
         iscalars, arange, dscalars, fvector, imatrix, numeric_grad,
         opt, lvector, lmatrix, true_div, max, min, Split, roll,
-        tile, patternbroadcast, Eye, Shape, Dot, PermuteRowElements,
+        tile, patternbroadcast, Eye, Shape, Dot, BatchedDot, batched_dot,
+        PermuteRowElements,
         ScalarFromTensor, TensorFromScalar, dtensor4, Rebroadcast, Alloc,
         dtensor3, SpecifyShape, Mean,
         itensor3, Tile, switch, Diagonal, Diag,
@@ -2668,6 +2669,34 @@ def test_batched_dot():
     assert result.shape[0] == first_mat_val.shape[0]
 
 
+def test_batched_dot_op():
+    rng = numpy.random.RandomState(utt.fetch_seed())
+    x3, y3 = dtensor3('x'), dtensor3('y')
+    x2, y2 = dmatrix('x'), dmatrix('y')
+    shapes = {(3, 3): ((5, 2, 3), (5, 3, 4)),
+              (3, 2): ((5, 2, 3), (5, 3)),
+              (2, 3): ((5, 3), (5, 3, 4)),
+              (2, 2): ((5, 3), (5, 3))}
+    for x, y in [(x3, y3), (x3, y2), (x2, y3), (x2, y2)]:
+        out = batched_dot(x, y)
+        assert isinstance(out.owner.op, BatchedDot)
+        x_shp, y_shp = shapes[(x.ndim, y.ndim)]
+        x_val = rng.rand(*x_shp)
+        y_val = rng.rand(*y_shp)
+        f = function([x, y], out)
+        expected = [numpy.dot(a, b) for a, b in zip(x_val, y_val)]
+        utt.assert_allclose(f(x_val, y_val), expected)
+        utt.verify_grad(batched_dot, [x_val, y_val], rng=rng)
+
+    f = function([x3, y3], batched_dot(x3, y3))
+    assert not any(isinstance(node.op, theano.scan_module.scan_op.Scan)
+                   for node in f.maker.fgraph.toposort())
+    # The batch sizes must match
+    x_val = rng.rand(5, 2, 3)
+    y_val = rng.rand(4, 3, 4)
+    assert_raises(ValueError, f, x_val, y_val)
+
+
 def test_batched_tensordot():
     first = theano.tensor.tensor4("first")
     second = theano.tensor.tensor4("second")
@@ -7073,6 +7102,18 @@ class TestInferShape(utt.InferShapeTester):
                                 (Dot, tensor.blas.Dot22,
                                  tensor.blas.Gemv, tensor.blas_c.CGemv))
 
+        # BatchedDot
+        adtens3 = dtensor3()
+        bdtens3 = dtensor3()
+        self._compile_and_check([adtens3, bdtens3],
+                                [BatchedDot()(adtens3, bdtens3)],
+                                [rand(4, 5, 3), rand(4, 3, 2)],
+                                (BatchedDot, tensor.blas.BatchedDot22))
+        self._compile_and_check([admat, bdmat],
+                                [BatchedDot()(admat, bdmat)],
+                                [rand(4, 5), rand(4, 5)],
+                                (BatchedDot, tensor.blas.BatchedDot22))
+
         # Split
         aivec = ivector()
         adtens_val = rand(4, 10, 3)
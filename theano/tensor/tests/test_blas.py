@@ -16,12 +16,14 @@ import theano.tensor as T
 from theano import tensor, Param, shared, config
 from theano.compat import exc_message
 from theano.printing import pp
-from theano.tensor.blas import (_dot22, _dot22scalar, res_is_a, _as_scalar,
+from theano.tensor.blas import (_dot22, _dot22scalar, _batched_dot22,
+                                res_is_a, _as_scalar,
                                 _is_real_matrix, _gemm_canonicalize,
                                 _factor_canonicalized, Gemm, Gemv,
                                 gemm_inplace, gemm_no_inplace,
                                 InconsistencyError, Ger, ger, ger_destructive)
 from theano.tests import unittest_tools
+from theano.tests.unittest_tools import SkipTest
 from .test_basic import (as_tensor_variable, inplace_func,
                         compile, inplace)
 import theano.tensor.blas_scipy
@@ -858,6 +860,114 @@ def test_dot22():
             cmp((0, 0), (0, 0))
 
 
+def test_batched_dot22():
+    rng = numpy.random.RandomState(unittest_tools.fetch_seed())
+    for dtype in ['float32', 'float64']:
+        x = T.tensor3(dtype=dtype)
+        y = T.tensor3(dtype=dtype)
+        f = theano.function([x, y], T.batched_dot(x, y), mode=mode_blas_opt)
+        topo = f.maker.fgraph.toposort()
+        assert _batched_dot22 in [n.op for n in topo], dtype
+
+        def cmp(x_val, y_val):
+            # Built with its shape, which a list of products loses for an
+            # empty batch.
+            expected = numpy.zeros(x_val.shape[:2] + y_val.shape[2:],
+                                   dtype=dtype)
+            for i, (a, b) in enumerate(zip(x_val, y_val)):
+                expected[i] = numpy.dot(a, b)
+            z = f(x_val, y_val)
+            assert z.shape == expected.shape
+            unittest_tools.assert_allclose(z, expected)
+
+        def rand(*shape):
+            return rng.uniform(size=shape).astype(dtype)
+
+        cmp(rand(5, 3, 4), rand(5, 4, 2))
+        # Transposed and strided matrices
+        cmp(rand(5, 4, 3).transpose(0, 2, 1), rand(5, 2, 4).transpose(0, 2, 1))
+        cmp(rand(5, 3, 8)[:, :, ::2], rand(5, 2, 4, 2)[:, 1])
+        cmp(rand(5, 6, 4)[::-1, ::2], rand(5, 4, 4)[:, :, ::-2])
+        # Empty and degenerated shapes
+        cmp(rand(0, 3, 4), rand(0, 4, 2))
+        cmp(rand(5, 0, 4), rand(5, 4, 2))
+        cmp(rand(5, 3, 0), rand(5, 0, 2))
+        cmp(rand(5, 1, 4), rand(5, 4, 1))
+        cmp(rand(5, 3, 1), rand(5, 1, 2))
+        try:
+            f(rand(5, 3, 4), rand(4, 4, 2))
+        except ValueError:
+            pass
+        else:
+            assert False
+
+    # Matrices are the one row or one column tensor3
+    x = T.matrix()
+    y = T.tensor3()
+    f = theano.function([x, y], T.batched_dot(x, y), mode=mode_blas_opt)
+    assert _batched_dot22 in [n.op for n in f.maker.fgraph.toposort()]
+    x_val = rng.uniform(size=(5, 4)).astype(config.floatX)
+    y_val = rng.uniform(size=(5, 4, 3)).astype(config.floatX)
+    unittest_tools.assert_allclose(
+        f(x_val, y_val), [numpy.dot(a, b) for a, b in zip(x_val, y_val)])
+
+
+def test_gemm_releases_gil():
+    # Another thread runs while the C code of _dot22 is in the BLAS call.
+    import sys
+    import threading
+    import time
+    if not config.blas.ldflags or not config.cxx:
+        raise SkipTest("The C code of _dot22 needs BLAS and a C compiler")
+    x = T.matrix()
+    f = theano.function([x], _dot22(x, x),
+                        mode=compile.Mode(optimizer=None, linker='cvm'))
+    xv = numpy.random.rand(800, 800).astype(config.floatX)
+    f(xv)
+    stamps = []
+    done = []
+
+    def count():
+        while not done:
+            stamps.append(time.time())
+            time.sleep(0)
+    thread = threading.Thread(target=count)
+    thread.start()
+    try:
+        f.input_storage[0].storage[0] = xv
+        while True:
+            t0 = time.time()
+            f.fn()
+            t1 = time.time()
+            if t1 - t0 > .1:
+                break
+            xv = numpy.random.rand(*(2 * s for s in xv.shape)).astype(
+                config.floatX)
+            f.input_storage[0].storage[0] = xv
+    finally:
+        done.append(True)
+        thread.join()
+    # The other thread may take the GIL for one switch interval at the
+    # start and at the end of the call.
+    margin = 4 * sys.getswitchinterval()
+    assert any(t0 + margin < t < t1 - margin for t in stamps)
+
+
+def test_scan_batched_dot():
+    x = T.tensor3()
+    y = T.tensor3()
+    out, _ = theano.map(T.dot, sequences=[x, y])
+    f = theano.function([x, y], out)
+    topo = f.maker.fgraph.toposort()
+    assert not any(isinstance(n.op, theano.scan_module.scan_op.Scan)
+                   for n in topo)
+    rng = numpy.random.RandomState(unittest_tools.fetch_seed())
+    x_val = rng.uniform(size=(5, 3, 4)).astype(config.floatX)
+    y_val = rng.uniform(size=(5, 4, 2)).astype(config.floatX)
+    unittest_tools.assert_allclose(
+        f(x_val, y_val), [numpy.dot(a, b) for a, b in zip(x_val, y_val)])
+
+
 @attr('slow')
 def test_dot22scalar():
     # including does not seem to work for 'local_dot_to_dot22' and
@@ -540,6 +540,27 @@ class test_CAReduce(unittest_tools.InferShapeTester):
             self.with_linker(gof.CLinker(), scalar.maximum, dtype=dtype,
                              test_nan=True)
 
+    def test_c_openmp(self):
+        if not theano.config.cxx:
+            raise SkipTest("G++ not available, so we need to skip this test.")
+        # Big enough for the outer loop to be shared between threads
+        n = int(math.ceil(math.sqrt(2 * config.openmp_elemwise_minsize)))
+        x = TensorType('float64', [False, False])('x')
+        xv = numpy.random.rand(n, n)
+        for scalar_op, np_op in [(scalar.add, numpy.sum),
+                                 (scalar.maximum, numpy.max)]:
+            for axis in [None, (0,), (1,)]:
+                e = CAReduce(scalar_op, axis=axis, openmp=True)(x)
+                f = gof.CLinker().accept(
+                    FunctionGraph([x], [e])).make_function()
+                for v in [xv, xv.T, xv[::2]]:
+                    unittest_tools.assert_allclose(f(v), np_op(v, axis=axis))
+                    # The partial results of the threads are combined in
+                    # the same order at each call.
+                    r = f(v)
+                    for i in range(5):
+                        assert numpy.array_equal(f(v), r)
+
     def test_infer_shape(self, dtype=None, pre_scalar_op=None):
         if dtype is None:
             dtype = theano.config.floatX
@@ -919,6 +940,18 @@ class T_reduce_dtype(unittest.TestCase):
                           method)()
             assert numpy.allclose(s_val, ret), (s_val, ret)
 
+    def test_pairwise_sum(self):
+        # The pairwise sum accumulates float32 in float32, without losing
+        # the precision of a float64 accumulator on many values.
+        x = tensor.fmatrix('x')
+        xv = numpy.random.rand(5, 300000).astype('float32')
+        for axis in [None, 1]:
+            s = tensor.elemwise.Sum(axis=axis, pairwise=True)(x)
+            assert s.owner.op.acc_dtype == 'float32'
+            f = theano.function([x], s, mode=self.mode)
+            ret = xv.astype('float64').sum(axis=axis)
+            unittest_tools.assert_allclose(f(xv), ret, rtol=1e-5)
+
 
 class T_mean_dtype(unittest.TestCase):
     def test_mean_default_dtype(self):
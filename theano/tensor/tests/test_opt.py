@@ -1154,9 +1154,11 @@ class test_fusion(unittest.TestCase):
         mode = copy.copy(compile.mode.get_default_mode())
         # we need the optimisation enabled and the canonicalize.
         # the canonicalize is needed to merge multiplication/addition by constant.
+        # The sum of case 26 would compute its input in its loop, see
+        # test_fusion_careduce.
         mode._optimizer = mode._optimizer.including(
             'local_elemwise_fusion', 'composite_elemwise_fusion',
-            'canonicalize')
+            'canonicalize').excluding('local_elemwise_careduce_fusion')
         self.do(mode, shared, shp)
 
     @attr('slow')
@@ -1165,9 +1167,11 @@ class test_fusion(unittest.TestCase):
         mode = copy.copy(compile.mode.get_default_mode())
         # we need the optimisation enabled and the canonicalize.
         # the canonicalize is needed to merge multiplication/addition by constant.
+        # The sum of case 26 would compute its input in its loop, see
+        # test_fusion_careduce.
         mode._optimizer = mode._optimizer.including(
             'local_elemwise_fusion', 'composite_elemwise_fusion',
-            'canonicalize')
+            'canonicalize').excluding('local_elemwise_careduce_fusion')
         self.do(mode, shared, shp)
 
     def test_gpu_fusion(self):
@@ -1222,6 +1226,34 @@ class test_fusion(unittest.TestCase):
         # Test it on some dummy values
         f(*[list(range(i, 4 + i)) for i in xrange(35)])
 
+    def test_fusion_careduce(self):
+        # The elemwise feeding a reduction is computed in its loop.
+        mode = copy.copy(compile.mode.get_default_mode())
+        if theano.config.mode == "FAST_COMPILE":
+            mode = compile.mode.get_mode("FAST_RUN")
+        mode = mode.including('local_elemwise_fusion',
+                              'canonicalize').excluding('inplace')
+        x = dmatrix('x')
+        m = x.max(axis=1, keepdims=True)
+        xv = numpy.random.rand(4, 5) - 0.5
+        for out, expected in [
+                (tensor.sum(x ** 2), (xv ** 2).sum()),
+                (tensor.exp(x - m).mean(axis=1),
+                 numpy.exp(xv - xv.max(axis=1, keepdims=True)).mean(axis=1)),
+                (tensor.max(abs(x), axis=0), abs(xv).max(axis=0))]:
+            f = function([x], out, mode=mode)
+            topo = f.maker.fgraph.toposort()
+            assert any(isinstance(n.op, T.elemwise.ElemwiseReduce)
+                       for n in topo)
+            utt.assert_allclose(f(xv), expected)
+
+        # The intermediate result is also an output: it must be stored.
+        e = tensor.exp(x)
+        f = function([x], [e, e.sum(axis=0)], mode=mode)
+        topo = f.maker.fgraph.toposort()
+        assert not any(isinstance(n.op, T.elemwise.ElemwiseReduce)
+                       for n in topo)
+
     def test_pickle_big_fusion(self):
         """In the past, pickle of Composite generated in tha case
         crashed with max recusion limit. So we where not able to
@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+
+import theano
+from theano import tensor
+from theano.scan_module.scan_op import Scan
+from theano.tensor.vectorize import vectorize, NotVectorizable
+from theano.tests import unittest_tools as utt
+
+
+class test_vectorize(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(seed=utt.fetch_seed())
+        self.xs_val = self.rng.rand(5, 4)
+        self.w_val = self.rng.rand(4, 3)
+
+    def check(self, outputs, x, xs, w):
+        batched = vectorize(outputs, {x: xs})
+        f = theano.function([x, w], outputs)
+        g = theano.function([xs, w], batched)
+        results = g(self.xs_val, self.w_val)
+        for i, x_val in enumerate(self.xs_val):
+            for out, expected in zip(results, f(x_val, self.w_val)):
+                utt.assert_allclose(out[i], expected)
+        return g
+
+    def test_ops(self):
+        x = tensor.dvector('x')
+        w = tensor.dmatrix('w')
+        xs = tensor.dmatrix('xs')
+        h = tensor.tanh(tensor.dot(x, w))
+        outputs = [h,
+                   tensor.dot(w, h),
+                   h.sum(),
+                   tensor.exp(x)[1:3] * 2,
+                   x.dimshuffle('x', 0) + w.T,
+                   x.reshape((2, x.shape[0] // 2)),
+                   w.sum(axis=0)]
+        g = self.check(outputs, x, xs, w)
+        assert not any(isinstance(node.op, Scan)
+                       for node in g.maker.fgraph.toposort())
+
+    def test_fallback(self):
+        x = tensor.dvector('x')
+        w = tensor.dmatrix('w')
+        xs = tensor.dmatrix('xs')
+        out = tensor.sort(x) + w.sum()
+        g = self.check([out], x, xs, w)
+        assert any(isinstance(node.op, Scan)
+                   for node in g.maker.fgraph.toposort())
+        self.assertRaises(NotVectorizable, vectorize, out, {x: xs},
+                          fallback=False)
+
+    def test_broadcastable(self):
+        x = tensor.drow('x')
+        y = tensor.dvector('y')
+        # The batch of x has a broadcastable batch dimension
+        xs = tensor.TensorType('float64', (True, True, False))('xs')
+        ys = tensor.dmatrix('ys')
+        out = vectorize(x + y, {x: xs, y: ys})
+        assert out.broadcastable == (False, True, False)
+        f = theano.function([xs, ys], out)
+        utt.assert_allclose(f(np.ones((1, 1, 3)), np.ones((1, 3))),
+                            2 * np.ones((1, 1, 3)))
+        # It isn't broadcasted against the batch of y
+        self.assertRaises(ValueError, f, np.ones((1, 1, 3)),
+                          np.ones((4, 3)))
+        # x has only one row
+        self.assertRaises(TypeError, vectorize, x + y,
+                          {x: tensor.dtensor3('xs'), y: ys})
+
+    def test_scan_opt(self):
+        xs = tensor.dmatrix('xs')
+        w = tensor.dmatrix('w')
+        out, _ = theano.map(lambda x, w: tensor.tanh(tensor.dot(x, w)),
+                            sequences=[xs], non_sequences=[w])
+        mode = theano.compile.get_default_mode().including('scan_vectorize')
+        f = theano.function([xs, w], out, mode=mode)
+        assert not any(isinstance(node.op, Scan)
+                       for node in f.maker.fgraph.toposort())
+        utt.assert_allclose(f(self.xs_val, self.w_val),
+                            np.tanh(np.dot(self.xs_val, self.w_val)))
@@ -0,0 +1,248 @@
+"""
+Automatic vectorization of graphs.
+
+`vectorize` takes outputs computed for one example and returns the outputs
+computed for a batch of examples, stacked along a new leading axis. Each
+node that depends on the batch is replaced by its batched version, as
+defined by the rules registered with `register_vectorize`. The nodes
+without a rule are computed by a scan over the examples.
+
+"""
+from __future__ import print_function
+import copy
+
+from six.moves import xrange
+
+import theano
+from theano import gof
+from theano.compat import OrderedDict
+from theano.compile.ops import Shape, Shape_i
+from theano.tensor import basic as T
+from theano.tensor.elemwise import Elemwise, DimShuffle, CAReduce
+from theano.tensor.subtensor import Subtensor
+
+
+class NotVectorizable(Exception):
+    """
+    Raised by `vectorize` when a node has no batched version and the
+    fallback on scan is disabled.
+
+    """
+
+
+# Op class -> rule
+_rules = OrderedDict()
+
+
+def register_vectorize(*op_classes):
+    """
+    Register a function that computes the batched version of the nodes of
+    the given Op classes (and their subclasses).
+
+    The rule is called as ``rule(node, inputs, batched)``, where `inputs`
+    are the new inputs of the node and `batched[i]` tells if `inputs[i]`
+    has the leading batch axis. It returns a list of pairs (new output,
+    is batched) for the outputs of the node, or None if it can't batch
+    this node.
+
+    """
+    def register(rule):
+        for op_class in op_classes:
+            _rules[op_class] = rule
+        return rule
+    return register
+
+
+def _get_rule(op):
+    for op_class in type(op).__mro__:
+        if op_class in _rules:
+            return _rules[op_class]
+    return None
+
+
+@register_vectorize(Elemwise)
+def _vectorize_elemwise(node, inputs, batched):
+    op = node.op
+    if op.inplace_pattern:
+        op = Elemwise(op.scalar_op)
+    inputs = [x if b else T.shape_padleft(x)
+              for x, b in zip(inputs, batched)]
+    return [(out, True) for out in op(*inputs, return_list=True)]
+
+
+@register_vectorize(DimShuffle)
+def _vectorize_dimshuffle(node, inputs, batched):
+    x, = inputs
+    order = [0] + [o if o == 'x' else o + 1 for o in node.op.new_order]
+    return [(x.dimshuffle(*order), True)]
+
+
+@register_vectorize(CAReduce)
+def _vectorize_careduce(node, inputs, batched):
+    x, = inputs
+    axis = node.op.axis
+    if axis is None:
+        axis = xrange(node.inputs[0].ndim)
+    op = copy.copy(node.op)
+    op.axis = tuple(a + 1 for a in axis)
+    return [(op(x), True)]
+
+
+@register_vectorize(T.Dot)
+def _vectorize_dot(node, inputs, batched):
+    x, y = inputs
+    bx, by = batched
+    if bx and by:
+        return [(T.batched_dot(x, y), True)]
+    if bx:
+        out = T.tensordot(x, y, [[x.ndim - 1], [0]])
+    else:
+        # The batch axis of y is the first one after the axes of x.
+        out = T.tensordot(x, y, [[x.ndim - 1], [1]])
+        n = x.ndim - 1
+        out = out.dimshuffle([n] + list(range(n)) +
+                             list(range(n + 1, out.ndim)))
+    return [(out, True)]
+
+
+@register_vectorize(Subtensor)
+def _vectorize_subtensor(node, inputs, batched):
+    if not batched[0] or any(batched[1:]):
+        return None
+    op = Subtensor([slice(None)] + list(node.op.idx_list))
+    return [(op(*inputs), True)]
+
+
+@register_vectorize(Shape)
+def _vectorize_shape(node, inputs, batched):
+    x, = inputs
+    # All the examples have the same shape.
+    return [(x.shape[1:], False)]
+
+
+@register_vectorize(Shape_i)
+def _vectorize_shape_i(node, inputs, batched):
+    x, = inputs
+    return [(Shape_i(node.op.i + 1)(x), False)]
+
+
+@register_vectorize(T.Reshape)
+def _vectorize_reshape(node, inputs, batched):
+    x, shp = inputs
+    if not batched[0] or batched[1]:
+        return None
+    shp = T.join(0, x.shape[:1], shp)
+    return [(T.reshape(x, shp, ndim=node.op.ndim + 1), True)]
+
+
+def _vectorize_with_scan(node, inputs, batched):
+    seqs = [x for x, b in zip(inputs, batched) if b]
+    non_seqs = [x for x, b in zip(inputs, batched) if not b]
+
+    def step(*args):
+        seq_args = iter(args[:len(seqs)])
+        non_seq_args = iter(args[len(seqs):])
+        return node.op(*[next(seq_args) if b else next(non_seq_args)
+                         for b in batched], return_list=True)
+
+    outs, updates = theano.map(step, sequences=seqs,
+                               non_sequences=non_seqs)
+    if updates:
+        raise NotVectorizable("%s needs updates to be computed by scan"
+                              % node)
+    if not isinstance(outs, (list, tuple)):
+        outs = [outs]
+    return [(out, True) for out in outs]
+
+
+def vectorize(outputs, replace, fallback=True):
+    """
+    Return the batched version of `outputs`.
+
+    Parameters
+    ----------
+    outputs
+        A variable or a list of variables, computed for one example.
+    replace
+        A dictionary (or list of pairs) that maps the variables of one
+        example to the variables of the batch, which have one more leading
+        dimension. The other inputs of the graph are shared by all the
+        examples.
+    fallback
+        If True, the nodes that can't be batched are computed by a scan
+        over the examples. If False, NotVectorizable is raised instead.
+
+    Returns
+    -------
+    The variable or list of variables with the outputs of all the
+    examples, stacked along a new leading axis.
+
+    Examples
+    --------
+    >>> x = tensor.vector('x')
+    >>> w = tensor.matrix('w')
+    >>> xs = tensor.matrix('xs')
+    >>> ys = vectorize(tensor.tanh(tensor.dot(x, w)), {x: xs})
+
+    """
+    return_list = isinstance(outputs, (list, tuple))
+    if not return_list:
+        outputs = [outputs]
+    replace = OrderedDict(replace)
+    if not replace:
+        raise ValueError("vectorize needs at least one batched input")
+    new = {}
+    for var, batch in replace.items():
+        batch = T.as_tensor_variable(batch)
+        if batch.ndim != var.ndim + 1:
+            raise TypeError("The batch of %s must have %d dimensions, got"
+                            " %d" % (var, var.ndim + 1, batch.ndim))
+        if any(b and not batch_b for b, batch_b in
+               zip(var.broadcastable, batch.broadcastable[1:])):
+            raise TypeError("The batch of %s must be broadcastable in the"
+                            " same dimensions, got %s for %s" %
+                            (var, batch.broadcastable, var.broadcastable))
+        # The examples must not be broadcasted against each other, and
+        # each of them has the type of `var`.
+        batch = T.patternbroadcast(batch, (False,) + var.broadcastable)
+        new[var] = (batch, True)
+    batch_size = T.as_tensor_variable(
+        list(replace.values())[0]).shape[0]
+
+    for node in gof.graph.io_toposort(list(replace), outputs):
+        inputs = []
+        batched = []
+        for var in node.inputs:
+            new_var, b = new.get(var, (var, False))
+            inputs.append(new_var)
+            batched.append(b)
+        if not any(batched):
+            if all(x is y for x, y in zip(inputs, node.inputs)):
+                new_outs = node.outputs
+            else:
+                new_outs = node.op(*inputs, return_list=True)
+            for out, new_out in zip(node.outputs, new_outs):
+                new[out] = (new_out, False)
+            continue
+
+        rule = _get_rule(node.op)
+        new_outs = rule(node, inputs, batched) if rule else None
+        if new_outs is None:
+            if not fallback:
+                raise NotVectorizable("No batched version of %s" % node)
+            new_outs = _vectorize_with_scan(node, inputs, batched)
+        for out, new_out in zip(node.outputs, new_outs):
+            new[out] = new_out
+
+    rval = []
+    for out in outputs:
+        new_out, b = new.get(out, (out, False))
+        if not b:
+            # The same for all the examples.
+            new_out = T.alloc(new_out, batch_size,
+                              *[new_out.shape[i]
+                                for i in xrange(new_out.ndim)])
+        rval.append(new_out)
+    if return_list:
+        return rval
+    return rval[0]
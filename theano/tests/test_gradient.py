@@ -787,5 +787,112 @@ def test_grad_clip():
     assert np.allclose(out, (1, 4))
     assert not np.allclose(out[0], out[1])
 
+
+class TestRematerialize(unittest.TestCase):
+
+    def setUp(self):
+        utt.seed_rng()
+        self.rng = np.random.RandomState(seed=utt.fetch_seed())
+        T = theano.tensor
+        self.x = T.matrix('x')
+        self.ws = [theano.shared(np.asarray(self.rng.randn(5, 5),
+                                            dtype=config.floatX))
+                   for i in range(6)]
+        self.a = np.asarray(self.rng.randn(3, 5), dtype=config.floatX)
+
+    def mlp(self, marked=()):
+        h = self.x
+        hs = []
+        for i, w in enumerate(self.ws):
+            h = theano.tensor.tanh(h.dot(w))
+            if i in marked:
+                h = gradient.checkpoint(h)
+            hs.append(h)
+        return h.sum(), hs
+
+    def check(self, cost, **kwargs):
+        ref_cost, _ = self.mlp()
+        g = gradient.grad(cost, self.ws, **kwargs)
+        g_ref = gradient.grad(ref_cost, self.ws)
+        f = theano.function([self.x], g)
+        f_ref = theano.function([self.x], g_ref)
+        for v, v_ref in zip(f(self.a), f_ref(self.a)):
+            utt.assert_allclose(v, v_ref)
+        return f
+
+    def test_op_removed(self):
+        y = gradient.checkpoint(self.x) * 2
+        f = theano.function([self.x], y)
+        assert gradient.checkpoint_ not in \
+            [node.op for node in f.maker.fgraph.toposort()]
+
+    def test_marked(self):
+        cost, hs = self.mlp(marked=[1, 3])
+        f = self.check(cost)
+        assert any(isinstance(node.op, gradient.Recompute)
+                   for node in f.maker.fgraph.toposort())
+
+        # Without checkpoints nothing is recomputed.
+        f = self.check(self.mlp()[0])
+        assert not any(isinstance(node.op, gradient.Recompute)
+                       for node in f.maker.fgraph.toposort())
+        f = self.check(cost, rematerialize=False)
+        assert not any(isinstance(node.op, gradient.Recompute)
+                       for node in f.maker.fgraph.toposort())
+
+    def test_gradient_graph(self):
+        cost, hs = self.mlp(marked=[1, 3])
+        forward = set(gof.graph.io_toposort([self.x] + self.ws, [cost]))
+
+        def backward_nodes(**kwargs):
+            g = gradient.grad(cost, self.ws, **kwargs)
+            return [node for node in gof.graph.io_toposort(
+                [self.x] + self.ws, g) if node not in forward]
+
+        def used_intermediates(nodes):
+            return set(i for node in nodes for i in node.inputs
+                       if i.owner in forward)
+
+        # The backward pass only reads the checkpoints of the forward pass.
+        nodes = backward_nodes()
+        assert used_intermediates(nodes) <= set([hs[1], hs[3], cost])
+        # It computes the dot products and the tanh again from them.
+        recomputed = set(node.outputs[0] for node in nodes
+                         if isinstance(node.op, gradient.Recompute))
+        assert recomputed
+        recomputed_ops = set()
+        for node in nodes:
+            if any(i in recomputed for i in node.inputs):
+                recomputed.update(node.outputs)
+                recomputed_ops.add(type(node.op))
+        assert theano.tensor.basic.Dot in recomputed_ops
+        assert theano.tensor.Elemwise in recomputed_ops
+
+        # Without rematerialization, it reads the other intermediates.
+        nodes = backward_nodes(rematerialize=False)
+        assert not any(isinstance(node.op, gradient.Recompute)
+                       for node in nodes)
+        assert used_intermediates(nodes) - set([hs[1], hs[3], cost])
+
+    def test_recomputed_inputs(self):
+        cost, hs = self.mlp()
+        g = gradient.grad(cost, self.ws, rematerialize=[hs[2]])
+        recompute_nodes = [node for node in gof.graph.io_toposort(
+            [self.x] + self.ws, g) if isinstance(node.op, gradient.Recompute)]
+        # The recomputation starts from the checkpoint and the inputs.
+        assert recompute_nodes
+        assert set(node.inputs[0] for node in recompute_nodes) <= \
+            set([self.x, hs[2]] + self.ws)
+        self.check(cost, rematerialize=[hs[2]])
+
+    def test_budget(self):
+        cost, hs = self.mlp()
+        sizes = dict((h.owner.inputs[0], 60) for h in hs)
+        sizes.update((h, 60) for h in hs)
+        checkpoints = gradient.plan_checkpoints(cost, 200, sizes)
+        assert checkpoints
+        assert all(c in hs for c in checkpoints[:-1])
+        self.check(cost, rematerialize=200)
+
 if __name__ == '__main__':
     unittest.main()